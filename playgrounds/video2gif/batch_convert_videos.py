@@ -1,40 +1,150 @@
 #!/usr/bin/env python3
+import argparse
+import io
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stderr, redirect_stdout
 from pathlib import Path
-from video_to_gif import convert_video_to_gif
+from video_to_gif import convert_video_to_gif, gif_output_path
 
-def batch_convert_videos(videos_dir):
+def is_up_to_date(video_file):
+    """Check whether the video's GIF exists and is newer than the video"""
+    output_path = gif_output_path(video_file)
+    return output_path.exists() and output_path.stat().st_mtime >= video_file.stat().st_mtime
+
+def convert_one(video_file):
+    """
+    Convert one video in a worker process, reporting failure instead of exiting
+
+    convert_video_to_gif prints its progress and calls sys.exit(1) on any
+    error, so its output is captured and SystemExit is caught here.
+
+    Returns:
+        (error message or None, seconds taken)
+    """
+    start = time.time()
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output), redirect_stderr(output):
+            convert_video_to_gif(video_file)
+        return None, time.time() - start
+    except (Exception, SystemExit) as e:
+        # A half-written GIF would look up to date on the next run
+        gif_output_path(video_file).unlink(missing_ok=True)
+        errors = [line for line in output.getvalue().splitlines() if line.startswith("Error")]
+        if errors:
+            message = errors[-1]
+        elif isinstance(e, SystemExit):
+            message = f"conversion exited with code {e.code}"
+        else:
+            message = str(e)
+        return message, time.time() - start
+
+def _convert_in_pool(video_files, jobs, report):
+    """
+    Convert videos in a new process pool, calling report(video_file, error, seconds) for each
+
+    Returns:
+        The videos left unfinished because a worker process died and broke the pool
+    """
+    unfinished = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(convert_one, video_file): video_file for video_file in video_files}
+        for future in as_completed(futures):
+            video_file = futures[future]
+            try:
+                error, seconds = future.result()
+            except BrokenProcessPool:
+                unfinished.append(video_file)
+                continue
+            except Exception as e:
+                error, seconds = str(e) or type(e).__name__, 0.0
+            report(video_file, error, seconds)
+    # Keep the input order for the retry
+    return [video_file for video_file in video_files if video_file in unfinished]
+
+def batch_convert_videos(videos_dir, jobs=None, force=False):
     """
-    Batch convert all video files in the specified directory to GIF
-    
+    Batch convert all video files in the specified directory to GIF, several at a time
+
     Args:
         videos_dir: Directory containing video files
+        jobs: Number of conversions run in parallel (default: one per CPU core)
+        force: Convert videos even when their GIF is newer than the video
+
+    Returns:
+        Dict mapping the name of each video that failed to its error
     """
     videos_path = Path(videos_dir)
     if not videos_path.exists():
         print(f"Error: Directory {videos_dir} does not exist", file=sys.stderr)
         sys.exit(1)
-        
-    video_files = list(videos_path.glob("*.mp4"))
+
+    video_files = sorted(videos_path.glob("*.mp4"))
     if not video_files:
         print(f"Warning: No MP4 files found in {videos_dir}", file=sys.stderr)
         sys.exit(1)
-        
-    print(f"Found {len(video_files)} video files, starting conversion...")
-    
-    for video_file in video_files:
-        try:
-            convert_video_to_gif(video_file)
-        except Exception as e:
-            print(f"Error converting {video_file.name}: {str(e)}", file=sys.stderr)
-            continue
-            
-    print("All video conversions completed!")
+
+    pending = [f for f in video_files if force or not is_up_to_date(f)]
+    skipped = len(video_files) - len(pending)
+    jobs = jobs or os.cpu_count() or 1
+    print(f"Found {len(video_files)} video files, {skipped} already converted, "
+          f"converting {len(pending)} with {jobs} jobs...")
+
+    failures = {}
+    done = done_bytes = 0
+    start = time.time()
+
+    def report(video_file, error, seconds):
+        nonlocal done, done_bytes
+        done += 1
+        elapsed = max(time.time() - start, 1e-6)
+        if error is None:
+            done_bytes += video_file.stat().st_size
+            status = f"done in {seconds:.1f}s"
+        else:
+            # A worker killed mid-write leaves a partial GIF that would look up to date next time
+            gif_output_path(video_file).unlink(missing_ok=True)
+            failures[video_file.name] = error
+            status = f"FAILED: {error}"
+        print(f"[{done}/{len(pending)}] {video_file.name}: {status} "
+              f"({done / elapsed * 60:.1f} videos/min, {done_bytes / elapsed / (1024*1024):.2f} MB/s)",
+              flush=True)
+
+    # A worker that dies, e.g. killed for memory, breaks the whole pool and fails every
+    # unfinished conversion with it, so those run again in a new pool. If that pool
+    # breaks too, the rest run one at a time, so a death pins down the video causing it.
+    unfinished = _convert_in_pool(pending, jobs, report)
+    if unfinished:
+        print(f"A worker process died, restarting the pool for {len(unfinished)} videos", file=sys.stderr)
+        unfinished = _convert_in_pool(unfinished, jobs, report)
+    if unfinished:
+        print(f"A worker process died again, converting the last {len(unfinished)} videos one at a time",
+              file=sys.stderr)
+        for video_file in unfinished:
+            if _convert_in_pool([video_file], 1, report):
+                report(video_file, "worker process died", 0.0)
+
+    elapsed = time.time() - start
+    converted = len(pending) - len(failures)
+    print(f"Converted {converted}, skipped {skipped}, failed {len(failures)} in {elapsed:.1f}s")
+    for name, error in failures.items():
+        print(f"Error converting {name}: {error}", file=sys.stderr)
+    if not failures:
+        print("All video conversions completed!")
+    return failures
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python batch_convert_videos.py <videos_directory_path>", file=sys.stderr)
+    parser = argparse.ArgumentParser(description="Convert every MP4 in a directory to GIF")
+    parser.add_argument("videos_dir", help="Directory containing the MP4 files")
+    parser.add_argument("--jobs", "-j", type=int, default=None,
+                        help="Number of conversions run in parallel (default: one per CPU core)")
+    parser.add_argument("--force", action="store_true",
+                        help="Convert videos even when their GIF is already newer than the video")
+    args = parser.parse_args()
+
+    if batch_convert_videos(args.videos_dir, args.jobs, args.force):
         sys.exit(1)
-        
-    videos_dir = sys.argv[1]
-    batch_convert_videos(videos_dir) 
\ No newline at end of file
@@ -3,6 +3,11 @@ import sys
 from pathlib import Path
 from moviepy.editor import VideoFileClip
 
+def gif_output_path(video_path, target_width=320, target_height=172):
+    """Return where convert_video_to_gif writes the GIF of a video: a gifs folder next to the video's folder."""
+    video_path = Path(video_path)
+    return video_path.parent.parent / "gifs" / f"{video_path.stem}-{target_width}x{target_height}.gif"
+
 def convert_video_to_gif(video_path, target_width=320, target_height=172, offset_y=0):
     """
     Convert video to GIF, maintaining horizontal width and center-cropping vertically
@@ -15,8 +20,7 @@ def convert_video_to_gif(video_path, target_width=320, target_height=172, offset
     """
     # Build output file path
     video_path = Path(video_path)
-    output_filename = f"{video_path.stem}-{target_width}x{target_height}.gif"
-    output_path = video_path.parent.parent / "gifs" / output_filename
+    output_path = gif_output_path(video_path, target_width, target_height)
     
     print(f"Processing video: {video_path}")
     print(f"Output GIF will be saved to: {output_path}")
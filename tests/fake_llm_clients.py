@@ -0,0 +1,46 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+class APIError(Exception):
+    """An SDK error carrying an HTTP status and response headers, like the provider SDKs raise."""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": headers or {}})()
+
+def openai_response(content):
+    response = MagicMock()
+    response.choices = [MagicMock(message=MagicMock(content=content))]
+    response.usage.prompt_tokens = 12
+    response.usage.completion_tokens = 5
+    response.usage.prompt_tokens_details.cached_tokens = 8
+    return response
+
+def make_openai_client(*contents):
+    """
+    Return a mock OpenAI client whose chat completions answer with ``contents``.
+
+    A single content is the answer to every request; several are returned
+    one per request, in order.
+    """
+    client = MagicMock()
+    if len(contents) > 1:
+        client.chat.completions.create.side_effect = [openai_response(content) for content in contents]
+    else:
+        client.chat.completions.create.return_value = openai_response(*contents or ("Test OpenAI response",))
+    return client
+
+def make_async_openai_client():
+    """Return a mock AsyncOpenAI client answering "Answer to <prompt>"; the prompt "fail" raises."""
+    client = MagicMock()
+
+    async def create(model, messages, **kwargs):
+        prompt = messages[0]["content"][0]["text"]
+        if prompt == "fail":
+            raise Exception("Test error")
+        await asyncio.sleep(0.01)
+        return openai_response(f"Answer to {prompt}")
+
+    client.chat.completions.create = AsyncMock(side_effect=create)
+    return client
@@ -0,0 +1,195 @@
+import email.parser
+import email.policy
+import itertools
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def answer(text):
+    """The fake's reply to a prompt; prompts containing "fail" are rejected."""
+    return None if "fail" in text else f"Answer to {text}"
+
+def last_text(messages):
+    content = messages[-1]["content"]
+    if isinstance(content, str):
+        return content
+    return [part["text"] for part in content if part["type"] == "text"][-1]
+
+class FakeLLMServer:
+    """
+    Local HTTP server speaking enough of the OpenAI and Anthropic APIs for the SDKs.
+
+    Serves chat completions and messages, plus both batch APIs. A batch
+    reports itself in progress on the first ``polls_until_done`` status
+    checks and done afterwards.
+
+    Usage:
+        with FakeLLMServer() as server:
+            client = OpenAI(api_key="test", base_url=f"{server.url}/v1")
+    """
+
+    def __init__(self, polls_until_done=1):
+        self.polls_until_done = polls_until_done
+        self.files = {}
+        self.batches = {}
+        self.requests = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def new_id(self, prefix):
+        with self._lock:
+            return f"{prefix}_{next(self._ids)}"
+
+    def count(self, method, path):
+        return sum(1 for request in self.requests if request == (method, path))
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.requests.append(("GET", self.path))
+                self.route("GET", self.path.split("?")[0], None)
+
+            def do_POST(self):
+                server.requests.append(("POST", self.path))
+                length = int(self.headers.get("Content-Length", 0))
+                self.route("POST", self.path.split("?")[0], self.rfile.read(length))
+
+            def reply(self, status, body, content_type="application/json"):
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def route(self, method, path, body):
+                parts = path.strip("/").split("/")
+                if method == "POST" and path == "/v1/chat/completions":
+                    return self.chat_completion(json.loads(body))
+                if method == "POST" and path == "/v1/files":
+                    return self.upload(body)
+                if method == "GET" and parts[:2] == ["v1", "files"] and parts[-1] == "content":
+                    return self.reply(200, server.files[parts[2]], "application/octet-stream")
+                if method == "POST" and path == "/v1/batches":
+                    return self.create_openai_batch(json.loads(body))
+                if method == "GET" and parts[:2] == ["v1", "batches"]:
+                    return self.reply(200, server.poll(parts[2]))
+                if method == "POST" and path == "/v1/messages":
+                    return self.message(json.loads(body))
+                if method == "POST" and path == "/v1/messages/batches":
+                    return self.create_anthropic_batch(json.loads(body))
+                if method == "GET" and parts[:3] == ["v1", "messages", "batches"] and parts[-1] == "results":
+                    return self.reply(200, server.files[server.batches[parts[3]]["results"]], "application/x-jsonl")
+                if method == "GET" and parts[:3] == ["v1", "messages", "batches"]:
+                    return self.reply(200, server.poll(parts[3]))
+                self.reply(404, {"error": {"message": f"No route for {method} {path}"}})
+
+            def chat_completion(self, request):
+                text = answer(last_text(request["messages"]))
+                if text is None:
+                    return self.reply(400, {"error": {"message": "rejected", "type": "invalid_request_error"}})
+                self.reply(200, openai_completion(request, text))
+
+            def message(self, request):
+                text = answer(last_text(request["messages"]))
+                if text is None:
+                    return self.reply(400, {"type": "error",
+                                            "error": {"type": "invalid_request_error", "message": "rejected"}})
+                self.reply(200, anthropic_message(request, text))
+
+            def upload(self, body):
+                message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+                content = next(part.get_payload(decode=True) for part in message.iter_parts()
+                               if part.get_param("name", header="content-disposition") == "file")
+                file_id = server.new_id("file")
+                server.files[file_id] = content
+                self.reply(200, {"id": file_id, "object": "file", "bytes": len(content), "created_at": 0,
+                                 "filename": "batch.jsonl", "purpose": "batch", "status": "processed"})
+
+            def create_openai_batch(self, request):
+                lines = [json.loads(line) for line in server.files[request["input_file_id"]].splitlines()]
+                output, errors = [], []
+                for line in lines:
+                    text = answer(last_text(line["body"]["messages"]))
+                    if text is None:
+                        errors.append({"id": server.new_id("req"), "custom_id": line["custom_id"],
+                                       "response": {"status_code": 400, "body": {"error": {"message": "rejected"}}},
+                                       "error": None})
+                    else:
+                        output.append({"id": server.new_id("req"), "custom_id": line["custom_id"],
+                                       "response": {"status_code": 200, "body": openai_completion(line["body"], text)},
+                                       "error": None})
+                batch_id = server.new_id("batch")
+                batch = {"id": batch_id, "object": "batch", "endpoint": request["endpoint"],
+                         "input_file_id": request["input_file_id"], "completion_window": "24h",
+                         "status": "in_progress", "created_at": 0, "output_file_id": None, "error_file_id": None}
+                server.batches[batch_id] = {"object": batch, "polls": 0, "kind": "openai",
+                                            "output": server.store(output), "errors": server.store(errors)}
+                self.reply(200, batch)
+
+            def create_anthropic_batch(self, request):
+                results = []
+                for entry in request["requests"]:
+                    text = answer(last_text(entry["params"]["messages"]))
+                    if text is None:
+                        result = {"type": "errored", "error": {"type": "error", "error": {
+                            "type": "invalid_request_error", "message": "rejected"}}}
+                    else:
+                        result = {"type": "succeeded", "message": anthropic_message(entry["params"], text)}
+                    results.append({"custom_id": entry["custom_id"], "result": result})
+                batch_id = server.new_id("msgbatch")
+                batch = {"id": batch_id, "type": "message_batch", "processing_status": "in_progress",
+                         "request_counts": {"processing": len(results), "succeeded": 0, "errored": 0,
+                                            "canceled": 0, "expired": 0},
+                         "created_at": "2024-01-01T00:00:00Z", "expires_at": "2024-01-02T00:00:00Z",
+                         "results_url": None}
+                server.batches[batch_id] = {"object": batch, "polls": 0, "kind": "anthropic",
+                                            "results": server.store(results)}
+                self.reply(200, batch)
+
+        return Handler
+
+    def store(self, entries):
+        file_id = self.new_id("file")
+        self.files[file_id] = "".join(json.dumps(entry) + "\n" for entry in entries).encode()
+        return file_id
+
+    def poll(self, batch_id):
+        batch = self.batches[batch_id]
+        batch["polls"] += 1
+        if batch["polls"] > self.polls_until_done:
+            state = batch["object"]
+            if batch["kind"] == "openai":
+                state.update(status="completed", output_file_id=batch["output"], error_file_id=batch["errors"])
+            else:
+                state.update(processing_status="ended",
+                             results_url=f"{self.url}/v1/messages/batches/{batch_id}/results")
+        return batch["object"]
+
+def openai_completion(request, text):
+    return {"id": "chatcmpl-fake", "object": "chat.completion", "created": 0, "model": request["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}}
+
+def anthropic_message(request, text):
+    return {"id": "msg_fake", "type": "message", "role": "assistant", "model": request["model"],
+            "content": [{"type": "text", "text": text}], "stop_reason": "end_turn", "stop_sequence": None,
+            "usage": {"input_tokens": 10, "output_tokens": 5}}
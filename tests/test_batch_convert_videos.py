@@ -0,0 +1,207 @@
+import importlib
+import importlib.util
+import os
+import runpy
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+SCRIPT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'playgrounds', 'video2gif')
+_patchers = []
+
+def setUpModule():
+    global video_to_gif, convert_all, convert_one, is_up_to_date
+    # The scripts import each other from their own directory. moviepy is only needed for
+    # the real conversion, which every test stubs out. Both are undone after the module,
+    # which also drops the imported scripts from sys.modules again.
+    stubs = {} if importlib.util.find_spec('moviepy') else {'moviepy': MagicMock(), 'moviepy.editor': MagicMock()}
+    _patchers.extend([patch.object(sys, 'path', [SCRIPT_DIR, *sys.path]), patch.dict(sys.modules, stubs)])
+    for patcher in _patchers:
+        patcher.start()
+    video_to_gif = importlib.import_module('video_to_gif')
+    batch_convert_videos = importlib.import_module('batch_convert_videos')
+    convert_all = batch_convert_videos.batch_convert_videos
+    convert_one = batch_convert_videos.convert_one
+    is_up_to_date = batch_convert_videos.is_up_to_date
+
+def tearDownModule():
+    while _patchers:
+        _patchers.pop().stop()
+
+def write_gif(video_file):
+    output_path = video_to_gif.gif_output_path(video_file)
+    output_path.parent.mkdir(exist_ok=True)
+    output_path.write_bytes(b"GIF89a")
+    return output_path
+
+def failing_conversion(video_file):
+    # Like convert_video_to_gif: report the error, leave a partial GIF and exit
+    print(f"Processing video: {video_file}")
+    write_gif(video_file)
+    print("Error: cannot decode video")
+    sys.exit(1)
+
+class ConversionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.videos_dir = Path(self.tmp.name) / "videos"
+        self.videos_dir.mkdir()
+
+    def write_video(self, name):
+        video_file = self.videos_dir / name
+        video_file.write_bytes(b"\0" * 1024)
+        return video_file
+
+class TestConvertOne(ConversionTestCase):
+    def test_is_up_to_date(self):
+        video_file = self.write_video("a.mp4")
+        self.assertFalse(is_up_to_date(video_file))
+        output_path = write_gif(video_file)
+        self.assertTrue(is_up_to_date(video_file))
+        os.utime(video_file, (output_path.stat().st_mtime + 10,) * 2)
+        self.assertFalse(is_up_to_date(video_file))
+
+    def test_success(self):
+        video_file = self.write_video("a.mp4")
+        stdout = StringIO()
+        with patch('batch_convert_videos.convert_video_to_gif', side_effect=print) as convert, \
+                redirect_stdout(stdout):
+            error, seconds = convert_one(video_file)
+        self.assertIsNone(error)
+        self.assertGreaterEqual(seconds, 0)
+        convert.assert_called_once_with(video_file)
+        self.assertEqual(stdout.getvalue(), "")
+
+    def test_exit_reported_as_error(self):
+        video_file = self.write_video("a.mp4")
+        stdout = StringIO()
+        with patch('batch_convert_videos.convert_video_to_gif', side_effect=failing_conversion), \
+                redirect_stdout(stdout):
+            error, _ = convert_one(video_file)
+        self.assertEqual(error, "Error: cannot decode video")
+        self.assertEqual(stdout.getvalue(), "")
+        # The partial GIF must not count as converted next time
+        self.assertFalse(video_to_gif.gif_output_path(video_file).exists())
+
+    def test_error_without_message(self):
+        video_file = self.write_video("a.mp4")
+        with patch('batch_convert_videos.convert_video_to_gif', side_effect=SystemExit(2)):
+            self.assertEqual(convert_one(video_file)[0], "conversion exited with code 2")
+        with patch('batch_convert_videos.convert_video_to_gif', side_effect=ValueError("bad size")):
+            self.assertEqual(convert_one(video_file)[0], "bad size")
+
+class TestBatchConvert(ConversionTestCase):
+    def setUp(self):
+        super().setUp()
+        # Worker threads instead of processes, so the stubbed conversion is used
+        self.executor = MagicMock(side_effect=lambda max_workers: ThreadPoolExecutor(1))
+        patcher = patch('batch_convert_videos.ProcessPoolExecutor', self.executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_batch(self, convert, **kwargs):
+        output = StringIO()
+        with patch('batch_convert_videos.convert_video_to_gif', side_effect=convert) as mock_convert, \
+                redirect_stdout(output), redirect_stderr(output):
+            failures = convert_all(self.videos_dir, **kwargs)
+        return failures, mock_convert, output.getvalue()
+
+    def test_skips_converted_videos(self):
+        write_gif(self.write_video("a.mp4"))
+        fresh = self.write_video("b.mp4")
+        failures, convert, output = self.run_batch(write_gif, jobs=3)
+        self.assertEqual(failures, {})
+        convert.assert_called_once_with(fresh)
+        self.executor.assert_called_once_with(max_workers=3)
+        self.assertIn("Found 2 video files, 1 already converted, converting 1 with 3 jobs", output)
+        self.assertIn("All video conversions completed!", output)
+
+    def test_force_converts_everything(self):
+        write_gif(self.write_video("a.mp4"))
+        self.write_video("b.mp4")
+        with patch('os.cpu_count', return_value=5):
+            _, convert, _ = self.run_batch(write_gif, force=True)
+        self.assertEqual(convert.call_count, 2)
+        self.executor.assert_called_once_with(max_workers=5)
+
+    def test_failures_collected(self):
+        self.write_video("bad.mp4")
+        good = self.write_video("good.mp4")
+        convert = lambda video_file: failing_conversion(video_file) if video_file.name == "bad.mp4" else None
+        failures, _, output = self.run_batch(convert)
+        self.assertEqual(failures, {"bad.mp4": "Error: cannot decode video"})
+        self.assertIn("Converted 1, skipped 0, failed 1", output)
+        self.assertIn("Error converting bad.mp4: Error: cannot decode video", output)
+        self.assertIn(f"{good.name}: done", output)
+
+    def test_dead_worker_counted_as_failure(self):
+        self.write_video("a.mp4")
+        with patch('batch_convert_videos.convert_one', side_effect=MemoryError):
+            failures, _, _ = self.run_batch(None)
+        self.assertEqual(failures, {"a.mp4": "MemoryError"})
+
+    def test_broken_pool_restarted(self):
+        killer = self.write_video("killer.mp4")
+        bystander = self.write_video("bystander.mp4")
+        calls = []
+
+        def convert(video_file):
+            calls.append(video_file.name)
+            # A killed worker leaves its partial GIF behind
+            write_gif(video_file)
+            if video_file == killer or calls.count(video_file.name) == 1:
+                raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+            return None, 0.1
+
+        with patch('batch_convert_videos.convert_one', side_effect=convert):
+            failures, _, output = self.run_batch(None, jobs=2)
+        self.assertEqual(failures, {"killer.mp4": "worker process died"})
+        # Once in the first pool, once in the restarted pool and then on its own
+        self.assertEqual(calls.count("killer.mp4"), 3)
+        self.assertEqual(calls.count("bystander.mp4"), 2)
+        self.assertEqual([call.kwargs['max_workers'] for call in self.executor.call_args_list], [2, 2, 1])
+        self.assertIn("restarting the pool for 2 videos", output)
+        self.assertFalse(video_to_gif.gif_output_path(killer).exists())
+        self.assertTrue(is_up_to_date(bystander))
+
+    def test_missing_or_empty_directory(self):
+        for videos_dir in (self.videos_dir / "missing", self.videos_dir):
+            with self.assertRaises(SystemExit), redirect_stderr(StringIO()):
+                convert_all(videos_dir)
+
+class TestCommandLine(ConversionTestCase):
+    def run_script(self, *args):
+        output = StringIO()
+        argv = ['batch_convert_videos.py', str(self.videos_dir), *args]
+        with patch.object(sys, 'argv', argv), redirect_stdout(output), redirect_stderr(output), \
+                patch('concurrent.futures.ProcessPoolExecutor',
+                      side_effect=lambda max_workers: ThreadPoolExecutor(1)) as executor:
+            runpy.run_path(os.path.join(SCRIPT_DIR, 'batch_convert_videos.py'), run_name='__main__')
+        return executor, output.getvalue()
+
+    def test_jobs_and_force(self):
+        write_gif(self.write_video("a.mp4"))
+        with patch('video_to_gif.convert_video_to_gif', side_effect=write_gif) as convert:
+            executor, output = self.run_script('--jobs', '2')
+            convert.assert_not_called()
+            executor.assert_called_once_with(max_workers=2)
+            self.assertIn("1 already converted, converting 0 with 2 jobs", output)
+            self.run_script('-j', '1', '--force')
+            convert.assert_called_once()
+
+    def test_exit_status_on_failure(self):
+        self.write_video("a.mp4")
+        with patch('video_to_gif.convert_video_to_gif', side_effect=failing_conversion):
+            with self.assertRaises(SystemExit) as cm:
+                self.run_script()
+        self.assertEqual(cm.exception.code, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock
+from tools.browser_pool import BrowserPool, close_browser_pool, get_browser_pool, run_sync
+
+def make_playwright():
+    """Build a mocked Playwright driver whose contexts hand out fresh pages."""
+    def new_page():
+        page = AsyncMock()
+        page.on = MagicMock()
+        return page
+
+    def new_context(**kwargs):
+        context = AsyncMock()
+        context.new_page = AsyncMock(side_effect=new_page)
+        return context
+
+    browser = AsyncMock()
+    browser.is_connected = MagicMock(return_value=True)
+    browser.new_context = AsyncMock(side_effect=new_context)
+    playwright = AsyncMock()
+    playwright.chromium.launch = AsyncMock(return_value=browser)
+    return playwright, browser
+
+class TestBrowserPool(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.playwright, self.browser = make_playwright()
+        patcher = patch('tools.browser_pool.async_playwright',
+                        return_value=AsyncMock(start=AsyncMock(return_value=self.playwright)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_browser_reused_across_pages(self):
+        async with BrowserPool(warm_contexts=2) as pool:
+            self.assertEqual(self.browser.new_context.call_count, 2)
+            for _ in range(3):
+                async with pool.page() as page:
+                    await page.goto('http://example.com')
+        self.playwright.chromium.launch.assert_called_once_with(headless=True)
+        self.assertEqual(self.browser.new_context.call_count, 2)
+        self.browser.close.assert_called_once()
+        self.playwright.stop.assert_called_once()
+
+    async def test_pages_per_context_capped(self):
+        async with BrowserPool(max_contexts=2, max_pages_per_context=2) as pool:
+            entered = asyncio.Event()
+            release = asyncio.Event()
+            open_pages = 0
+            peak = 0
+
+            async def worker():
+                nonlocal open_pages, peak
+                async with pool.page():
+                    open_pages += 1
+                    peak = max(peak, open_pages)
+                    if open_pages == 4:
+                        entered.set()
+                    await release.wait()
+                    open_pages -= 1
+
+            tasks = [asyncio.create_task(worker()) for _ in range(6)]
+            await entered.wait()
+            await asyncio.sleep(0)
+            self.assertEqual(open_pages, 4)
+            release.set()
+            await asyncio.gather(*tasks)
+        self.assertEqual(peak, 4)
+        self.assertEqual(self.browser.new_context.call_count, 2)
+
+    async def test_context_recycled_after_max_uses(self):
+        async with BrowserPool(max_context_uses=2) as pool:
+            for _ in range(4):
+                async with pool.page():
+                    pass
+        # The warm context served two pages, its replacement the other two
+        self.assertEqual(self.browser.new_context.call_count, 2)
+
+    async def test_context_recycled_after_crash(self):
+        async with BrowserPool() as pool:
+            async with pool.page() as page:
+                # Simulate Playwright emitting the page's crash event
+                event, callback = page.on.call_args[0]
+                self.assertEqual(event, 'crash')
+                callback(page)
+            async with pool.page():
+                pass
+        self.assertEqual(self.browser.new_context.call_count, 2)
+
+    async def test_browser_relaunched_after_disconnect(self):
+        async with BrowserPool() as pool:
+            self.browser.is_connected.return_value = False
+            relaunched = AsyncMock()
+            relaunched.is_connected = MagicMock(return_value=True)
+            relaunched.new_context = AsyncMock(side_effect=self.browser.new_context.side_effect)
+            self.playwright.chromium.launch.return_value = relaunched
+            async with pool.page():
+                pass
+        self.assertEqual(self.playwright.chromium.launch.call_count, 2)
+        relaunched.new_context.assert_called_once()
+
+class TestSharedPool(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('tools.browser_pool.async_playwright',
+                        side_effect=lambda: AsyncMock(start=AsyncMock(return_value=make_playwright()[0])))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_replaces(self, first):
+        async def replace():
+            pool = await get_browser_pool()
+            self.assertIsNot(pool, first)
+            await close_browser_pool()
+            self.assertTrue(pool.closed)
+
+        asyncio.run(replace())
+
+    def test_pool_of_running_loop_closed_on_its_loop(self):
+        first = run_sync(get_browser_pool())
+        self.assert_replaces(first)
+        deadline = time.monotonic() + 5
+        while not first.closed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(first.closed)
+
+    def test_pool_of_idle_loop_closed(self):
+        loop = asyncio.new_event_loop()
+        try:
+            first = loop.run_until_complete(get_browser_pool())
+            self.assert_replaces(first)
+            self.assertTrue(first.closed)
+        finally:
+            loop.close()
+
+if __name__ == '__main__':
+    unittest.main()
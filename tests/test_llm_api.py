@@ -1,6 +1,16 @@
+import asyncio
+from io import StringIO
 import unittest
-from unittest.mock import patch, MagicMock, mock_open
-from tools.llm_api import create_llm_client, query_llm, load_environment
+from unittest.mock import patch, MagicMock, AsyncMock, mock_open
+import subprocess
+import threading
+from pathlib import Path
+from tools.llm_api import (
+    create_llm_client, query_llm, query_llm_async, query_llm_batch_async, load_environment, ClientRegistry,
+    stream_llm, stream_llm_async, query_llm_packed, Usage, _usage, default_model, main
+)
+from tools.llm_cache import MemoryCache
+from tests.fake_llm_clients import make_async_openai_client, make_openai_client
 import os
 import google.generativeai as genai
 import io
@@ -199,9 +209,9 @@ class TestLLMAPI(unittest.TestCase):
             create_llm_client("invalid_provider")
 
     @unittest.skipIf(skip_llm_tests, skip_message)
-    @patch('tools.llm_api.create_llm_client')
-    def test_query_openai(self, mock_create_client):
-        mock_create_client.return_value = self.mock_openai_client
+    @patch('tools.llm_api.get_llm_client')
+    def test_query_openai(self, mock_get_client):
+        mock_get_client.return_value = self.mock_openai_client
         response = query_llm("Test prompt", provider="openai")
         self.assertEqual(response, "Test OpenAI response")
         self.mock_openai_client.chat.completions.create.assert_called_once_with(
@@ -211,9 +221,9 @@ class TestLLMAPI(unittest.TestCase):
         )
 
     @unittest.skipIf(skip_llm_tests, skip_message)
-    @patch('tools.llm_api.create_llm_client')
-    def test_query_azure(self, mock_create_client):
-        mock_create_client.return_value = self.mock_azure_client
+    @patch('tools.llm_api.get_llm_client')
+    def test_query_azure(self, mock_get_client):
+        mock_get_client.return_value = self.mock_azure_client
         response = query_llm("Test prompt", provider="azure")
         self.assertEqual(response, "Test Azure OpenAI response")
         self.mock_azure_client.chat.completions.create.assert_called_once_with(
@@ -223,9 +233,9 @@ class TestLLMAPI(unittest.TestCase):
         )
 
     @unittest.skipIf(skip_llm_tests, skip_message)
-    @patch('tools.llm_api.create_llm_client')
-    def test_query_deepseek(self, mock_create_client):
-        mock_create_client.return_value = self.mock_openai_client
+    @patch('tools.llm_api.get_llm_client')
+    def test_query_deepseek(self, mock_get_client):
+        mock_get_client.return_value = self.mock_openai_client
         response = query_llm("Test prompt", provider="deepseek")
         self.assertEqual(response, "Test OpenAI response")
         self.mock_openai_client.chat.completions.create.assert_called_once_with(
@@ -235,9 +245,9 @@ class TestLLMAPI(unittest.TestCase):
         )
 
     @unittest.skipIf(skip_llm_tests, skip_message)
-    @patch('tools.llm_api.create_llm_client')
-    def test_query_anthropic(self, mock_create_client):
-        mock_create_client.return_value = self.mock_anthropic_client
+    @patch('tools.llm_api.get_llm_client')
+    def test_query_anthropic(self, mock_get_client):
+        mock_get_client.return_value = self.mock_anthropic_client
         response = query_llm("Test prompt", provider="anthropic")
         self.assertEqual(response, "Test Anthropic response")
         self.mock_anthropic_client.messages.create.assert_called_once_with(
@@ -247,18 +257,18 @@ class TestLLMAPI(unittest.TestCase):
         )
 
     @unittest.skipIf(skip_llm_tests, skip_message)
-    @patch('tools.llm_api.create_llm_client')
-    def test_query_gemini(self, mock_create_client):
-        mock_create_client.return_value = self.mock_gemini_client
+    @patch('tools.llm_api.get_llm_client')
+    def test_query_gemini(self, mock_get_client):
+        mock_get_client.return_value = self.mock_gemini_client
         response = query_llm("Test prompt", provider="gemini")
         self.assertEqual(response, "Test Gemini response")
         self.mock_gemini_client.GenerativeModel.assert_called_once_with("gemini-pro")
         self.mock_gemini_model.generate_content.assert_called_once_with("Test prompt")
 
     @unittest.skipIf(skip_llm_tests, skip_message)
-    @patch('tools.llm_api.create_llm_client')
-    def test_query_local(self, mock_create_client):
-        mock_create_client.return_value = self.mock_openai_client
+    @patch('tools.llm_api.get_llm_client')
+    def test_query_local(self, mock_get_client):
+        mock_get_client.return_value = self.mock_openai_client
         response = query_llm("Test prompt", provider="local")
         self.assertEqual(response, "Test OpenAI response")
         self.mock_openai_client.chat.completions.create.assert_called_once_with(
@@ -268,9 +278,9 @@ class TestLLMAPI(unittest.TestCase):
         )
 
     @unittest.skipIf(skip_llm_tests, skip_message)
-    @patch('tools.llm_api.create_llm_client')
-    def test_query_with_custom_model(self, mock_create_client):
-        mock_create_client.return_value = self.mock_openai_client
+    @patch('tools.llm_api.get_llm_client')
+    def test_query_with_custom_model(self, mock_get_client):
+        mock_get_client.return_value = self.mock_openai_client
         response = query_llm("Test prompt", model="custom-model")
         self.assertEqual(response, "Test OpenAI response")
         self.mock_openai_client.chat.completions.create.assert_called_once_with(
@@ -280,9 +290,9 @@ class TestLLMAPI(unittest.TestCase):
         )
 
     @unittest.skipIf(skip_llm_tests, skip_message)
-    @patch('tools.llm_api.create_llm_client')
-    def test_query_o1_model(self, mock_create_client):
-        mock_create_client.return_value = self.mock_openai_client
+    @patch('tools.llm_api.get_llm_client')
+    def test_query_o1_model(self, mock_get_client):
+        mock_get_client.return_value = self.mock_openai_client
         response = query_llm("Test prompt", model="o1")
         self.assertEqual(response, "Test OpenAI response")
         self.mock_openai_client.chat.completions.create.assert_called_once_with(
@@ -293,19 +303,337 @@ class TestLLMAPI(unittest.TestCase):
         )
 
     @unittest.skipIf(skip_llm_tests, skip_message)
-    @patch('tools.llm_api.create_llm_client')
-    def test_query_with_existing_client(self, mock_create_client):
+    @patch('tools.llm_api.get_llm_client')
+    def test_query_with_existing_client(self, mock_get_client):
         response = query_llm("Test prompt", client=self.mock_openai_client)
         self.assertEqual(response, "Test OpenAI response")
-        mock_create_client.assert_not_called()
+        mock_get_client.assert_not_called()
 
     @unittest.skipIf(skip_llm_tests, skip_message)
-    @patch('tools.llm_api.create_llm_client')
-    def test_query_error(self, mock_create_client):
+    @patch('tools.llm_api.get_llm_client')
+    def test_query_error(self, mock_get_client):
         self.mock_openai_client.chat.completions.create.side_effect = Exception("Test error")
-        mock_create_client.return_value = self.mock_openai_client
+        mock_get_client.return_value = self.mock_openai_client
         response = query_llm("Test prompt")
         self.assertIsNone(response)
 
+class TestImportTime(unittest.TestCase):
+    IMPORT_SCRIPT = """
+import sys
+import tools.llm_api
+sdks = [name for name in ('openai', 'anthropic', 'google.generativeai') if name in sys.modules]
+print(tools.llm_api._environment_loaded, *sdks)
+"""
+
+    def test_import_is_lazy_and_silent(self):
+        result = subprocess.run([sys.executable, '-c', self.IMPORT_SCRIPT], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent.parent, check=True)
+        environment_loaded, *sdks = result.stdout.split()
+        # Eagerly importing the SDKs took over a second
+        self.assertEqual(sdks, [])
+        self.assertEqual(environment_loaded, 'False')
+        self.assertEqual(result.stderr, '')
+
+class TestClientRegistry(unittest.TestCase):
+    def setUp(self):
+        self.env_patcher = patch.dict('os.environ', {'OPENAI_API_KEY': 'key-1', 'GOOGLE_API_KEY': 'test-google-key'})
+        self.env_patcher.start()
+        self.addCleanup(self.env_patcher.stop)
+        self.http_client = MagicMock()
+        patcher = patch.object(ClientRegistry, '_http_client', return_value=self.http_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.registry = ClientRegistry()
+
+    @patch('tools.llm_api.create_llm_client')
+    def test_client_reused_per_key(self, mock_create_client):
+        mock_create_client.side_effect = lambda *args: MagicMock()
+        first = self.registry.get("openai")
+        self.assertIs(self.registry.get("openai"), first)
+        mock_create_client.assert_called_once_with("openai", False, self.http_client)
+        os.environ['OPENAI_API_KEY'] = 'key-2'
+        self.assertIsNot(self.registry.get("openai"), first)
+        self.assertIsNot(self.registry.get("deepseek"), first)
+
+    @patch('tools.llm_api.create_llm_client')
+    def test_concurrent_first_use_creates_one_client(self, mock_create_client):
+        mock_create_client.side_effect = lambda *args: MagicMock()
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(self.registry.get("local"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(mock_create_client.call_count, 1)
+        self.assertTrue(all(client is clients[0] for client in clients))
+
+    @patch('tools.llm_api.genai')
+    def test_gemini_configured_once(self, mock_genai):
+        self.assertIs(self.registry.get("gemini"), mock_genai)
+        self.registry.get("gemini")
+        mock_genai.configure.assert_called_once_with(api_key='test-google-key')
+
+    @patch('tools.llm_api.create_llm_client')
+    def test_close(self, mock_create_client):
+        mock_create_client.side_effect = lambda *args: MagicMock()
+        client = self.registry.get("openai")
+        self.registry.close()
+        client.close.assert_called_once()
+        self.assertIsNot(self.registry.get("openai"), client)
+
+    @patch('tools.llm_api.create_llm_client')
+    def test_async_clients_per_event_loop(self, mock_create_client):
+        mock_create_client.side_effect = lambda *args: AsyncMock()
+
+        async def get_twice():
+            client = self.registry.get("openai", asynchronous=True)
+            self.assertIs(self.registry.get("openai", asynchronous=True), client)
+            await self.registry.aclose()
+            return client
+
+        first = asyncio.run(get_twice())
+        second = asyncio.run(get_twice())
+        self.assertIsNot(first, second)
+        first.close.assert_awaited_once()
+
+@patch('tools.llm_api.prepare_image', side_effect=lambda path, provider: (f"data-{path}", "image/png"))
+class TestMultiImage(unittest.TestCase):
+    def test_images_for_openai_compatible_providers(self, mock_prepare):
+        for provider in ("openai", "azure", "local"):
+            client = make_openai_client("ok")
+            self.assertEqual(query_llm("Compare", client, provider=provider, image_path=["a.png", "b.png"]), "ok")
+            content = client.chat.completions.create.call_args[1]["messages"][0]["content"]
+            self.assertEqual(content, [
+                {"type": "text", "text": "Compare"},
+                {"type": "image_url", "image_url": {"url": "data:image/png;base64,data-a.png"}},
+                {"type": "image_url", "image_url": {"url": "data:image/png;base64,data-b.png"}},
+            ])
+
+    def test_provider_without_vision_gets_text_only(self, mock_prepare):
+        client = make_openai_client("ok")
+        with patch('sys.stderr', new_callable=StringIO) as stderr:
+            self.assertEqual(query_llm("Describe", client, provider="deepseek", image_path="a.png"), "ok")
+        self.assertIn("Provider deepseek does not accept images", stderr.getvalue())
+        content = client.chat.completions.create.call_args[1]["messages"][0]["content"]
+        self.assertEqual(content, [{"type": "text", "text": "Describe"}])
+        mock_prepare.assert_not_called()
+
+    def test_images_for_anthropic(self, mock_prepare):
+        client = MagicMock()
+        client.messages.create.return_value = MagicMock(content=[MagicMock(text="ok")])
+        query_llm("Compare", client, provider="anthropic", image_path=["a.png", "b.png"])
+        content = client.messages.create.call_args[1]["messages"][0]["content"]
+        self.assertEqual([part["type"] for part in content], ["text", "image", "image"])
+        self.assertEqual(content[2]["source"]["data"], "data-b.png")
+
+    def test_images_for_gemini(self, mock_prepare):
+        mock_prepare.side_effect = lambda path, provider: ("aW1n", "image/jpeg")
+        client = MagicMock()
+        client.GenerativeModel.return_value.generate_content.return_value = MagicMock(text="ok")
+        query_llm("Describe", client, provider="gemini", image_path="a.jpg")
+        client.GenerativeModel.return_value.generate_content.assert_called_once_with(
+            ["Describe", {"mime_type": "image/jpeg", "data": b"img"}])
+
+    def test_packed_questions_share_requests(self, mock_prepare):
+        client = make_openai_client('Sure: ["yes", "no"]', 'blue')
+        questions = [("Is there a header?", "a.png"), ("Is it red?", ["b.png", "c.png"]), ("What color?", None)]
+        answers = query_llm_packed(questions, client, max_per_request=2)
+        self.assertEqual(answers, ["yes", "no", "blue"])
+        self.assertEqual(client.chat.completions.create.call_count, 2)
+        content = client.chat.completions.create.call_args_list[0][1]["messages"][0]["content"]
+        self.assertEqual([part["type"] for part in content], ["text", "text", "image_url", "text", "image_url", "image_url"])
+        self.assertEqual(content[3], {"type": "text", "text": "Question 2: Is it red?"})
+        # A lone question is asked as it is
+        content = client.chat.completions.create.call_args_list[1][1]["messages"][0]["content"]
+        self.assertEqual(content, [{"type": "text", "text": "What color?"}])
+
+    def test_packed_falls_back_to_single_questions(self, mock_prepare):
+        client = make_openai_client("Yes and no", "yes", "no")
+        answers = query_llm_packed([("First?", "a.png"), ("Second?", "b.png")], client)
+        self.assertEqual(answers, ["yes", "no"])
+        self.assertEqual(client.chat.completions.create.call_count, 3)
+
+def openai_chunk(content):
+    return MagicMock(choices=[MagicMock(delta=MagicMock(content=content))])
+
+class TestStreaming(unittest.TestCase):
+    def test_stream_openai(self):
+        client = MagicMock()
+        client.chat.completions.create.return_value = iter([openai_chunk("Hel"), openai_chunk(None), openai_chunk("lo")])
+        self.assertEqual(list(stream_llm("Test prompt", client)), ["Hel", "lo"])
+        client.chat.completions.create.assert_called_once_with(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Test prompt"}]}],
+            stream=True,
+            temperature=0.7
+        )
+
+    def test_stream_anthropic(self):
+        client = MagicMock()
+        client.messages.stream.return_value.__enter__.return_value.text_stream = iter(["Hel", "lo"])
+        self.assertEqual(list(stream_llm("Test prompt", client, provider="anthropic")), ["Hel", "lo"])
+        client.messages.stream.assert_called_once_with(
+            model="claude-3-sonnet-20240229",
+            max_tokens=1000,
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Test prompt"}]}]
+        )
+
+    def test_stream_gemini(self):
+        client = MagicMock()
+        client.GenerativeModel.return_value.generate_content.return_value = iter(
+            [MagicMock(text="Hel"), MagicMock(text="lo")])
+        self.assertEqual(list(stream_llm("Test prompt", client, provider="gemini")), ["Hel", "lo"])
+        client.GenerativeModel.return_value.generate_content.assert_called_once_with("Test prompt", stream=True)
+
+    def test_stream_cached(self):
+        client = MagicMock()
+        client.chat.completions.create.return_value = iter([openai_chunk("Hel"), openai_chunk("lo")])
+        cache = MemoryCache()
+        self.assertEqual(list(stream_llm("Test prompt", client, cache=cache)), ["Hel", "lo"])
+        self.assertEqual(list(stream_llm("Test prompt", client, cache=cache)), ["Hello"])
+        client.chat.completions.create.assert_called_once()
+
+    def test_stream_error_ends_stream(self):
+        def chunks():
+            yield openai_chunk("Hel")
+            raise Exception("Test error")
+
+        client = MagicMock()
+        client.chat.completions.create.return_value = chunks()
+        cache = MemoryCache()
+        self.assertEqual(list(stream_llm("Test prompt", client, cache=cache)), ["Hel"])
+        self.assertEqual(len(cache), 0)
+
+    def test_stream_openai_async(self):
+        async def chunks():
+            for content in ("Hel", "lo"):
+                yield openai_chunk(content)
+
+        async def collect():
+            return [delta async for delta in stream_llm_async("Test prompt", client)]
+
+        client = MagicMock()
+        client.chat.completions.create = AsyncMock(return_value=chunks())
+        self.assertEqual(asyncio.run(collect()), ["Hel", "lo"])
+
+class TestAsyncQuery(unittest.IsolatedAsyncioTestCase):
+    async def test_query_openai_async(self):
+        client = make_async_openai_client()
+        response = await query_llm_async("Test prompt", client=client)
+        self.assertEqual(response, "Answer to Test prompt")
+        client.chat.completions.create.assert_awaited_once_with(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Test prompt"}]}],
+            temperature=0.7
+        )
+
+    async def test_query_anthropic_async(self):
+        client = MagicMock()
+        client.messages.create = AsyncMock(return_value=MagicMock(content=[MagicMock(text="Test Anthropic response")]))
+        response = await query_llm_async("Test prompt", client=client, provider="anthropic")
+        self.assertEqual(response, "Test Anthropic response")
+        client.messages.create.assert_awaited_once_with(
+            model="claude-3-sonnet-20240229",
+            max_tokens=1000,
+            messages=[{"role": "user", "content": [{"type": "text", "text": "Test prompt"}]}]
+        )
+
+    async def test_query_gemini_async(self):
+        client = MagicMock()
+        client.GenerativeModel.return_value.generate_content_async = AsyncMock(
+            return_value=MagicMock(text="Test Gemini response"))
+        response = await query_llm_async("Test prompt", client=client, provider="gemini")
+        self.assertEqual(response, "Test Gemini response")
+        client.GenerativeModel.assert_called_once_with("gemini-pro")
+
+    async def test_query_error_async(self):
+        self.assertIsNone(await query_llm_async("fail", client=make_async_openai_client()))
+
+    async def test_batch_keeps_order_and_errors(self):
+        client = make_async_openai_client()
+        in_flight = peak = 0
+        create = client.chat.completions.create.side_effect
+
+        async def tracked(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            try:
+                return await create(**kwargs)
+            finally:
+                in_flight -= 1
+
+        client.chat.completions.create.side_effect = tracked
+        prompts = [f"q{i}" for i in range(10)] + ["fail"]
+        results = await query_llm_batch_async(prompts, concurrency=3, client=client)
+        self.assertEqual([r.response for r in results[:10]], [f"Answer to q{i}" for i in range(10)])
+        self.assertIsNone(results[10].response)
+        self.assertEqual(str(results[10].error), "Test error")
+        self.assertEqual(peak, 3)
+
+class TestSystemPrompt(unittest.TestCase):
+    PREAMBLE = "You are a careful agent. " * 200
+
+    def test_openai_system_message_leads(self):
+        client = MagicMock()
+        response = client.chat.completions.create.return_value
+        response.choices = [MagicMock(message=MagicMock(content="ok"))]
+        response.usage = MagicMock(prompt_tokens=1600, completion_tokens=10,
+                                   prompt_tokens_details=MagicMock(cached_tokens=1536))
+        query_llm("First question", client, system=self.PREAMBLE)
+        query_llm("Second question", client, system=self.PREAMBLE)
+        first, second = (call[1]["messages"] for call in client.chat.completions.create.call_args_list)
+        self.assertEqual(first[0], {"role": "system", "content": self.PREAMBLE})
+        self.assertEqual(first[0], second[0])
+        self.assertEqual(first[1]["content"], [{"type": "text", "text": "First question"}])
+        self.assertEqual(_usage(response, "openai"), Usage(1600, 10, 1536))
+
+    def test_anthropic_system_marked_for_caching(self):
+        client = MagicMock()
+        response = client.messages.create.return_value
+        response.content = [MagicMock(text="ok")]
+        response.usage = MagicMock(input_tokens=20, output_tokens=10, cache_read_input_tokens=1500,
+                                   cache_creation_input_tokens=0)
+        self.assertEqual(query_llm("Question", client, provider="anthropic", system=self.PREAMBLE), "ok")
+        kwargs = client.messages.create.call_args[1]
+        self.assertEqual(kwargs["system"], [{"type": "text", "text": self.PREAMBLE,
+                                             "cache_control": {"type": "ephemeral"}}])
+        self.assertEqual(kwargs["messages"], [{"role": "user", "content": [{"type": "text", "text": "Question"}]}])
+        self.assertEqual(_usage(response, "anthropic"), Usage(1520, 10, 1500))
+
+    def test_anthropic_without_system_unchanged(self):
+        client = MagicMock()
+        client.messages.create.return_value.content = [MagicMock(text="ok")]
+        query_llm("Question", client, provider="anthropic")
+        self.assertNotIn("system", client.messages.create.call_args[1])
+
+    def test_gemini_system_instruction(self):
+        client = MagicMock()
+        client.GenerativeModel.return_value.generate_content.return_value = MagicMock(text="ok")
+        query_llm("Question", client, provider="gemini", system=self.PREAMBLE)
+        client.GenerativeModel.assert_called_once_with("gemini-pro", system_instruction=self.PREAMBLE)
+        client.GenerativeModel.return_value.generate_content.assert_called_once_with("Question")
+
+    def test_system_prompt_in_cache_key(self):
+        client = MagicMock()
+        client.chat.completions.create.return_value.choices = [MagicMock(message=MagicMock(content="ok"))]
+        cache = MemoryCache()
+        query_llm("Question", client, cache=cache, system="Be brief.")
+        query_llm("Question", client, cache=cache, system="Be brief.")
+        query_llm("Question", client, cache=cache, system="Be thorough.")
+        query_llm("Question", client, cache=cache)
+        self.assertEqual(client.chat.completions.create.call_count, 3)
+
+class TestCommandLine(unittest.TestCase):
+    def test_default_model_matches_library(self):
+        for provider in ("anthropic", "gemini", "openai"):
+            with self.subTest(provider=provider), \
+                    patch('sys.argv', ['llm_api.py', '--prompt', 'Hi', '--provider', provider]), \
+                    patch('tools.llm_api.get_llm_client'), \
+                    patch('tools.llm_api.query_llm', return_value="ok") as mock_query, \
+                    patch('sys.stdout', new_callable=StringIO):
+                main()
+                self.assertEqual(mock_query.call_args[1]["model"], default_model(provider))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,109 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from anthropic import Anthropic
+from openai import AsyncOpenAI, OpenAI
+from tests.fake_llm_server import FakeLLMServer
+from tools.llm_batch import BatchJob, JobState, read_prompts
+
+PROMPTS = ["q0", {"id": "custom", "prompt": "q1"}, {"prompt": "please fail"}, "q3", {"prompt": "q4", "system": "Be brief."}]
+
+class TestBatchJob(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.tmp.name, "prompts.jsonl")
+        self.output_path = os.path.join(self.tmp.name, "responses.jsonl")
+        with open(self.input_path, "w") as f:
+            for prompt in PROMPTS:
+                f.write(json.dumps(prompt) + "\n")
+            f.write("\n")
+        self.server = FakeLLMServer().__enter__()
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        self.tmp.cleanup()
+
+    def read_output(self):
+        with open(self.output_path) as f:
+            return [json.loads(line) for line in f]
+
+    def assert_output(self):
+        output = self.read_output()
+        self.assertEqual([entry["id"] for entry in output], ["0", "custom", "2", "3", "4"])
+        self.assertEqual([entry["response"] for entry in output],
+                         ["Answer to q0", "Answer to q1", None, "Answer to q3", "Answer to q4"])
+        self.assertIsNotNone(output[2]["error"])
+
+    def job(self, **kwargs):
+        kwargs.setdefault("poll_interval", 0)
+        return BatchJob(self.input_path, self.output_path, **kwargs)
+
+    def test_read_prompts(self):
+        items = list(read_prompts(self.input_path))
+        self.assertEqual([item.id for item in items], ["0", "custom", "2", "3", "4"])
+        self.assertEqual(items[4].system, "Be brief.")
+
+    def test_openai_batch_api(self):
+        client = OpenAI(api_key="test", base_url=f"{self.server.url}/v1")
+        counts = self.job(provider="openai", client=client).run()
+        self.assertEqual((counts["done"], counts["failed"]), (4, 1))
+        self.assertEqual(self.server.count("POST", "/v1/batches"), 1)
+        self.assertEqual(self.server.count("POST", "/v1/chat/completions"), 0)
+        self.assert_output()
+
+    def test_batches_split_at_request_limit(self):
+        client = OpenAI(api_key="test", base_url=f"{self.server.url}/v1")
+        with patch("tools.llm_batch._OpenAIBatches.max_requests", 2):
+            self.job(provider="openai", client=client).run()
+        self.assertEqual(self.server.count("POST", "/v1/batches"), 3)
+        self.assert_output()
+
+    def test_anthropic_batch_api(self):
+        client = Anthropic(api_key="test", base_url=self.server.url)
+        counts = self.job(provider="anthropic", client=client).run()
+        self.assertEqual((counts["done"], counts["failed"]), (4, 1))
+        self.assert_output()
+
+    def test_resume_polls_submitted_batches(self):
+        client = OpenAI(api_key="test", base_url=f"{self.server.url}/v1")
+        counts = self.job(provider="openai", client=client).run(wait=False)
+        self.assertEqual(counts["submitted"], 5)
+        self.assertFalse(os.path.exists(self.output_path))
+
+        # A new job on the same state picks the batch up instead of submitting again
+        counts = self.job(provider="openai", client=client).run()
+        self.assertEqual(counts["done"], 4)
+        self.assertEqual(self.server.count("POST", "/v1/batches"), 1)
+        self.assert_output()
+
+    def test_local_runner_resumes(self):
+        client = AsyncOpenAI(api_key="test", base_url=f"{self.server.url}/v1")
+        counts = self.job(provider="local", model="test-model", client=client, concurrency=3).run()
+        self.assertEqual((counts["done"], counts["failed"]), (4, 1))
+        self.assertEqual(self.server.count("POST", "/v1/chat/completions"), 5)
+        self.assert_output()
+
+        # Only the failed item is sent again
+        client = AsyncOpenAI(api_key="test", base_url=f"{self.server.url}/v1")
+        self.job(provider="local", model="test-model", client=client).run()
+        self.assertEqual(self.server.count("POST", "/v1/chat/completions"), 6)
+        self.assert_output()
+
+    def test_state_refuses_other_input(self):
+        state_path = os.path.join(self.tmp.name, "job.sqlite")
+        state = JobState(state_path)
+        state.load(self.input_path)
+        with open(self.input_path, "a") as f:
+            f.write('"q5"\n')
+        with self.assertRaises(ValueError):
+            state.load(self.input_path)
+        state.close()
+
+    def test_unsupported_mode(self):
+        with self.assertRaises(ValueError):
+            BatchJob(self.input_path, self.output_path, provider="gemini", model="gemini-pro", mode="api")
+
+if __name__ == '__main__':
+    unittest.main()
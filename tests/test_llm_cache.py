@@ -0,0 +1,128 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from tools.llm_cache import MemoryCache, SQLiteCache, RequestCoalescer, make_cache_key
+from tools.llm_api import query_llm
+from tests.fake_llm_clients import make_openai_client
+
+class TestResponseCaches(unittest.TestCase):
+    def test_cache_key_covers_request(self):
+        key = make_cache_key("openai", "gpt-4o", "prompt", None, {"temperature": 0.7})
+        self.assertEqual(key, make_cache_key("openai", "gpt-4o", "prompt", None, {"temperature": 0.7}))
+        self.assertNotEqual(key, make_cache_key("anthropic", "gpt-4o", "prompt", None, {"temperature": 0.7}))
+        self.assertNotEqual(key, make_cache_key("openai", "gpt-4o", "prompt", "abc", {"temperature": 0.7}))
+        self.assertNotEqual(key, make_cache_key("openai", "gpt-4o", "prompt", None, {"temperature": 0}))
+
+    def test_memory_cache_lru(self):
+        cache = MemoryCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        self.assertEqual(cache.get("a"), "1")
+        cache.set("c", "3")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "1")
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        cache = MemoryCache(ttl=60)
+        cache.set("a", "1")
+        with patch('tools.llm_cache.time.time', return_value=time.time() + 61):
+            self.assertIsNone(cache.get("a"))
+
+    def test_sqlite_cache_persists(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "responses.sqlite")
+            cache = SQLiteCache(path)
+            cache.set("a", "1")
+            cache.close()
+            cache = SQLiteCache(path, ttl=60)
+            self.assertEqual(cache.get("a"), "1")
+            with patch('tools.llm_cache.time.time', return_value=time.time() + 61):
+                self.assertIsNone(cache.get("a"))
+            cache.close()
+
+    def test_coalescer_shares_in_flight_call(self):
+        coalescer = RequestCoalescer()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "result"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(coalescer.run("key", fetch)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(coalescer.run("key", fetch)))
+                     for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(results, ["result"] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_coalescer_shares_in_flight_coroutine(self):
+        coalescer = RequestCoalescer()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def run():
+            return await asyncio.gather(*(coalescer.run_async("key", fetch) for _ in range(4)))
+
+        self.assertEqual(asyncio.run(run()), ["result"] * 4)
+        self.assertEqual(len(calls), 1)
+
+class TestQueryCache(unittest.TestCase):
+    def test_repeat_prompt_served_from_cache(self):
+        client = make_openai_client()
+        cache = MemoryCache()
+        self.assertEqual(query_llm("Test prompt", client, cache=cache), "Test OpenAI response")
+        self.assertEqual(query_llm("Test prompt", client, cache=cache), "Test OpenAI response")
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+        query_llm("Other prompt", client, cache=cache)
+        query_llm("Test prompt", client, model="gpt-4o-mini", cache=cache)
+        self.assertEqual(client.chat.completions.create.call_count, 3)
+
+    def test_bypass_refreshes_cache(self):
+        client = make_openai_client("old")
+        cache = MemoryCache()
+        query_llm("Test prompt", client, cache=cache)
+        client.chat.completions.create.return_value.choices[0].message.content = "new"
+        self.assertEqual(query_llm("Test prompt", client, cache=cache, bypass_cache=True), "new")
+        self.assertEqual(query_llm("Test prompt", client, cache=cache), "new")
+
+    def test_errors_not_cached(self):
+        client = make_openai_client()
+        client.chat.completions.create.side_effect = [Exception("Test error"), client.chat.completions.create.return_value]
+        cache = MemoryCache()
+        self.assertIsNone(query_llm("Test prompt", client, cache=cache))
+        self.assertEqual(query_llm("Test prompt", client, cache=cache), "Test OpenAI response")
+
+    def test_image_content_in_key(self):
+        client = make_openai_client()
+        cache = MemoryCache()
+        with tempfile.TemporaryDirectory() as tmp:
+            image_path = os.path.join(tmp, "shot.png")
+            for content in (b"first", b"second", b"second"):
+                with open(image_path, "wb") as f:
+                    f.write(content)
+                query_llm("Describe", client, image_path=image_path, cache=cache)
+        self.assertEqual(client.chat.completions.create.call_count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
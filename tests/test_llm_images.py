@@ -0,0 +1,89 @@
+import base64
+import io
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from tools.llm_images import ImageLimits, encode_file_base64, prepare_image, _encoded_images
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+class TestImagePreparation(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        _encoded_images.clear()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def write_image(self, name, size, mode="RGB"):
+        # Noise compresses badly, like the detail of a real screenshot
+        image = Image.frombytes(mode, size, os.urandom(size[0] * size[1] * len(mode)))
+        path = os.path.join(self.tmp.name, name)
+        image.save(path)
+        return path
+
+    def test_file_encoding(self):
+        data = os.urandom(100_000)
+        path = self.write("blob.bin", data)
+        self.assertEqual(encode_file_base64(path), base64.b64encode(data).decode())
+
+    def test_encoded_image_cached_by_content(self):
+        path = self.write("small.png", b"not really a png")
+        first = prepare_image(path, "openai")
+        with patch('tools.llm_images._encode') as mock_encode:
+            copy = self.write("copy.png", b"not really a png")
+            self.assertEqual(prepare_image(copy, "openai"), first)
+            mock_encode.assert_not_called()
+        self.assertEqual(first, (base64.b64encode(b"not really a png").decode(), "image/png"))
+
+    @unittest.skipIf(Image is None, "Pillow is not installed")
+    def test_small_image_sent_unchanged(self):
+        path = self.write_image("small.png", (64, 64))
+        with open(path, "rb") as f:
+            self.assertEqual(prepare_image(path, "openai"), (base64.b64encode(f.read()).decode(), "image/png"))
+
+    @unittest.skipIf(Image is None, "Pillow is not installed")
+    def test_large_screenshot_downscaled(self):
+        path = self.write_image("page.png", (1280, 4000))
+        encoded, mime_type = prepare_image(path, "anthropic")
+        self.assertEqual(mime_type, "image/jpeg")
+        image = Image.open(io.BytesIO(base64.b64decode(encoded)))
+        self.assertEqual(max(image.size), 1568)
+        self.assertLess(len(encoded), os.path.getsize(path))
+        # OpenAI also caps the short side
+        path = self.write_image("wide.png", (2400, 1800))
+        encoded, _ = prepare_image(path, "openai")
+        self.assertEqual(Image.open(io.BytesIO(base64.b64decode(encoded))).size, (1024, 768))
+
+    @unittest.skipIf(Image is None, "Pillow is not installed")
+    def test_transparency_kept(self):
+        path = self.write_image("overlay.png", (3000, 200), mode="RGBA")
+        encoded, mime_type = prepare_image(path, "anthropic")
+        self.assertEqual(mime_type, "image/png")
+        self.assertEqual(Image.open(io.BytesIO(base64.b64decode(encoded))).mode, "RGBA")
+
+    @unittest.skipIf(Image is None, "Pillow is not installed")
+    def test_byte_limit_enforced(self):
+        limits = {"anthropic": ImageLimits(1568, 1568, 300 * 1024)}
+        with patch.dict('tools.llm_images.PROVIDER_IMAGE_LIMITS', limits):
+            # Transparent images that stay too large as PNG are flattened to JPEG
+            path = self.write_image("overlay.png", (800, 800), mode="RGBA")
+            encoded, mime_type = prepare_image(path, "anthropic")
+            self.assertEqual(mime_type, "image/jpeg")
+            self.assertLessEqual(len(encoded), 300 * 1024)
+            # Images too large even at the lowest JPEG quality are shrunk
+            path = self.write_image("noise.png", (1500, 1500))
+            encoded, _ = prepare_image(path, "anthropic")
+            self.assertLessEqual(len(encoded), 300 * 1024)
+            self.assertLess(Image.open(io.BytesIO(base64.b64decode(encoded))).width, 1500)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import asyncio
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import MagicMock, patch
+from tools.llm_cache import MemoryCache
+from tools.llm_metrics import (CallMetrics, JSONLSink, add_metrics_hook, format_summary, load_metrics,
+                               percentile, remove_metrics_hook, summarize)
+from tools.llm_api import main, query_llm, query_llm_async, stream_llm
+from tests.fake_llm_clients import APIError, make_openai_client
+
+def make_metrics(latency, provider="openai", model="gpt-4o", **fields):
+    values = dict(timestamp=0.0, provider=provider, model=model, latency=latency, ttfb=latency,
+                  input_tokens=10, output_tokens=5, cache=None, retries=0, streamed=False, error=None)
+    values.update(fields)
+    return CallMetrics(**values)
+
+class TestCallMetrics(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        add_metrics_hook(self.calls.append)
+
+    def tearDown(self):
+        remove_metrics_hook(self.calls.append)
+
+    def test_records_tokens_and_latency(self):
+        query_llm("Test prompt", make_openai_client())
+        self.assertEqual(len(self.calls), 1)
+        call = self.calls[0]
+        self.assertEqual((call.provider, call.model), ("openai", "gpt-4o"))
+        self.assertEqual((call.input_tokens, call.output_tokens, call.cache_read_tokens), (12, 5, 8))
+        self.assertIsNone(call.cache)
+        self.assertEqual(call.ttfb, call.latency)
+        self.assertIsNone(call.error)
+
+    def test_records_cache_hits_and_misses(self):
+        client = make_openai_client()
+        cache = MemoryCache()
+        query_llm("Test prompt", client, cache=cache)
+        query_llm("Test prompt", client, cache=cache)
+        query_llm("Test prompt", client, cache=cache, bypass_cache=True)
+        self.assertEqual([call.cache for call in self.calls], ["miss", "hit", "bypass"])
+        self.assertIsNone(self.calls[1].input_tokens)
+
+    def test_records_errors_and_retries(self):
+        client = make_openai_client()
+        client.chat.completions.create.side_effect = Exception("Test error")
+        self.assertIsNone(query_llm("Test prompt", client))
+        self.assertEqual(self.calls[0].error, "Exception: Test error")
+
+        client = make_openai_client()
+        client.chat.completions.create.side_effect = [APIError(429),
+                                                      client.chat.completions.create.return_value]
+        with patch('tools.llm_api._rate_limiter.limited', return_value=True), \
+             patch('tools.llm_api._rate_limiter.penalize'):
+            query_llm("Test prompt", client)
+        self.assertEqual(self.calls[1].retries, 1)
+        self.assertIsNone(self.calls[1].error)
+
+    def test_async_query(self):
+        client = MagicMock()
+        response = MagicMock()
+        response.choices = [MagicMock(message=MagicMock(content="Async response"))]
+        response.usage.prompt_tokens = 3
+        response.usage.completion_tokens = 2
+
+        async def create(**kwargs):
+            return response
+
+        client.chat.completions.create = create
+        asyncio.run(query_llm_async("Test prompt", client))
+        self.assertEqual((self.calls[0].input_tokens, self.calls[0].output_tokens), (3, 2))
+
+    def test_stream_records_time_to_first_byte(self):
+        client = MagicMock()
+        chunks = [MagicMock(choices=[MagicMock(delta=MagicMock(content=text))]) for text in ("Hel", "lo")]
+        client.chat.completions.create.return_value = iter(chunks)
+        self.assertEqual("".join(stream_llm("Test prompt", client)), "Hello")
+        call = self.calls[0]
+        self.assertTrue(call.streamed)
+        self.assertLessEqual(call.ttfb, call.latency)
+
+    def test_failing_hook_does_not_break_query(self):
+        def broken(metrics):
+            raise RuntimeError("hook failed")
+
+        add_metrics_hook(broken)
+        try:
+            self.assertEqual(query_llm("Test prompt", make_openai_client()), "Test OpenAI response")
+        finally:
+            remove_metrics_hook(broken)
+        self.assertEqual(len(self.calls), 1)
+
+class TestMetricsSummary(unittest.TestCase):
+    def test_percentiles(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(values, 0.5), 51.0)
+        self.assertEqual(percentile(values, 0.99), 100.0)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_summarize_per_provider_model(self):
+        records = [make_metrics(float(i), cache="hit" if i % 2 else "miss") for i in range(1, 11)]
+        records.append(make_metrics(9.0, error="Exception: boom"))
+        records.append(make_metrics(2.0, provider="anthropic", model="claude", retries=2))
+        summary = summarize(records)
+        self.assertEqual(list(summary), ["anthropic/claude", "openai/gpt-4o"])
+        openai = summary["openai/gpt-4o"]
+        self.assertEqual((openai["calls"], openai["errors"]), (11, 1))
+        self.assertEqual(openai["latency"]["p50"], 6.0)
+        self.assertEqual(openai["latency"]["p99"], 10.0)
+        self.assertEqual(openai["input_tokens"], 110)
+        self.assertEqual(openai["cache_hit_rate"], 0.5)
+        self.assertEqual(summary["anthropic/claude"]["retries"], 2)
+        self.assertIn("openai/gpt-4o", format_summary(summary))
+
+    def test_jsonl_sink_round_trip_and_cli_stats(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "metrics.jsonl")
+            sink = JSONLSink(path)
+            sink(make_metrics(1.5))
+            sink(make_metrics(0.5, cache="hit"))
+            with open(path, "a") as f:
+                f.write("not json\n")
+            self.assertEqual([record.latency for record in load_metrics(path)], [1.5, 0.5])
+
+            output = io.StringIO()
+            with patch('sys.argv', ['llm_api.py', '--stats', path]), redirect_stdout(output):
+                main()
+            self.assertIn("openai/gpt-4o", output.getvalue())
+            self.assertIn("1.50s", output.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
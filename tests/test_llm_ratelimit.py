@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from tools.llm_ratelimit import RateLimiter, TokenBucket
+from tools import llm_api
+from tools.llm_api import query_llm, set_rate_limit
+from tests.fake_llm_clients import APIError
+
+class TestTokenBucket(unittest.TestCase):
+    def test_waits_are_first_come_first_served(self):
+        bucket = TokenBucket(per_minute=60)
+        bucket.updated = 0.0
+        self.assertEqual(bucket.reserve(60, now=0.0), 0.0)
+        self.assertEqual(bucket.reserve(10, now=0.0), 10.0)
+        self.assertEqual(bucket.reserve(5, now=0.0), 15.0)
+        self.assertEqual(bucket.reserve(1, now=10.0), 6.0)
+
+    def test_adjust_refunds_unused_tokens(self):
+        bucket = TokenBucket(per_minute=600)
+        bucket.updated = 0.0
+        bucket.reserve(700, now=0.0)
+        bucket.adjust(-200, now=0.0)
+        self.assertEqual(bucket.reserve(0, now=0.0), 0.0)
+
+class TestRateLimiter(unittest.TestCase):
+    def test_request_and_token_budgets(self):
+        limiter = RateLimiter()
+        limiter.set_limit("openai", rpm=2, tpm=6000)
+        self.assertEqual(limiter.reserve("openai", "gpt-4o", 1000), 0.0)
+        self.assertEqual(limiter.reserve("openai", "gpt-4o-mini", 1000), 0.0)
+        # Third request of the minute waits for the request bucket
+        self.assertAlmostEqual(limiter.reserve("openai", "gpt-4o", 1000), 30.0, delta=0.1)
+        self.assertEqual(limiter.reserve("anthropic", "claude", 10 ** 6), 0.0)
+
+    def test_model_limit_overrides_provider(self):
+        limiter = RateLimiter()
+        limiter.set_limit("openai", rpm=1000)
+        limiter.set_limit("openai", "o1", rpm=1)
+        limiter.reserve("openai", "o1", 0)
+        self.assertGreater(limiter.reserve("openai", "o1", 0), 59)
+        self.assertEqual(limiter.reserve("openai", "gpt-4o", 0), 0.0)
+
+    def test_usage_corrects_estimate(self):
+        limiter = RateLimiter()
+        limiter.set_limit("openai", tpm=1000)
+        limiter.reserve("openai", None, 1000)
+        self.assertGreater(limiter.reserve("openai", None, 100), 0)
+        limiter.record("openai", None, 1000, 100)
+        limiter.record("openai", None, 100, 0)
+        self.assertEqual(limiter.reserve("openai", None, 800), 0.0)
+
+class TestQueryRateLimit(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(llm_api, '_rate_limiter', RateLimiter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('tools.llm_ratelimit.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = MagicMock()
+        response = MagicMock(choices=[MagicMock(message=MagicMock(content="ok"))])
+        response.usage.prompt_tokens = 10
+        response.usage.completion_tokens = 5
+        self.client.chat.completions.create.return_value = response
+
+    def test_rate_limited_call_is_queued_again(self):
+        set_rate_limit("openai", rpm=600)
+        self.client.chat.completions.create.side_effect = [APIError(429, {"retry-after": "2"}), self.client.chat.completions.create.return_value]
+        self.assertEqual(query_llm("Test prompt", self.client), "ok")
+        self.assertEqual(self.client.chat.completions.create.call_count, 2)
+        # The retry waited out the provider's Retry-After
+        self.assertGreaterEqual(self.sleep.call_args[0][0], 1.9)
+
+    def test_unlimited_provider_fails_as_before(self):
+        self.client.chat.completions.create.side_effect = APIError(429, {"retry-after": "2"})
+        self.assertIsNone(query_llm("Test prompt", self.client))
+        self.assertEqual(self.client.chat.completions.create.call_count, 1)
+        self.sleep.assert_not_called()
+
+    def test_reported_usage_feeds_token_budget(self):
+        set_rate_limit("openai", tpm=3000)
+        for _ in range(5):
+            query_llm("Test prompt", self.client)
+        # Each call reserved ~1000 tokens but used 15, so nobody had to wait
+        self.sleep.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import asyncio
+import random
+import threading
+import time
+import unittest
+from concurrent.futures import CancelledError
+from io import StringIO
+from unittest.mock import MagicMock, patch
+from tools.llm_api import main, query_llm
+from tools.llm_router import LLMRouter, Target, is_retryable
+from tests.fake_llm_clients import APIError
+
+class FakeProviders:
+    """Stands in for query_llm: behaviour per provider is a delay and an optional error."""
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.calls = []
+        self.models = []
+        self.cancel_events = []
+
+    def __call__(self, prompt, model=None, provider=None, raise_errors=False, **kwargs):
+        self.calls.append(provider)
+        self.models.append(model)
+        self.cancel_events.append(kwargs.get("cancel"))
+        delay, error = self.behaviour[provider]
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return f"{provider} answer"
+
+    async def query_async(self, prompt, model=None, provider=None, raise_errors=False, **kwargs):
+        self.calls.append(provider)
+        delay, error = self.behaviour[provider]
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return f"{provider} answer"
+
+class TestLLMRouter(unittest.TestCase):
+    def route(self, behaviour, *targets, **options):
+        providers = FakeProviders(behaviour)
+        patcher = patch('tools.llm_router.query_llm', side_effect=providers)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('tools.llm_router.query_llm_async', side_effect=providers.query_async)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        router = LLMRouter([Target(provider) for provider in targets], **options)
+        self.addCleanup(router.close)
+        return router, providers
+
+    def test_fails_over_on_rate_limit(self):
+        router, providers = self.route({"openai": (0, APIError(429)), "anthropic": (0, None)},
+                                       "openai", "anthropic")
+        self.assertEqual(router.query("Test prompt"), "anthropic answer")
+        self.assertGreater(router.stats()[Target("openai")]["cooling_down"], 0)
+        # The rate-limited target is tried last while it backs off
+        self.assertEqual(router.query("Test prompt"), "anthropic answer")
+        self.assertEqual(providers.calls, ["openai", "anthropic", "anthropic"])
+
+    def test_retry_after_honoured(self):
+        router, _ = self.route({"openai": (0, APIError(503, {"retry-after": "30"})), "anthropic": (0, None)},
+                               "openai", "anthropic")
+        router.query("Test prompt")
+        self.assertGreater(router.stats()[Target("openai")]["cooling_down"], 29)
+
+    def test_retries_after_backoff_when_all_fail(self):
+        router, providers = self.route({"openai": (0, APIError(500))}, "openai", backoff_base=0.01)
+        self.assertIsNone(router.query("Test prompt"))
+        self.assertEqual(providers.calls, ["openai", "openai"])
+
+    def test_permanent_error_not_retried(self):
+        router, providers = self.route({"openai": (0, APIError(400))}, "openai")
+        self.assertIsNone(router.query("Test prompt"))
+        self.assertEqual(providers.calls, ["openai"])
+        self.assertEqual(router.stats()[Target("openai")]["cooling_down"], 0)
+
+    def test_hedges_slow_request(self):
+        router, providers = self.route({"openai": (0.5, None), "anthropic": (0, None)},
+                                       "openai", "anthropic", hedge_after=0.05)
+        start = time.monotonic()
+        self.assertEqual(router.query("Test prompt"), "anthropic answer")
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(providers.calls, ["openai", "anthropic"])
+
+    def test_losing_hedge_not_counted(self):
+        router, providers = self.route({"openai": (0.2, APIError(429)), "anthropic": (0, None)},
+                                       "openai", "anthropic", hedge_after=0.05)
+        self.assertEqual(router.query("Test prompt"), "anthropic answer")
+        # The losing request is told to give up before any retry
+        self.assertTrue(all(event.is_set() for event in providers.cancel_events))
+        time.sleep(0.3)
+        stats = router.stats()
+        self.assertEqual(stats[Target("openai")]["requests"], 0)
+        self.assertEqual(stats[Target("openai")]["cooling_down"], 0)
+        self.assertEqual(stats[Target("anthropic")]["requests"], 1)
+
+    def test_cancelled_request_not_sent(self):
+        client = MagicMock()
+        cancel = threading.Event()
+        cancel.set()
+        with self.assertRaises(CancelledError):
+            query_llm("Test prompt", client, cancel=cancel, raise_errors=True)
+        client.chat.completions.create.assert_not_called()
+
+    def test_hedges_slow_request_async(self):
+        router, providers = self.route({"openai": (0.5, None), "anthropic": (0, None)},
+                                       "openai", "anthropic", hedge_after=0.05)
+        self.assertEqual(asyncio.run(router.query_async("Test prompt")), "anthropic answer")
+        # The losing request was cancelled, so only the winner is measured
+        stats = router.stats()
+        self.assertEqual(stats[Target("openai")]["requests"], 0)
+        self.assertEqual(stats[Target("anthropic")]["requests"], 1)
+
+    def test_fastest_strategy_uses_latency(self):
+        router, providers = self.route({"openai": (0.03, None), "anthropic": (0, None)},
+                                       "openai", "anthropic", strategy="fastest")
+        router._record_success(Target("anthropic"), 0.001)
+        router._record_success(Target("openai"), 0.2)
+        router.query("Test prompt")
+        self.assertEqual(providers.calls, ["anthropic"])
+        self.assertEqual(router.stats()[Target("anthropic")]["p50"] < 0.2, True)
+
+    def test_weighted_strategy(self):
+        router, providers = self.route({"openai": (0, None), "anthropic": (0, None)}, "openai", "anthropic",
+                                       strategy="weighted")
+        router.targets = [Target("openai", weight=9), Target("anthropic", weight=1)]
+        router._stats = {target: router._stats[Target(target.provider)] for target in router.targets}
+        random.seed(0)
+        for _ in range(200):
+            router.query("Test prompt")
+        self.assertGreater(providers.calls.count("openai"), 150)
+
+    def test_error_classification(self):
+        self.assertTrue(is_retryable(APIError(429)))
+        self.assertTrue(is_retryable(APIError(502)))
+        self.assertTrue(is_retryable(TimeoutError()))
+        self.assertFalse(is_retryable(APIError(401)))
+        self.assertFalse(is_retryable(ValueError("OPENAI_API_KEY not found in environment variables")))
+
+class TestCommandLine(unittest.TestCase):
+    def test_several_providers_fail_over(self):
+        providers = FakeProviders({"openai": (0, APIError(400)), "anthropic": (0, None)})
+        argv = ['llm_api.py', '--prompt', 'Hi', '--provider', 'openai,anthropic:claude-test']
+        with patch('sys.argv', argv), patch('tools.llm_router.query_llm', side_effect=providers), \
+                patch('sys.stdout', new_callable=StringIO) as stdout, patch('sys.stderr', new_callable=StringIO):
+            main()
+        self.assertEqual(stdout.getvalue(), "anthropic answer\n")
+        self.assertEqual(list(zip(providers.calls, providers.models)),
+                         [("openai", None), ("anthropic", "claude-test")])
+
+    def test_invalid_combinations_rejected(self):
+        for args in (['--provider', 'openai,nope'], ['--provider', 'openai,anthropic', '--model', 'gpt-4o'],
+                     ['--provider', 'openai,anthropic', '--stream'], ['--hedge-after', '2']):
+            with self.subTest(args=args), patch('sys.argv', ['llm_api.py', '--prompt', 'Hi', *args]), \
+                    patch('sys.stderr', new_callable=StringIO), self.assertRaises(SystemExit):
+                main()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+from playwright.async_api import Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+from tools.page_readiness import (ReadinessPolicy, PageNotReady, add_readiness_arguments, load_page,
+                                  page_content, policy_from_args)
+
+class FakePage:
+    """Page stand-in reaching each load state after a delay."""
+
+    DELAYS = {'commit': 0, 'domcontentloaded': 0.01, 'load': 0.02, 'networkidle': 0.5}
+
+    def __init__(self):
+        self.gotos = []
+        self.wait_for_selector = AsyncMock()
+        self.wait_for_function = AsyncMock()
+
+    async def goto(self, url, wait_until, timeout):
+        self.gotos.append((url, wait_until))
+        delay = self.DELAYS[wait_until]
+        if delay > timeout / 1000:
+            await asyncio.sleep(timeout / 1000)
+            raise PlaywrightTimeoutError(f"Timeout {timeout}ms exceeded")
+        await asyncio.sleep(delay)
+
+class TestLoadPage(unittest.IsolatedAsyncioTestCase):
+    async def test_waits_for_load_state_and_selector(self):
+        page = FakePage()
+        policy = ReadinessPolicy(wait_until='domcontentloaded', selector='#content', predicate='window.ready')
+        self.assertTrue(await load_page(page, 'http://example.com', policy))
+        self.assertEqual(page.gotos, [('http://example.com', 'domcontentloaded')])
+        self.assertEqual(page.wait_for_selector.call_args.args, ('#content',))
+        self.assertEqual(page.wait_for_function.call_args.args, ('window.ready',))
+
+    async def test_deadline(self):
+        page = FakePage()
+        with self.assertRaises(PageNotReady):
+            await load_page(page, 'http://example.com', ReadinessPolicy(timeout=0.05))
+        self.assertFalse(await load_page(page, 'http://example.com', ReadinessPolicy(timeout=0.05, partial=True)))
+
+    async def test_python_predicate_bounded_by_deadline(self):
+        page = FakePage()
+        checks = []
+
+        async def predicate(p):
+            checks.append(p)
+            return len(checks) > 1
+
+        policy = ReadinessPolicy(wait_until='load', predicate=predicate)
+        self.assertTrue(await load_page(page, 'http://example.com', policy))
+        self.assertEqual(len(checks), 2)
+        policy = ReadinessPolicy(wait_until='load', predicate=lambda p: False, timeout=0.2, partial=True)
+        self.assertFalse(await load_page(page, 'http://example.com', policy))
+
+    async def test_per_url_overrides(self):
+        fast = ReadinessPolicy(wait_until='domcontentloaded')
+        policy = ReadinessPolicy(overrides=(('*.fast.com', fast), ('https://example.com/app/*', fast)))
+        self.assertIs(policy.for_url('https://www.fast.com/page'), fast)
+        self.assertIs(policy.for_url('https://example.com/app/1'), fast)
+        self.assertIs(policy.for_url('https://example.com/blog'), policy)
+
+        page = FakePage()
+        await load_page(page, 'https://www.fast.com/page', policy)
+        self.assertEqual(page.gotos, [('https://www.fast.com/page', 'domcontentloaded')])
+
+    def test_policy_from_args(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            rules = os.path.join(tmp, 'rules.json')
+            with open(rules, 'w') as f:
+                json.dump({'*.news.com': {'wait_until': 'load', 'partial': True}}, f)
+            parser = argparse.ArgumentParser()
+            add_readiness_arguments(parser)
+            policy = policy_from_args(parser.parse_args(['--page-timeout', '5', '--readiness-rules', rules]))
+        self.assertEqual((policy.wait_until, policy.timeout, policy.partial), ('networkidle', 5.0, False))
+        override = policy.for_url('https://www.news.com/story')
+        self.assertEqual((override.wait_until, override.timeout, override.partial), ('load', 5.0, True))
+
+class TestPageContent(unittest.IsolatedAsyncioTestCase):
+    NAVIGATING = PlaywrightError("Unable to retrieve content because the page is navigating and changing the content.")
+
+    async def test_reads_dom_while_navigating(self):
+        page = MagicMock()
+        page.content = AsyncMock(side_effect=self.NAVIGATING)
+        page.evaluate = AsyncMock(return_value="<html><body>Partial</body></html>")
+        self.assertEqual(await page_content(page), "<html><body>Partial</body></html>")
+        page.evaluate.assert_awaited_once_with("document.documentElement.outerHTML")
+
+    async def test_retries_until_document_replaced(self):
+        page = MagicMock()
+        page.content = AsyncMock(side_effect=[self.NAVIGATING, "<html>Loaded</html>"])
+        page.evaluate = AsyncMock(side_effect=PlaywrightError("Execution context was destroyed"))
+        with patch('tools.page_readiness.CONTENT_RETRY_DELAY', 0):
+            self.assertEqual(await page_content(page), "<html>Loaded</html>")
+        self.assertEqual(page.content.await_count, 2)
+
+    async def test_other_errors_raised(self):
+        page = MagicMock()
+        page.content = AsyncMock(side_effect=PlaywrightError("Target page, context or browser has been closed"))
+        with self.assertRaises(PlaywrightError):
+            await page_content(page)
+        page.evaluate.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
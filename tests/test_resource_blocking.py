@@ -0,0 +1,90 @@
+import argparse
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+from tools.resource_blocking import (BlockingProfile, NO_BLOCKING, SCREENSHOT_PROFILE, TEXT_PROFILE,
+                                     add_blocking_arguments, block_resources, profile_from_args)
+from tools.web_scraper import fetch_page
+
+def make_route(url, resource_type, navigation=False, main_frame=True):
+    route = AsyncMock()
+    route.request.url = url
+    route.request.resource_type = resource_type
+    route.request.is_navigation_request = MagicMock(return_value=navigation)
+    route.request.frame.parent_frame = None if main_frame else MagicMock()
+    return route
+
+class TestBlockingProfile(unittest.TestCase):
+    def test_blocks_types_and_domains(self):
+        self.assertTrue(TEXT_PROFILE.blocks('image', 'https://example.com/a.png'))
+        self.assertTrue(TEXT_PROFILE.blocks('script', 'https://www.google-analytics.com/analytics.js'))
+        self.assertTrue(TEXT_PROFILE.blocks('xhr', 'https://stats.g.doubleclick.net/collect'))
+        self.assertFalse(TEXT_PROFILE.blocks('script', 'https://example.com/app.js'))
+        self.assertFalse(TEXT_PROFILE.blocks('xhr', 'https://notdoubleclick.net/api'))
+        self.assertFalse(SCREENSHOT_PROFILE.blocks('image', 'https://example.com/a.png'))
+        self.assertTrue(SCREENSHOT_PROFILE.blocks('media', 'https://example.com/a.mp4'))
+
+    def test_profile_from_args(self):
+        parser = argparse.ArgumentParser()
+        add_blocking_arguments(parser, TEXT_PROFILE)
+        with tempfile.TemporaryDirectory() as tmp:
+            domains = os.path.join(tmp, 'domains.txt')
+            with open(domains, 'w') as f:
+                f.write("# extra trackers\ntracker.example\n\n")
+            profile = profile_from_args(parser.parse_args(['--block', 'image,font', '--block-domains', domains]),
+                                        TEXT_PROFILE)
+        self.assertEqual(profile.resource_types, {'image', 'font'})
+        self.assertTrue(profile.blocks('script', 'https://cdn.tracker.example/t.js'))
+        self.assertTrue(profile.blocks('script', 'https://www.googletagmanager.com/gtm.js'))
+        self.assertIs(profile_from_args(parser.parse_args(['--no-blocking']), TEXT_PROFILE), NO_BLOCKING)
+        with self.assertRaises(SystemExit):
+            parser.parse_args(['--block', 'pictures'])
+
+class TestBlockResources(unittest.IsolatedAsyncioTestCase):
+    async def test_route_handler(self):
+        page = AsyncMock()
+        await block_resources(page, TEXT_PROFILE)
+        pattern, handle = page.route.call_args.args
+        self.assertEqual(pattern, '**/*')
+
+        image = make_route('https://example.com/a.png', 'image')
+        await handle(image)
+        image.abort.assert_called_once_with('blockedbyclient')
+        script = make_route('https://example.com/app.js', 'script')
+        await handle(script)
+        script.continue_.assert_called_once()
+        script.abort.assert_not_called()
+        # A page on a blocked host can still be loaded itself, but not framed
+        page_itself = make_route('https://www.optimizely.com/docs', 'document', navigation=True)
+        await handle(page_itself)
+        page_itself.continue_.assert_called_once()
+        frame = make_route('https://ads.doubleclick.net/ad', 'document', navigation=True, main_frame=False)
+        await handle(frame)
+        frame.abort.assert_called_once()
+
+    async def test_nothing_routed_without_blocking(self):
+        page = AsyncMock()
+        await block_resources(page, NO_BLOCKING)
+        page.route.assert_not_called()
+
+    async def test_fetch_page_uses_text_profile(self):
+        page = AsyncMock()
+        page.content.return_value = "<p>Text</p>"
+        context = AsyncMock()
+        context.new_page.return_value = page
+        self.assertEqual(await fetch_page('http://example.com', context), "<p>Text</p>")
+        _, handle = page.route.call_args.args
+        stylesheet = make_route('http://example.com/site.css', 'stylesheet')
+        await handle(stylesheet)
+        stylesheet.abort.assert_called_once()
+
+        page.route.reset_mock()
+        await fetch_page('http://example.com', context, blocking=BlockingProfile(frozenset({'image'})))
+        _, handle = page.route.call_args.args
+        stylesheet = make_route('http://example.com/site.css', 'stylesheet')
+        await handle(stylesheet)
+        stylesheet.continue_.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
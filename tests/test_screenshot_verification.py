@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
+import io
 import os
 import pytest
+from PIL import Image
 from unittest.mock import patch, MagicMock, mock_open, AsyncMock
-from tools.screenshot_utils import take_screenshot_sync, take_screenshot
+from tools.screenshot_utils import (
+    take_screenshot_sync, take_screenshot, take_screenshots_sync, take_screenshot_bytes_sync, ScreenshotJob,
+    ScreenshotOptions, _to_webp, main as screenshot_main
+)
+from tools.browser_pool import run_sync, close_browser_pool
 from tools.llm_api import query_llm
 
 class TestScreenshotVerification:
@@ -14,6 +20,7 @@ class TestScreenshotVerification:
         mock_page.goto = AsyncMock()
         mock_page.screenshot = AsyncMock()
         mock_page.set_viewport_size = AsyncMock()
+        mock_page.on = MagicMock()
         return mock_page
     
     @pytest.fixture
@@ -24,10 +31,11 @@ class TestScreenshotVerification:
         return mock_context
     
     @pytest.fixture
-    def mock_browser(self, mock_page):
+    def mock_browser(self, mock_context):
         """Mock Playwright browser."""
         mock_browser = AsyncMock()
-        mock_browser.new_page = AsyncMock(return_value=mock_page)
+        mock_browser.new_context = AsyncMock(return_value=mock_context)
+        mock_browser.is_connected = MagicMock(return_value=True)
         mock_browser.close = AsyncMock()
         return mock_browser
     
@@ -37,7 +45,9 @@ class TestScreenshotVerification:
         mock_playwright = AsyncMock()
         mock_playwright.chromium = AsyncMock()
         mock_playwright.chromium.launch = AsyncMock(return_value=mock_browser)
-        return mock_playwright
+        yield mock_playwright
+        # Drop the shared pool so it does not outlive the mocks
+        run_sync(close_browser_pool())
     
     def test_screenshot_capture(self, mock_playwright, mock_page, tmp_path):
         """Test screenshot capture functionality with mocked Playwright."""
@@ -50,12 +60,12 @@ class TestScreenshotVerification:
             f.write(b'fake_screenshot_data')
         
         # Mock the async_playwright function and ensure the mock chain is connected
-        with patch('tools.screenshot_utils.async_playwright', return_value=AsyncMock(
-            __aenter__=AsyncMock(return_value=mock_playwright),
-            __aexit__=AsyncMock()
+        with patch('tools.browser_pool.async_playwright', return_value=AsyncMock(
+            start=AsyncMock(return_value=mock_playwright)
         )):
-            # Take the screenshot
+            # Take the screenshot twice, the browser is launched only once
             actual_path = take_screenshot_sync('http://test.com', output_path)
+            take_screenshot_sync('http://test.com', output_path)
             
             # Verify the path is correct
             assert actual_path == output_path
@@ -67,11 +77,134 @@ class TestScreenshotVerification:
             # Verify the mock chain was called correctly
             mock_playwright.chromium.launch.assert_called_once_with(headless=True)
             mock_browser = mock_playwright.chromium.launch.return_value
-            mock_browser.new_page.assert_called_once_with(viewport={'width': 1280, 'height': 720})
-            mock_page.goto.assert_called_once_with('http://test.com', wait_until='networkidle')
-            mock_page.screenshot.assert_called_once_with(path=output_path, full_page=True)
-            mock_browser.close.assert_called_once()
+            mock_browser.new_context.assert_called_once()
+            mock_page.set_viewport_size.assert_called_with({'width': 1280, 'height': 720})
+            assert mock_page.goto.call_args.args == ('http://test.com',)
+            assert mock_page.goto.call_args.kwargs['wait_until'] == 'networkidle'
+            mock_page.screenshot.assert_called_with(path=output_path, full_page=True)
+            assert mock_page.close.call_count == 2
+            mock_browser.close.assert_not_called()
     
+    def test_batch_screenshots(self, mock_playwright, mock_page, tmp_path):
+        """Test many (url, viewport) jobs sharing one browser, with a failing capture."""
+        async def goto(url, **kwargs):
+            if 'bad' in url:
+                raise Exception("net::ERR_NAME_NOT_RESOLVED")
+
+        mock_page.goto.side_effect = goto
+        jobs = [ScreenshotJob(url, width, height)
+                for url in ('http://a.com', 'http://b.com/page', 'http://bad.com')
+                for width, height in ((1280, 720), (390, 844))]
+
+        with patch('tools.browser_pool.async_playwright', return_value=AsyncMock(
+            start=AsyncMock(return_value=mock_playwright)
+        )):
+            results = list(take_screenshots_sync(jobs, output_dir=str(tmp_path), concurrency=3))
+
+        assert len(results) == 6
+        failed = [r for r in results if r.error is not None]
+        assert [r.job.url for r in failed] == ['http://bad.com', 'http://bad.com']
+        paths = [r.path for r in results if r.error is None]
+        assert len(set(paths)) == 4
+        assert all(os.path.dirname(path) == str(tmp_path) for path in paths)
+        assert any(path.endswith('_390x844.png') for path in paths)
+        mock_playwright.chromium.launch.assert_called_once_with(headless=True)
+        assert mock_page.screenshot.call_count == 4
+        assert mock_page.close.call_count == 6
+
+    def test_screenshot_options(self, mock_playwright, mock_page, tmp_path):
+        """Test format, quality, clip, viewport-only and element capture options."""
+        mock_page.locator = MagicMock()
+        element = mock_page.locator.return_value.first
+        element.screenshot = AsyncMock(return_value=b'element')
+
+        with patch('tools.browser_pool.async_playwright', return_value=AsyncMock(
+            start=AsyncMock(return_value=mock_playwright)
+        )):
+            jpeg_path = os.path.join(tmp_path, 'shot.jpg')
+            take_screenshot_sync('http://test.com', jpeg_path, options=ScreenshotOptions(quality=60))
+            mock_page.screenshot.assert_called_with(path=jpeg_path, type='jpeg', quality=60, full_page=True)
+
+            temp_path = take_screenshot_sync('http://test.com', options=ScreenshotOptions(
+                format='jpeg', full_page=False, clip=(0, 0, 800, 600)))
+            assert temp_path.endswith('.jpg')
+            os.remove(temp_path)
+            mock_page.screenshot.assert_called_with(path=temp_path, type='jpeg', full_page=False,
+                                                    clip={'x': 0, 'y': 0, 'width': 800, 'height': 600})
+
+            data = take_screenshot_bytes_sync('http://test.com', options=ScreenshotOptions(selector='#chart'))
+            assert data == b'element'
+            mock_page.locator.assert_called_with('#chart')
+            element.screenshot.assert_called_once_with()
+
+    def test_screenshot_webp_bytes(self, mock_playwright, mock_page):
+        """Test in-memory WebP capture, converted from Chromium's PNG."""
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48), 'blue').save(buffer, format='PNG')
+        mock_page.screenshot = AsyncMock(return_value=buffer.getvalue())
+
+        with patch('tools.browser_pool.async_playwright', return_value=AsyncMock(
+            start=AsyncMock(return_value=mock_playwright)
+        )):
+            data = take_screenshot_bytes_sync('http://test.com', options=ScreenshotOptions(format='webp', quality=50))
+
+        mock_page.screenshot.assert_called_once_with(full_page=True)
+        assert data[:4] == b'RIFF' and data[8:12] == b'WEBP'
+        with Image.open(io.BytesIO(data)) as image:
+            assert image.size == (64, 48)
+
+    def test_webp_costs_a_png_capture_and_a_conversion(self, mock_playwright, mock_page):
+        """WebP is the PNG capture re-encoded once, so it trades time for a smaller file."""
+        image = Image.effect_noise((256, 256), 64).convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        png = buffer.getvalue()
+        mock_page.screenshot = AsyncMock(return_value=png)
+
+        with patch('tools.browser_pool.async_playwright', return_value=AsyncMock(
+            start=AsyncMock(return_value=mock_playwright)
+        )), patch('tools.screenshot_utils._to_webp', wraps=_to_webp) as to_webp:
+            data = take_screenshot_bytes_sync('http://test.com', options=ScreenshotOptions(format='webp'))
+
+        mock_page.screenshot.assert_called_once_with(full_page=True)
+        to_webp.assert_called_once_with(png, None)
+        assert len(data) < len(png)
+
+    def test_quality_rejected_for_png(self, mock_playwright, mock_page, tmp_path):
+        """PNG is lossless, so a quality is an error rather than silently ignored."""
+        with patch('tools.browser_pool.async_playwright', return_value=AsyncMock(
+            start=AsyncMock(return_value=mock_playwright)
+        )):
+            with pytest.raises(ValueError):
+                take_screenshot_bytes_sync('http://test.com', options=ScreenshotOptions(quality=60))
+            with pytest.raises(ValueError):
+                take_screenshot_sync('http://test.com', os.path.join(tmp_path, 'shot.png'),
+                                     options=ScreenshotOptions(format='png', quality=60))
+        mock_page.goto.assert_not_called()
+
+        with patch('sys.argv', ['screenshot_utils.py', 'http://test.com', '--quality', '60']):
+            with pytest.raises(SystemExit):
+                screenshot_main()
+
+    def test_conflicting_options_rejected(self, mock_playwright, mock_page, tmp_path):
+        """Options that would be ignored are errors: one output path for a batch, a clip with a selector."""
+        with patch('tools.browser_pool.async_playwright', return_value=AsyncMock(
+            start=AsyncMock(return_value=mock_playwright)
+        )):
+            with pytest.raises(ValueError):
+                take_screenshot_bytes_sync('http://test.com', options=ScreenshotOptions(
+                    clip=(0, 0, 800, 600), selector='#chart'))
+        mock_page.goto.assert_not_called()
+
+        output = os.path.join(tmp_path, 'shot.png')
+        for args in (['http://a.com', 'http://b.com', '-o', output],
+                     ['http://a.com', '--viewport', '800x600', '--viewport', '390x844', '-o', output],
+                     ['http://a.com', '--output-dir', str(tmp_path), '-o', output],
+                     ['http://a.com', '--clip', '0,0,800,600', '--selector', '#chart']):
+            with patch('sys.argv', ['screenshot_utils.py', *args]), pytest.raises(SystemExit):
+                screenshot_main()
+        mock_playwright.chromium.launch.assert_not_called()
+
     def test_llm_verification_openai(self, tmp_path):
         """Test screenshot verification with OpenAI using mocks."""
         screenshot_path = os.path.join(tmp_path, 'test_screenshot.png')
@@ -87,7 +220,7 @@ class TestScreenshotVerification:
         mock_response.choices[0].message.content = "The webpage has a blue background and the title is 'agentic.ai test page'"
         mock_openai.chat.completions.create.return_value = mock_response
         
-        with patch('tools.llm_api.create_llm_client', return_value=mock_openai):
+        with patch('tools.llm_api.get_llm_client', return_value=mock_openai):
             response = query_llm(
                 "What is the background color of this webpage? What is the title?",
                 provider="openai",
@@ -115,7 +248,7 @@ class TestScreenshotVerification:
         mock_response.content = [mock_content]
         mock_anthropic.messages.create.return_value = mock_response
         
-        with patch('tools.llm_api.create_llm_client', return_value=mock_anthropic):
+        with patch('tools.llm_api.get_llm_client', return_value=mock_anthropic):
             response = query_llm(
                 "What is the background color of this webpage? What is the title?",
                 provider="anthropic",
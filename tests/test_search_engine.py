@@ -1,8 +1,12 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import sys
+import time
 from io import StringIO
-from tools.search_engine import search
+from tools.llm_cache import MemoryCache
+from duckduckgo_search.exceptions import RatelimitException, TimeoutException
+from tools.search_engine import (search, search_many, search_with_retry, classify_error, CircuitBreaker,
+                                 CircuitOpenError, RetryPolicy, _breaker)
 
 class TestSearchEngine(unittest.TestCase):
     def setUp(self):
@@ -114,5 +118,136 @@ class TestSearchEngine(unittest.TestCase):
         self.assertEqual(result.get('title', 'N/A'), 'N/A')
         self.assertEqual(result.get('body', 'N/A'), 'N/A')
 
+class TestSearchMany(unittest.TestCase):
+    def setUp(self):
+        self.stderr = StringIO()
+        self.old_stderr = sys.stderr
+        sys.stderr = self.stderr
+
+    def tearDown(self):
+        sys.stderr = self.old_stderr
+
+    @staticmethod
+    def fake_text(query, max_results=10):
+        if query == "broken":
+            raise Exception("Test error")
+        return [
+            {'href': f'http://example.com/{query}', 'title': query, 'body': query},
+            {'href': 'http://shared.com/', 'title': 'Shared', 'body': 'Shared'},
+        ]
+
+    @patch('tools.search_engine.time.sleep')
+    @patch('tools.search_engine.DDGS')
+    def test_dedupes_queries_and_urls(self, mock_ddgs, mock_sleep):
+        mock_ddgs.return_value.text.side_effect = self.fake_text
+        results = search_many(["alpha", "beta", " Alpha ", "broken"], concurrency=2)
+
+        self.assertEqual(list(results), ["alpha", "beta", "broken"])
+        self.assertEqual([r['href'] for r in results["alpha"]], ['http://example.com/alpha', 'http://shared.com/'])
+        self.assertEqual([r['href'] for r in results["beta"]], ['http://example.com/beta'])
+        self.assertEqual(results["broken"], [])
+        self.assertIn("ERROR: Search failed for query: broken: Test error", self.stderr.getvalue())
+        # Sessions are reused per worker thread rather than opened per query
+        self.assertLessEqual(mock_ddgs.call_count, 2)
+        searched = [c.args[0] for c in mock_ddgs.return_value.text.call_args_list]
+        self.assertEqual(sorted(set(searched)), ["alpha", "beta", "broken"])
+        self.assertEqual(searched.count("alpha"), 1)
+        # Every session is closed once the searches are done
+        self.assertEqual(mock_ddgs.return_value.__exit__.call_count, mock_ddgs.call_count)
+
+    @patch('tools.search_engine.DDGS')
+    def test_cache_serves_repeat_queries(self, mock_ddgs):
+        mock_ddgs.return_value.text.side_effect = self.fake_text
+        mock_ddgs.return_value.__enter__.return_value.text.side_effect = self.fake_text
+        cache = MemoryCache()
+        first = search_many(["alpha", "beta"], cache=cache)
+        second = search_many(["beta", "alpha"], cache=cache, dedupe=False)
+        self.assertEqual(mock_ddgs.return_value.text.call_count, 2)
+        self.assertEqual(second["alpha"][0], first["alpha"][0])
+        self.assertIn("DEBUG: Using cached results for query: beta", self.stderr.getvalue())
+
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            search("alpha", cache=cache)
+            self.assertIn("URL: http://example.com/alpha", sys.stdout.getvalue())
+        finally:
+            sys.stdout = stdout
+        mock_ddgs.return_value.__enter__.return_value.text.assert_not_called()
+
+    @patch('tools.search_engine.DDGS')
+    def test_empty_results_not_cached(self, mock_ddgs):
+        mock_ddgs.return_value.text.return_value = []
+        cache = MemoryCache()
+        self.assertEqual(search_many(["alpha"], cache=cache), {"alpha": []})
+        mock_ddgs.return_value.text.side_effect = self.fake_text
+        results = search_many(["alpha"], cache=cache)
+        self.assertEqual(results["alpha"][0]['href'], 'http://example.com/alpha')
+        self.assertEqual(mock_ddgs.return_value.text.call_count, 2)
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.stderr = StringIO()
+        self.old_stderr = sys.stderr
+        sys.stderr = self.stderr
+        _breaker.reset()
+
+    def tearDown(self):
+        sys.stderr = self.old_stderr
+        _breaker.reset()
+
+    def test_classify_error(self):
+        self.assertEqual(classify_error(RatelimitException("https://duckduckgo.com 202 Ratelimit")), "rate_limit")
+        self.assertEqual(classify_error(TimeoutException("timed out")), "transient")
+        self.assertEqual(classify_error(ConnectionError("reset")), "transient")
+        self.assertEqual(classify_error(ValueError("bad query")), "permanent")
+
+    def test_backoff_grows_with_jitter_and_cap(self):
+        policy = RetryPolicy(base_delay=1.0, rate_limit_delay=5.0, max_delay=30.0)
+        for attempt, low, high in ((0, 0.5, 1.0), (1, 1.0, 2.0), (3, 4.0, 8.0), (10, 15.0, 30.0)):
+            delay = policy.delay(attempt, "transient")
+            self.assertTrue(low <= delay <= high, (attempt, delay))
+        self.assertGreaterEqual(policy.delay(0, "rate_limit"), 2.5)
+
+    @patch('tools.search_engine.time.sleep')
+    def test_rate_limit_retried_with_backoff(self, mock_sleep):
+        ddgs = MagicMock()
+        ddgs.text.side_effect = [RatelimitException("Ratelimit"), RatelimitException("Ratelimit"),
+                                 [{'href': 'http://example.com'}]]
+        results = search_with_retry("test query", ddgs=ddgs)
+        self.assertEqual(len(results), 1)
+        first, second = (c.args[0] for c in mock_sleep.call_args_list)
+        self.assertTrue(2.5 <= first <= 5.0)
+        self.assertTrue(5.0 <= second <= 10.0)
+        self.assertIn("before retry (rate limit)", self.stderr.getvalue())
+
+    @patch('tools.search_engine.time.sleep')
+    def test_permanent_error_not_retried(self, mock_sleep):
+        ddgs = MagicMock()
+        ddgs.text.side_effect = ValueError("bad query")
+        with self.assertRaises(ValueError):
+            search_with_retry("test query", ddgs=ddgs)
+        self.assertEqual(ddgs.text.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    @patch('tools.search_engine.time.sleep')
+    def test_circuit_breaker_opens_and_recovers(self, mock_sleep):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        ddgs = MagicMock()
+        ddgs.text.side_effect = TimeoutException("timed out")
+        with self.assertRaises(CircuitOpenError):
+            search_with_retry("test query", max_retries=3, ddgs=ddgs, breaker=breaker)
+        self.assertEqual(ddgs.text.call_count, 2)
+        with self.assertRaises(CircuitOpenError):
+            search_with_retry("other query", ddgs=ddgs, breaker=breaker)
+        self.assertEqual(ddgs.text.call_count, 2)
+
+        # After the timeout a single trial search goes through and closes the circuit
+        ddgs.text.side_effect = None
+        ddgs.text.return_value = [{'href': 'http://example.com'}]
+        with patch('tools.search_engine.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual(len(search_with_retry("test query", ddgs=ddgs, breaker=breaker)), 1)
+        self.assertEqual(breaker.failures, 0)
+        self.assertIsNone(breaker.opened_at)
+
 if __name__ == '__main__':
     unittest.main()
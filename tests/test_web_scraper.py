@@ -1,13 +1,30 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 import asyncio
+import random
+import tempfile
+import time
 import pytest
+from contextlib import asynccontextmanager
+from io import StringIO
 from tools.web_scraper import (
     validate_url,
     parse_html,
+    parse_html_tree,
     fetch_page,
-    process_urls
+    fetch_page_http,
+    get_http_session,
+    close_http_session,
+    iter_urls,
+    process_urls,
+    ParseExecutor,
+    PageCache,
+    normalize_url,
+    needs_browser,
+    FetchResult,
+    main
 )
+from tools.page_readiness import ReadinessPolicy
 
 pytestmark = pytest.mark.asyncio
 
@@ -105,5 +122,422 @@ class TestWebScraper(unittest.TestCase):
             self.assertEqual(results[1], "Test content")
             self.assertEqual(self.mock_session.get.call_count, 2)
 
+class FakeBrowserPool:
+    """Browser pool stand-in whose pages load after a per-URL delay."""
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.open_pages = 0
+        self.peak_pages = 0
+
+    @asynccontextmanager
+    async def page(self):
+        self.open_pages += 1
+        self.peak_pages = max(self.peak_pages, self.open_pages)
+        page = MagicMock()
+        url = None
+
+        async def goto(target, **kwargs):
+            nonlocal url
+            url = target
+            await asyncio.sleep(self.delays[target])
+
+        async def content():
+            return f"<p>Content of {url}</p>"
+
+        page.goto = goto
+        page.wait_for_load_state = AsyncMock()
+        page.route = AsyncMock()
+        page.content = content
+        try:
+            yield page
+        finally:
+            self.open_pages -= 1
+
+class TestUrlScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_limits_open_pages(self):
+        urls = [f"http://example.com/{i}" for i in range(20)]
+        pool = FakeBrowserPool({url: 0.001 for url in urls})
+        results = [item async for item in iter_urls(iter(urls), max_concurrent=3, browser_pool=pool,
+                                                    http_first=False)]
+        self.assertEqual(len(results), 20)
+        self.assertEqual(pool.peak_pages, 3)
+
+    async def test_yields_in_completion_order(self):
+        pool = FakeBrowserPool({"http://slow.com": 0.05, "http://fast.com": 0})
+        urls = [url async for url, _ in iter_urls(["http://slow.com", "http://fast.com"], browser_pool=pool,
+                                                  http_first=False)]
+        self.assertEqual(urls, ["http://fast.com", "http://slow.com"])
+
+    async def test_process_urls_keeps_input_order(self):
+        pool = FakeBrowserPool({"http://slow.com": 0.05, "http://fast.com": 0})
+        results = await process_urls(["http://slow.com", "http://fast.com"], browser_pool=pool,
+                                     http_first=False)
+        self.assertEqual(results, ["  Content of http://slow.com", "  Content of http://fast.com"])
+
+    async def test_early_exit_stops_workers(self):
+        urls = [f"http://example.com/{i}" for i in range(10)]
+        pool = FakeBrowserPool({url: 0.001 for url in urls})
+        stream = iter_urls(urls, max_concurrent=2, browser_pool=pool, http_first=False)
+        async for _ in stream:
+            break
+        await stream.aclose()
+        self.assertEqual(pool.open_pages, 0)
+
+    async def test_slow_input_does_not_block_fetches(self):
+        def slow_urls():
+            yield "http://fast.com"
+            time.sleep(0.3)
+            yield "http://late.com"
+
+        pool = FakeBrowserPool({"http://fast.com": 0, "http://late.com": 0})
+        start = time.monotonic()
+        stream = iter_urls(slow_urls(), browser_pool=pool, http_first=False)
+        url, _ = await anext(stream)
+        self.assertEqual(url, "http://fast.com")
+        self.assertLess(time.monotonic() - start, 0.25)
+        self.assertEqual([url async for url, _ in stream], ["http://late.com"])
+
+    async def test_failing_url_yields_empty_text(self):
+        async def load_page(url, page, readiness=None, blocking=None):
+            if url == "http://bad.com":
+                raise RuntimeError("browser crashed")
+            return FetchResult(f"<p>Content of {url}</p>")
+
+        pool = FakeBrowserPool({})
+        with patch('tools.web_scraper._load_page', side_effect=load_page), \
+                self.assertLogs('tools.web_scraper', level='ERROR'):
+            results = await process_urls(["http://bad.com", "http://good.com"], browser_pool=pool,
+                                         http_first=False)
+        self.assertEqual(results, ["", "  Content of http://good.com"])
+
+class FakeHTTPSession:
+    """aiohttp session stand-in serving canned responses."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = []
+        self.request_headers = []
+
+    @asynccontextmanager
+    async def get(self, url, headers=None):
+        self.requested.append(url)
+        self.request_headers.append(headers or {})
+        status, content_type, body, *extra = self.pages[url]
+        response = MagicMock()
+        response.status = status
+        response.headers = {'Content-Type': content_type, **(extra[0] if extra else {})}
+        # Chunked responses come without a Content-Length
+        chunked = response.headers.get('Transfer-Encoding') == 'chunked'
+        response.content_length = None if chunked else len(body)
+        response.charset = 'utf-8'
+
+        async def iter_chunked(size):
+            data = body.encode('utf-8')
+            for start in range(0, len(data), size):
+                yield data[start:start + size]
+
+        response.content.iter_chunked = iter_chunked
+        yield response
+
+class TestTieredFetch(unittest.IsolatedAsyncioTestCase):
+    ARTICLE = "<html><body><article><p>" + "Server rendered text. " * 20 + "</p></article></body></html>"
+    SHELL = "<html><body><div id=\"root\"></div><script src=\"/app.js\"></script></body></html>"
+
+    async def test_static_page_skips_browser(self):
+        session = FakeHTTPSession({"http://docs.com": (200, "text/html; charset=utf-8", self.ARTICLE)})
+        pool = FakeBrowserPool({})
+        with patch('tools.web_scraper.get_http_session', AsyncMock(return_value=session)):
+            results = await process_urls(["http://docs.com"], browser_pool=pool)
+        self.assertIn("Server rendered text.", results[0])
+        self.assertEqual(pool.peak_pages, 0)
+
+    async def test_escalates_to_browser(self):
+        session = FakeHTTPSession({
+            "http://spa.com": (200, "text/html", self.SHELL),
+            "http://blocked.com": (403, "text/html", self.ARTICLE),
+            "http://file.com": (200, "application/pdf", "%PDF"),
+        })
+        urls = list(session.pages)
+        pool = FakeBrowserPool({url: 0 for url in urls})
+        with patch('tools.web_scraper.get_http_session', AsyncMock(return_value=session)):
+            results = await process_urls(urls, browser_pool=pool)
+        self.assertEqual(session.requested, urls)
+        self.assertEqual(results, [f"  Content of {url}" for url in urls])
+
+    async def test_oversized_chunked_response(self):
+        session = FakeHTTPSession({
+            "http://big.com": (200, "text/html", self.ARTICLE, {'Transfer-Encoding': 'chunked'}),
+        })
+        with patch('tools.web_scraper.MAX_HTTP_BODY', 100), patch('tools.web_scraper.HTTP_READ_CHUNK', 16):
+            self.assertIsNone(await fetch_page_http("http://big.com", session))
+        self.assertEqual(await fetch_page_http("http://big.com", session), self.ARTICLE)
+
+    def test_needs_browser(self):
+        self.assertFalse(needs_browser(self.ARTICLE))
+        self.assertTrue(needs_browser(self.SHELL))
+        self.assertTrue(needs_browser("<html><body></body></html>"))
+        self.assertTrue(needs_browser(
+            "<body><noscript>" + "Please enable JavaScript to use this site. " * 10 + "</noscript></body>"))
+        self.assertTrue(needs_browser("<body><app-root></app-root>" + "x" * 500 + "</body>"))
+        # A server-rendered page that mounts into its root is left alone
+        self.assertFalse(needs_browser("<body><div id=\"root\"><p>" + "x" * 500 + "</p></div></body>"))
+
+class TestMain(unittest.TestCase):
+    def test_runs_share_the_background_loop(self):
+        loops = []
+
+        async def process(urls, **options):
+            loops.append(asyncio.get_running_loop())
+            return ["Text"] * len(urls)
+
+        async def stream(urls, **options):
+            loops.append(asyncio.get_running_loop())
+            for url in urls:
+                yield url, "Text"
+
+        argv = ['web_scraper.py', '--no-cache', 'http://example.com']
+        with patch('tools.web_scraper.process_urls', side_effect=process), \
+                patch('tools.web_scraper.iter_urls', side_effect=stream), \
+                patch('tools.web_scraper._close_shared_clients', new_callable=AsyncMock) as close, \
+                patch('sys.stdout', new_callable=StringIO) as stdout:
+            for extra in ([], ['--stream']):
+                with patch('sys.argv', argv + extra):
+                    main()
+        # The shared clients stay bound to one live loop instead of a loop per run
+        self.assertEqual(loops, [loops[0]] * 2)
+        self.assertTrue(loops[0].is_running())
+        self.assertEqual(close.await_count, 2)
+        self.assertEqual(stdout.getvalue().count("=== Content from http://example.com ==="), 2)
+
+class TestHTTPSession(unittest.TestCase):
+    def test_session_of_finished_loop_is_closed(self):
+        first = asyncio.run(get_http_session())
+        self.assertFalse(first.closed)
+
+        async def second_run():
+            session = await get_http_session()
+            await close_http_session()
+            return session
+
+        self.assertIsNot(asyncio.run(second_run()), first)
+        self.assertTrue(first.closed)
+
+    def test_session_of_idle_loop_is_closed(self):
+        loop = asyncio.new_event_loop()
+        try:
+            first = loop.run_until_complete(get_http_session())
+            second = asyncio.run(get_http_session())
+            self.assertTrue(first.closed)
+            asyncio.run(close_http_session())
+            self.assertTrue(second.closed)
+        finally:
+            loop.close()
+
+class TestPageCache(unittest.IsolatedAsyncioTestCase):
+    ARTICLE = TestTieredFetch.ARTICLE
+    URL = "http://docs.com/page"
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = PageCache(self.tmp.name, ttl=60)
+        self.session = FakeHTTPSession({self.URL: (200, "text/html", self.ARTICLE, {'ETag': '"v1"'})})
+        patcher = patch('tools.web_scraper.get_http_session', AsyncMock(return_value=self.session))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+
+    async def test_fresh_entry_skips_network(self):
+        first = await process_urls([self.URL], browser_pool=FakeBrowserPool({}), cache=self.cache)
+        second = await process_urls(["HTTP://Docs.com:80/page#top"], browser_pool=FakeBrowserPool({}),
+                                    cache=self.cache)
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.session.requested), 1)
+        self.assertEqual(self.cache.read_html(self.cache.lookup(self.URL)), self.ARTICLE)
+
+    async def test_stale_entry_revalidated(self):
+        await process_urls([self.URL], browser_pool=FakeBrowserPool({}), cache=self.cache)
+        self.cache.ttl = 0
+        self.session.pages[self.URL] = (304, "text/html", "")
+        results = await process_urls([self.URL], browser_pool=FakeBrowserPool({}), cache=self.cache)
+        self.assertIn("Server rendered text.", results[0])
+        self.assertEqual(self.session.request_headers[-1], {'If-None-Match': '"v1"'})
+        self.assertGreater(self.cache.lookup(self.URL).fetched_at, time.time() - 5)
+
+    async def test_stale_entry_served_when_refetch_fails(self):
+        first = await process_urls([self.URL], browser_pool=FakeBrowserPool({}), cache=self.cache)
+        self.cache.ttl = 0
+        # The HTTP fetch fails and so does the browser fallback
+        self.session.pages[self.URL] = (500, "text/html", "")
+        with self.assertLogs('tools.web_scraper', 'WARNING'):
+            self.assertEqual(await process_urls([self.URL], browser_pool=FakeBrowserPool({}), cache=self.cache),
+                             first)
+        with patch('tools.web_scraper._fetch_tiered', side_effect=OSError("network down")), \
+                self.assertLogs('tools.web_scraper', 'WARNING'):
+            self.assertEqual(await process_urls([self.URL], cache=self.cache), first)
+
+    async def test_partial_page_not_cached(self):
+        pool = FakeBrowserPool({self.URL: 1})
+        readiness = ReadinessPolicy(timeout=0.05, partial=True)
+        results = await process_urls([self.URL], browser_pool=pool, http_first=False, cache=self.cache,
+                                     readiness=readiness)
+        self.assertEqual(results, [f"  Content of {self.URL}"])
+        self.assertIsNone(self.cache.lookup(self.URL))
+
+        # Without partial content the page fails at the deadline
+        results = await process_urls([self.URL], browser_pool=pool, http_first=False,
+                                     readiness=readiness._replace(partial=False))
+        self.assertEqual(results, [""])
+
+    def test_lru_eviction(self):
+        self.cache.max_bytes = 250
+        for name in ("a", "b", "c"):
+            self.cache.store(f"http://site.com/{name}", name * 100, name)
+            self.cache.lookup("http://site.com/a")
+        self.assertIsNotNone(self.cache.lookup("http://site.com/a"))
+        self.assertIsNone(self.cache.lookup("http://site.com/b"))
+        self.assertIsNotNone(self.cache.lookup("http://site.com/c"))
+
+    def test_normalize_url(self):
+        self.assertEqual(normalize_url("HTTPS://Example.com:443?b=2&a=1#frag"), "https://example.com/?a=1&b=2")
+        self.assertEqual(normalize_url("http://example.com:8080/x"), "http://example.com:8080/x")
+
+class TestParseExecutor(unittest.IsolatedAsyncioTestCase):
+    HTML = "<html><body><h1>Title</h1><p>Paragraph</p><a href='/x'>Link</a></body></html>"
+
+    async def asyncSetUp(self):
+        self.executor = ParseExecutor(max_workers=1, inline_limit=100, shared_memory_limit=1000)
+
+    async def asyncTearDown(self):
+        self.executor.shutdown()
+
+    async def test_small_page_parsed_inline(self):
+        self.assertEqual(await self.executor.parse(self.HTML[:90]), parse_html(self.HTML[:90]))
+        self.assertIsNone(self.executor._executor)
+
+    async def test_large_pages_parsed_in_workers(self):
+        medium = self.HTML + " " * 200
+        large = self.HTML + " " * 2000 + "<p>Caf\u00e9</p>"
+        self.assertEqual(await self.executor.parse(medium), parse_html(medium))
+        self.assertEqual(await self.executor.parse(large), parse_html(large))
+        self.assertIsNotNone(self.executor._executor)
+
+class TestParseHtmlParity(unittest.TestCase):
+    """The linear walk of parse_html must match the recursive walk of parse_html_tree."""
+
+    DOCUMENTS = [
+        # Plain structure and links
+        "<html><head><title>Ignored</title></head><body><h1>Title</h1><p>Text</p></body></html>",
+        '<p>See <a href="https://example.com">the docs</a> for more.</p>',
+        '<a href="#top">Top</a><a href="javascript:void(0)">JS</a><a>No href</a><a href="">Empty</a>',
+        '<a title="t" href="/relative">Relative</a><a xlink:href="/x">Namespaced</a>',
+        '<a href="/a"><span>Wrapped</span></a> after',
+        # Deduplication and noise filtering
+        "<ul><li>Repeat</li><li>Repeat</li><li>Unique</li></ul>",
+        '<a href="/one">Same</a><a href="/two">Same</a><p>Same</p>',
+        "<p>var x = 1</p><p>style.css</p><p>{braces}</p><p>Kept</p>",
+        # Tail text rules: dropped after script/style, empty elements and whitespace-only elements
+        "<p>Before<script>var a = 1;</script>after script</p>",
+        "<p>Line one<br>line two</p>",
+        "<p>Image <img src='x.png'> caption</p>",
+        "<div><span>  </span>tail of empty span</div>",
+        "<div><b>Bold</b> tail of bold</div>",
+        "<p>Text<!-- a comment --> tail of comment</p><p>x<!----> empty comment</p>",
+        # Implied end tags
+        "<p>Unclosed paragraph",
+        "<p>First<p>Second<div>Block</div>",
+        "<ul><li>One<li>Two<li>Three</ul>",
+        "<dl><dt>Term<dd>Definition<dt>Other</dl>",
+        "<h1>Heading<h2>Nested heading</h2>",
+        "<select><option>A<option>B</select>",
+        "<div>Stray</p>closing tag</div>",
+        "<span>Stray</div>end tag</span>",
+        # Tables with implicit tbody/tr
+        "<table><tr><td>A</td><td>B</td></tr><tr><td>C</table>",
+        "<table><td>Cell without row</td></table>",
+        "<table><thead><tr><th>H</th></tr></thead><tbody><tr><td>D</td></tr></tbody></table>",
+        "<p>Para<table><tr><td>In table</td></tr></table>",
+        "<!DOCTYPE html><p>Para<table><tr><td>In table</td></tr></table>",
+        # Formatting elements reopened after implicit closes
+        "<p><b>Bold<p>Still bold</b> plain",
+        "<b><i>Both</b> italic only</i>",
+        "<a href='/1'>One<a href='/2'>Two</a>",
+        # Misnested formatting elements, resolved by the adoption agency algorithm
+        '<a href="/x">A<div>B<a href="#t"></a>C</div>D</a>',
+        '<a href="/x">Home0<div><ul>beta0<a href="#t"></a>beta4</div>gamma2</a>',
+        "<p><i><b>x</p>y",
+        "<b>1<p>2</b>3</p>4",
+        "<a href='/1'><b>One<div>Two</a>Three</b>",
+        "<font><font><font><font>Four deep</font></font></font></font>",
+        # Content misplaced in tables is moved in front of them
+        "<div>hello<table>x<tr><td>y</table></div>",
+        "<table><b>Bold<tr><td>Cell</td></tr></table>after",
+        "<table><p><li>Item<table>Fostered",
+        "<b><table><td><i>Cell</b>text</table>",
+        "<table><caption>Caption<td>Cell</table>",
+        "<table><colgroup><col>Text after cols</table>",
+        "<table><tr><td><select><option>A<td>B</table>",
+        # Raw text and foreign content
+        "<textarea>Typed &amp; <b>kept</b></textarea>",
+        "<pre><u></pre><textarea>Reopened inside",
+        "<math><title><a href='#t'>Not an integration point</a></title></math>",
+        "<svg><title><b>Integration point</b></title><p>Breaks out</svg>",
+        "<select><style></h2>Ignored style",
+        # Document structure edge cases
+        "Text before any tag",
+        "<title>T</title><meta charset='utf-8'>Body text",
+        "<body>Inside</body>After body<!-- dropped -->",
+        "<p>Entities &amp; &lt;tags&gt; &copy; &#169;</p>",
+        "<p>Windows\r\nline endings</p>",
+        "<svg><a href='/svg'>Vector link</a><text>Label</text></svg>",
+        "<style>p { color: red; }</style><noscript>Enable JS</noscript><p>Visible</p>",
+        # Template contents, stray </br> and head content
+        "<template>x<p>Hello</p>",
+        "<head><template>x</template></head><p>Body</p>",
+        "</br>b",
+        "<head><title>T</title>Text in head</head>",
+    ]
+
+    def test_parity_with_tree_parser(self):
+        for html in self.DOCUMENTS:
+            with self.subTest(html=html):
+                self.assertEqual(parse_html(html), parse_html_tree(html))
+
+    @staticmethod
+    def random_document(rng, depth=0, counter=None):
+        counter = counter if counter is not None else [0]
+        tags = ['a', 'b', 'i', 'div', 'p', 'ul', 'li', 'table', 'tr', 'td', 'caption', 'select',
+                'option', 'form', 'button', 'font', 'svg', 'math', 'textarea', 'script', 'h2',
+                'template', 'br', 'head', 'body', 'style']
+        parts = []
+        for _ in range(rng.randint(1, 4)):
+            if depth > 4 or rng.random() < 0.4:
+                counter[0] += 1
+                parts.append(rng.choice(['', ' ', '\n']) + f"w{counter[0]}")
+            elif rng.random() < 0.1:
+                parts.append(rng.choice(['</p>', '</b>', '</td>', '</table>', '</a>', '</div>', '</br>',
+                                         '</head>', '</template>', '<!-- c -->']))
+            else:
+                tag = rng.choice(tags)
+                attrs = rng.choice([' href="/x"', ' href="#t"', '']) if tag == 'a' else ''
+                close = f"</{tag}>" if rng.random() < 0.8 else ''
+                parts.append(f"<{tag}{attrs}>{TestParseHtmlParity.random_document(rng, depth + 1, counter)}{close}")
+        return ''.join(parts)
+
+    def test_random_documents(self):
+        rng = random.Random(1)
+        for _ in range(3000):
+            html = self.random_document(rng)
+            with self.subTest(html=html):
+                self.assertEqual(parse_html(html), parse_html_tree(html))
+
+    def test_deeply_nested_document(self):
+        depth = 5000
+        html = "<div>" * depth + "Deep" + "</div>" * depth
+        self.assertEqual(parse_html(html).strip(), "Deep")
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+import asyncio
+import atexit
+import logging
+import queue
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+from playwright.async_api import async_playwright
+
+logger = logging.getLogger(__name__)
+
+class _PooledContext:
+    """A browser context together with its usage counters."""
+
+    def __init__(self, context):
+        self.context = context
+        self.in_use = 0
+        self.uses = 0
+        self.retired = False
+
+class BrowserPool:
+    """
+    Long-lived Chromium instance that hands out pages from reusable contexts.
+
+    The browser is launched once and ``warm_contexts`` contexts are opened up
+    front. A context serves at most ``max_pages_per_context`` pages at a time
+    and is replaced once it has served ``max_context_uses`` pages or one of its
+    pages crashed. A disconnected browser is relaunched on the next request.
+
+    Usage:
+        async with BrowserPool() as pool:
+            async with pool.page() as page:
+                await page.goto(url)
+    """
+
+    def __init__(self, max_contexts: int = 5, max_pages_per_context: int = 4,
+                 max_context_uses: int = 50, warm_contexts: int = 1,
+                 launch_options: Optional[Dict[str, Any]] = None,
+                 context_options: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            max_contexts (int): Maximum number of browser contexts kept open
+            max_pages_per_context (int): Maximum number of open pages per context
+            max_context_uses (int): Pages a context serves before it is recycled
+            warm_contexts (int): Contexts opened when the pool starts
+            launch_options (dict, optional): Keyword arguments for chromium.launch
+            context_options (dict, optional): Keyword arguments for browser.new_context
+        """
+        self.max_contexts = max_contexts
+        self.max_pages_per_context = max_pages_per_context
+        self.max_context_uses = max_context_uses
+        self.warm_contexts = min(warm_contexts, max_contexts)
+        self.launch_options = launch_options if launch_options is not None else {'headless': True}
+        self.context_options = context_options or {}
+        self._playwright = None
+        self._browser = None
+        self._contexts: List[_PooledContext] = []
+        self._condition = asyncio.Condition()
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def __aenter__(self) -> 'BrowserPool':
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self) -> 'BrowserPool':
+        """Launch the browser and open the warm contexts. Safe to call repeatedly."""
+        async with self._condition:
+            await self._ensure_browser()
+            while len(self._active_contexts()) < self.warm_contexts:
+                self._contexts.append(await self._new_context())
+        return self
+
+    async def close(self):
+        """Close every context, the browser and the Playwright driver."""
+        async with self._condition:
+            self._closed = True
+            for pooled in self._contexts:
+                await self._close_context(pooled)
+            self._contexts.clear()
+            if self._browser is not None:
+                try:
+                    await self._browser.close()
+                except Exception as e:
+                    logger.debug(f"Error closing browser: {str(e)}")
+            if self._playwright is not None:
+                await self._playwright.stop()
+            self._browser = None
+            self._playwright = None
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def page(self):
+        """Open a page in a pooled context and close it again on exit."""
+        pooled = await self._acquire()
+        state = {'crashed': False}
+        page = None
+        try:
+            try:
+                page = await pooled.context.new_page()
+            except Exception:
+                # A context that cannot open pages is not worth keeping
+                state['crashed'] = True
+                raise
+            page.on('crash', lambda _: state.update(crashed=True))
+            yield page
+        finally:
+            if page is not None:
+                try:
+                    await page.close()
+                except Exception:
+                    state['crashed'] = True
+            await self._release(pooled, state['crashed'])
+
+    def _active_contexts(self) -> List[_PooledContext]:
+        return [pooled for pooled in self._contexts if not pooled.retired]
+
+    async def _ensure_browser(self):
+        if self._closed:
+            raise RuntimeError("Browser pool is closed")
+        if self._browser is not None and self._browser.is_connected():
+            return
+        if self._browser is not None:
+            logger.warning("Browser disconnected, relaunching")
+            for pooled in self._contexts:
+                pooled.retired = True
+            self._contexts.clear()
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        logger.debug("Launching browser")
+        self._browser = await self._playwright.chromium.launch(**self.launch_options)
+
+    async def _new_context(self) -> _PooledContext:
+        return _PooledContext(await self._browser.new_context(**self.context_options))
+
+    async def _close_context(self, pooled: _PooledContext):
+        try:
+            await pooled.context.close()
+        except Exception as e:
+            logger.debug(f"Error closing browser context: {str(e)}")
+
+    async def _acquire(self) -> _PooledContext:
+        async with self._condition:
+            while True:
+                await self._ensure_browser()
+                active = self._active_contexts()
+                available = [p for p in active if p.in_use < self.max_pages_per_context]
+                if available:
+                    pooled = min(available, key=lambda p: p.in_use)
+                    break
+                if len(active) < self.max_contexts:
+                    pooled = await self._new_context()
+                    self._contexts.append(pooled)
+                    break
+                await self._condition.wait()
+            pooled.in_use += 1
+            return pooled
+
+    async def _release(self, pooled: _PooledContext, crashed: bool):
+        async with self._condition:
+            pooled.in_use -= 1
+            pooled.uses += 1
+            if crashed or pooled.uses >= self.max_context_uses:
+                pooled.retired = True
+            if pooled.retired and pooled.in_use == 0:
+                if pooled in self._contexts:
+                    self._contexts.remove(pooled)
+                if not self._closed:
+                    await self._close_context(pooled)
+            self._condition.notify_all()
+
+# Pool shared by the tools, bound to the event loop it was created on
+_shared_pool: Optional[BrowserPool] = None
+_shared_loop: Optional[asyncio.AbstractEventLoop] = None
+
+async def _close_stale_pool(pool: BrowserPool, loop: asyncio.AbstractEventLoop):
+    """Close a pool that belongs to another event loop than the running one."""
+    if pool.closed:
+        return
+    try:
+        if loop.is_running():
+            # The loop lives on in another thread, so the pool is closed there
+            asyncio.run_coroutine_threadsafe(pool.close(), loop)
+        elif not loop.is_closed():
+            await asyncio.to_thread(loop.run_until_complete, pool.close())
+        else:
+            logger.warning("Browser pool of a closed event loop cannot be closed, its browser stays up "
+                           "until the driver is collected; await close_browser_pool() before the loop ends")
+    except Exception as e:
+        logger.debug(f"Error closing stale browser pool: {str(e)}")
+
+async def get_browser_pool() -> BrowserPool:
+    """
+    Return the shared pool for the running event loop, starting it on first use.
+
+    The pool belongs to that loop and cannot be closed once the loop is
+    closed, so code that starts short-lived loops, e.g. with asyncio.run,
+    must await close_browser_pool() before the loop ends. Synchronous
+    callers should go through run_sync or iter_sync instead, which keep one
+    background loop, and with it one pool, for the life of the process.
+    """
+    global _shared_pool, _shared_loop
+    loop = asyncio.get_running_loop()
+    if _shared_pool is None or _shared_pool.closed or _shared_loop is not loop:
+        stale, stale_loop = _shared_pool, _shared_loop
+        _shared_pool = None
+        if stale is not None and stale_loop is not loop:
+            await _close_stale_pool(stale, stale_loop)
+        _shared_pool = BrowserPool()
+        _shared_loop = loop
+    return await _shared_pool.start()
+
+async def close_browser_pool():
+    """Close the shared pool, on the event loop it belongs to."""
+    global _shared_pool, _shared_loop
+    pool, loop = _shared_pool, _shared_loop
+    _shared_pool = None
+    _shared_loop = None
+    if pool is None:
+        return
+    if loop is asyncio.get_running_loop():
+        await pool.close()
+    else:
+        await _close_stale_pool(pool, loop)
+
+# Event loop used by synchronous callers, so the shared pool outlives each call
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_lock = threading.Lock()
+
+def run_sync(coro):
+    """
+    Run a coroutine on the shared background event loop and wait for its result.
+
+    Args:
+        coro: The coroutine to run
+
+    Returns:
+        The coroutine's result
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_background_loop()).result()
+
+def iter_sync(agen):
+    """
+    Iterate an async generator on the shared background event loop, yielding its items as they come.
+
+    Args:
+        agen: The async generator to iterate
+
+    Yields:
+        The async generator's items
+    """
+    items = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put((item, None))
+        except BaseException as e:
+            items.put((done, e))
+            raise
+        items.put((done, None))
+
+    future = asyncio.run_coroutine_threadsafe(pump(), _get_background_loop())
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None and not isinstance(error, asyncio.CancelledError):
+                    raise error
+                return
+            yield item
+    finally:
+        # Stops the producer when the caller breaks off early
+        future.cancel()
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever,
+                             name='browser-pool', daemon=True).start()
+            atexit.register(_stop_background_loop)
+        return _background_loop
+
+def _stop_background_loop():
+    global _background_loop
+    loop = _background_loop
+    if loop is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(close_browser_pool(), loop).result(timeout=10)
+    except Exception as e:
+        logger.debug(f"Error closing browser pool: {str(e)}")
+    loop.call_soon_threadsafe(loop.stop)
+    _background_loop = None
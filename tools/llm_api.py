@@ -1,16 +1,62 @@
 #!/usr/bin/env /workspace/tmp_windsurf/venv/bin/python3
 
-import google.generativeai as genai
-from openai import OpenAI, AzureOpenAI
-from anthropic import Anthropic
 import argparse
+import asyncio
+import atexit
+import base64
+import importlib
+import itertools
+import json
+import logging
 import os
+import re
 from dotenv import load_dotenv
 from pathlib import Path
 import sys
-import base64
-from typing import Optional, Union, List
-import mimetypes
+from typing import AsyncIterator, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+import threading
+import weakref
+from concurrent.futures import CancelledError
+
+try:
+    from tools.llm_cache import ResponseCache, SQLiteCache, RequestCoalescer, make_cache_key
+    from tools.llm_images import encode_file_base64, guess_mime_type, image_digest, prepare_image
+    from tools.llm_metrics import CallTracker, JSONLSink, add_metrics_hook, format_summary, load_metrics, summarize
+    from tools.llm_ratelimit import RateLimiter, is_rate_limit, retry_after
+except ImportError:
+    from llm_cache import ResponseCache, SQLiteCache, RequestCoalescer, make_cache_key
+    from llm_images import encode_file_base64, guess_mime_type, image_digest, prepare_image
+    from llm_metrics import CallTracker, JSONLSink, add_metrics_hook, format_summary, load_metrics, summarize
+    from llm_ratelimit import RateLimiter, is_rate_limit, retry_after
+
+logger = logging.getLogger(__name__)
+
+# Provider SDKs are slow to import, so each is imported the first time its provider is used
+_SDK_IMPORTS = {
+    'genai': ('google.generativeai', None),
+    'OpenAI': ('openai', 'OpenAI'),
+    'AzureOpenAI': ('openai', 'AzureOpenAI'),
+    'AsyncOpenAI': ('openai', 'AsyncOpenAI'),
+    'AsyncAzureOpenAI': ('openai', 'AsyncAzureOpenAI'),
+    'Anthropic': ('anthropic', 'Anthropic'),
+    'AsyncAnthropic': ('anthropic', 'AsyncAnthropic'),
+}
+
+def _sdk(name: str):
+    """Return an SDK module or class, importing it on first use."""
+    value = globals().get(name)
+    if value is None:
+        module_name, attribute = _SDK_IMPORTS[name]
+        value = importlib.import_module(module_name)
+        if attribute:
+            value = getattr(value, attribute)
+        globals()[name] = value
+    return value
+
+def __getattr__(name: str):
+    if name in _SDK_IMPORTS:
+        return _sdk(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def load_environment():
     """Load environment variables from .env files in order of precedence"""
@@ -23,28 +69,28 @@ def load_environment():
     env_files = ['.env.local', '.env', '.env.example']
     env_loaded = False
     
-    print("Current working directory:", Path('.').absolute(), file=sys.stderr)
-    print("Looking for environment files:", env_files, file=sys.stderr)
-    
     for env_file in env_files:
         env_path = Path('.') / env_file
-        print(f"Checking {env_path.absolute()}", file=sys.stderr)
         if env_path.exists():
-            print(f"Found {env_file}, loading variables...", file=sys.stderr)
             load_dotenv(dotenv_path=env_path)
             env_loaded = True
-            print(f"Loaded environment variables from {env_file}", file=sys.stderr)
-            # Print loaded keys (but not values for security)
-            with open(env_path) as f:
-                keys = [line.split('=')[0].strip() for line in f if '=' in line and not line.startswith('#')]
-                print(f"Keys loaded from {env_file}: {keys}", file=sys.stderr)
+            logger.debug(f"Loaded environment variables from {env_path.absolute()}")
     
     if not env_loaded:
-        print("Warning: No .env files found. Using system environment variables only.", file=sys.stderr)
-        print("Available system environment variables:", list(os.environ.keys()), file=sys.stderr)
+        logger.debug("No .env files found, using system environment variables only")
+
+_environment_loaded = False
+_environment_lock = threading.Lock()
 
-# Load environment variables at module import
-load_environment()
+def ensure_environment():
+    """Run load_environment the first time a provider setting is needed."""
+    global _environment_loaded
+    if _environment_loaded:
+        return
+    with _environment_lock:
+        if not _environment_loaded:
+            load_environment()
+            _environment_loaded = True
 
 def encode_image_file(image_path: str) -> tuple[str, str]:
     """
@@ -56,186 +102,994 @@ def encode_image_file(image_path: str) -> tuple[str, str]:
     Returns:
         tuple: (base64_encoded_string, mime_type)
     """
-    mime_type, _ = mimetypes.guess_type(image_path)
-    if not mime_type:
-        mime_type = 'image/png'  # Default to PNG if type cannot be determined
-        
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        
-    return encoded_string, mime_type
+    return encode_file_base64(image_path), guess_mime_type(image_path)
 
-def create_llm_client(provider="openai"):
-    if provider == "openai":
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-        return OpenAI(
-            api_key=api_key
+# Environment variable holding each provider's API key, and its endpoint (None for the SDK default)
+PROVIDER_ENDPOINTS = {
+    "openai": ('OPENAI_API_KEY', None),
+    "azure": ('AZURE_OPENAI_API_KEY', "https://msopenai.openai.azure.com"),
+    "deepseek": ('DEEPSEEK_API_KEY', "https://api.deepseek.com/v1"),
+    "anthropic": ('ANTHROPIC_API_KEY', None),
+    "gemini": ('GOOGLE_API_KEY', None),
+    "local": (None, "http://192.168.180.137:8006/v1"),
+}
+
+def create_llm_client(provider="openai", asynchronous: bool = False, http_client=None):
+    """
+    Create the SDK client of a provider.
+
+    Most callers should use get_llm_client, which reuses clients.
+
+    Args:
+        provider (str): The API provider to use
+        asynchronous (bool): Create the SDK's async client, for query_llm_async
+        http_client (optional): httpx client the SDK sends its requests through
+
+    Returns:
+        The client instance (the configured genai module for gemini)
+    """
+    if provider not in PROVIDER_ENDPOINTS:
+        raise ValueError(f"Unsupported provider: {provider}")
+    ensure_environment()
+    key_variable, endpoint = PROVIDER_ENDPOINTS[provider]
+    api_key = os.getenv(key_variable) if key_variable else "not-needed"
+    if not api_key:
+        raise ValueError(f"{key_variable} not found in environment variables")
+    options = {"http_client": http_client} if http_client is not None else {}
+
+    if provider == "gemini":
+        genai = _sdk('genai')
+        genai.configure(api_key=api_key)
+        return genai
+    elif provider == "anthropic":
+        return _sdk('AsyncAnthropic' if asynchronous else 'Anthropic')(
+            api_key=api_key,
+            **options
         )
     elif provider == "azure":
-        api_key = os.getenv('AZURE_OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("AZURE_OPENAI_API_KEY not found in environment variables")
-        return AzureOpenAI(
+        return _sdk('AsyncAzureOpenAI' if asynchronous else 'AzureOpenAI')(
             api_key=api_key,
             api_version="2024-08-01-preview",
-            azure_endpoint="https://msopenai.openai.azure.com"
+            azure_endpoint=endpoint,
+            **options
         )
-    elif provider == "deepseek":
-        api_key = os.getenv('DEEPSEEK_API_KEY')
-        if not api_key:
-            raise ValueError("DEEPSEEK_API_KEY not found in environment variables")
-        return OpenAI(
+    elif endpoint is None:
+        return _sdk('AsyncOpenAI' if asynchronous else 'OpenAI')(
             api_key=api_key,
-            base_url="https://api.deepseek.com/v1",
+            **options
         )
-    elif provider == "anthropic":
-        api_key = os.getenv('ANTHROPIC_API_KEY')
-        if not api_key:
-            raise ValueError("ANTHROPIC_API_KEY not found in environment variables")
-        return Anthropic(
-            api_key=api_key
+    return _sdk('AsyncOpenAI' if asynchronous else 'OpenAI')(
+        api_key=api_key,
+        base_url=endpoint,
+        **options
+    )
+
+class ClientRegistry:
+    """
+    Thread-safe store of SDK clients, one per (provider, endpoint, API key).
+
+    Clients are created on first use and share a pooled HTTP connection
+    pool sized by the constructor arguments. Async clients are bound to
+    the event loop they were created on, so they are kept per loop.
+    Gemini's SDK is configured globally, so it is only reconfigured when
+    its API key changes.
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0):
+        """
+        Args:
+            max_connections (int): Maximum open connections per client
+            max_keepalive_connections (int): Idle connections kept alive per client
+            keepalive_expiry (float): Seconds an idle connection is kept alive
+        """
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self._clients = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._gemini_key = None
+        self._lock = threading.Lock()
+
+    def get(self, provider: str = "openai", asynchronous: bool = False):
+        """Return the shared client of a provider, creating it on first use."""
+        if provider not in PROVIDER_ENDPOINTS:
+            raise ValueError(f"Unsupported provider: {provider}")
+        ensure_environment()
+        key_variable, endpoint = PROVIDER_ENDPOINTS[provider]
+        key = (provider, endpoint, os.getenv(key_variable) if key_variable else None)
+        with self._lock:
+            if provider == "gemini":
+                if self._gemini_key != key:
+                    create_llm_client(provider)
+                    self._gemini_key = key
+                return _sdk('genai')
+            if asynchronous:
+                clients = self._async_clients.setdefault(asyncio.get_running_loop(), {})
+            else:
+                clients = self._clients
+            client = clients.get(key)
+            if client is None:
+                client = clients[key] = create_llm_client(
+                    provider, asynchronous, self._http_client(provider, asynchronous)
+                )
+            return client
+
+    def close(self):
+        """Close the synchronous clients and forget the async ones."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._async_clients.clear()
+            self._gemini_key = None
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                print(f"Error closing LLM client: {e}", file=sys.stderr)
+
+    async def aclose(self):
+        """Close the async clients of the running event loop."""
+        with self._lock:
+            clients = list(self._async_clients.pop(asyncio.get_running_loop(), {}).values())
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                print(f"Error closing LLM client: {e}", file=sys.stderr)
+
+    def _http_client(self, provider: str, asynchronous: bool):
+        import httpx
+        if provider == "anthropic":
+            import anthropic as sdk
+        else:
+            import openai as sdk
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
         )
+        http_client_cls = sdk.DefaultAsyncHttpxClient if asynchronous else sdk.DefaultHttpxClient
+        return http_client_cls(limits=limits)
+
+# Registry used when query_llm and friends are called without a client
+_registry = ClientRegistry()
+
+def get_llm_client(provider: str = "openai", asynchronous: bool = False):
+    """Return the shared client of a provider."""
+    return _registry.get(provider, asynchronous)
+
+def configure_llm_clients(**options):
+    """Replace the shared clients with ones using the given ClientRegistry options."""
+    global _registry
+    previous, _registry = _registry, ClientRegistry(**options)
+    previous.close()
+
+def close_llm_clients():
+    """Close the shared synchronous clients."""
+    _registry.close()
+
+async def aclose_llm_clients():
+    """Close the shared async clients of the running event loop."""
+    await _registry.aclose()
+
+atexit.register(close_llm_clients)
+
+# Providers served through the OpenAI chat completions API
+OPENAI_COMPATIBLE = ["openai", "local", "deepseek", "azure"]
+
+def default_model(provider: str) -> Optional[str]:
+    """Return the model used when query_llm is called without one."""
+    ensure_environment()
+    if provider == "openai":
+        return "gpt-4o"
+    elif provider == "azure":
+        return os.getenv('AZURE_OPENAI_MODEL_DEPLOYMENT', 'gpt-4o-ms')  # Get from env with fallback
+    elif provider == "deepseek":
+        return "deepseek-chat"
+    elif provider == "anthropic":
+        return "claude-3-sonnet-20240229"
     elif provider == "gemini":
-        api_key = os.getenv('GOOGLE_API_KEY')
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY not found in environment variables")
-        genai.configure(api_key=api_key)
-        return genai
+        return "gemini-pro"
     elif provider == "local":
-        return OpenAI(
-            base_url="http://192.168.180.137:8006/v1",
-            api_key="not-needed"
-        )
-    else:
-        raise ValueError(f"Unsupported provider: {provider}")
+        return "Qwen/Qwen2.5-32B-Instruct-AWQ"
+    return None
+
+def sampling_params(provider: str, model: str) -> dict:
+    """Return the sampling parameters sent with a request to the given model."""
+    if provider in OPENAI_COMPATIBLE:
+        # o1 does not accept a temperature
+        if model == "o1":
+            return {"response_format": {"type": "text"}, "reasoning_effort": "low"}
+        return {"temperature": 0.7}
+    elif provider == "anthropic":
+        return {"max_tokens": 1000}
+    return {}
+
+# OpenAI-compatible providers whose models accept images
+VISION_PROVIDERS = ["openai", "local", "azure"]
+
+# A single image path or a list of them
+ImagePaths = Optional[Union[str, List[str]]]
+
+class ImagePart(NamedTuple):
+    """An image placed between the text parts of a request."""
+    path: str
 
-def query_llm(prompt: str, client=None, model=None, provider="openai", image_path: Optional[str] = None) -> Optional[str]:
+class SystemPart(NamedTuple):
     """
-    Query an LLM with a prompt and optional image attachment.
+    A system prompt, always the first item of a request.
+
+    It is sent ahead of everything else so that requests sharing it share
+    a prefix: Anthropic gets a cache-control breakpoint after it, and
+    OpenAI caches such prefixes automatically once they exceed 1024 tokens.
+    """
+    text: str
+
+# Leads a request that packs several questions together
+PACKED_INSTRUCTIONS = (
+    "Answer each of the {count} numbered questions below. The images following a question belong to it. "
+    "Reply with only a JSON array of {count} strings, where element i is the answer to question i."
+)
+
+class Usage(NamedTuple):
+    """Token counts a provider reports for one request; input_tokens includes cache_read_tokens."""
+    input_tokens: int
+    output_tokens: int
+    cache_read_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+# Rough token cost used to reserve rate-limit budget before the real usage is known
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 1000
+DEFAULT_OUTPUT_TOKENS = 1000
+
+# Times a call is queued again after a 429 when a rate limit is configured for it
+RATE_LIMIT_RETRIES = 3
+
+# Request and token budgets shared by every call in the process
+_rate_limiter = RateLimiter()
+
+def set_rate_limit(provider: str, model: Optional[str] = None, rpm: Optional[float] = None,
+                   tpm: Optional[float] = None):
+    """
+    Limit the requests and tokens per minute sent to a provider or model.
+
+    Calls beyond the budget wait their turn, first come first served,
+    instead of running into the provider's 429s. Passing neither rpm nor
+    tpm removes the limit.
+    """
+    _rate_limiter.set_limit(provider, model, rpm, tpm)
+
+def estimate_tokens(content: list, provider: str, model: str) -> int:
+    """Estimate the input plus output tokens of a request before sending it."""
+    tokens = 0
+    for item in content:
+        if isinstance(item, ImagePart):
+            tokens += IMAGE_TOKENS
+        else:
+            tokens += len(item.text if isinstance(item, SystemPart) else item) // CHARS_PER_TOKEN + 1
+    return tokens + sampling_params(provider, model).get("max_tokens", DEFAULT_OUTPUT_TOKENS)
+
+# Identical requests in flight at the same time share one API call
+_coalescer = RequestCoalescer()
+
+class BatchResult(NamedTuple):
+    """Outcome of one prompt of a batch: the response, or the error that prevented it."""
+    response: Optional[str]
+    error: Optional[Exception] = None
+
+def query_llm(prompt: str, client=None, model=None, provider="openai", image_path: ImagePaths = None,
+              cache: Optional[ResponseCache] = None, bypass_cache: bool = False,
+              raise_errors: bool = False, system: Optional[str] = None,
+              cancel: Optional[threading.Event] = None) -> Optional[str]:
+    """
+    Query an LLM with a prompt and optional image attachments.
     
     Args:
         prompt (str): The text prompt to send
         client: The LLM client instance
         model (str, optional): The model to use
         provider (str): The API provider to use
-        image_path (str, optional): Path to an image file to attach
+        image_path (str or List[str], optional): Path of an image file to attach, or a list of them
+        cache (ResponseCache, optional): Cache to serve and store responses
+        bypass_cache (bool): Always query the provider, but still store the response
+        raise_errors (bool): Raise the provider's exception instead of returning None
+        system (str, optional): System prompt sent ahead of the prompt; keep it identical across
+            calls so providers can serve it from their prompt cache
+        cancel (threading.Event, optional): Once set, the call gives up with CancelledError instead
+            of sending the request, or sending it again after a rate limit. A request already sent
+            cannot be called back.
         
     Returns:
         Optional[str]: The LLM's response or None if there was an error
     """
     if client is None:
-        client = create_llm_client(provider)
+        client = get_llm_client(provider)
+    if model is None:
+        model = default_model(provider)
     
     try:
-        # Set default model
-        if model is None:
-            if provider == "openai":
-                model = "gpt-4o"
-            elif provider == "azure":
-                model = os.getenv('AZURE_OPENAI_MODEL_DEPLOYMENT', 'gpt-4o-ms')  # Get from env with fallback
-            elif provider == "deepseek":
-                model = "deepseek-chat"
-            elif provider == "anthropic":
-                model = "claude-3-sonnet-20240229"
-            elif provider == "gemini":
-                model = "gemini-pro"
-            elif provider == "local":
-                model = "Qwen/Qwen2.5-32B-Instruct-AWQ"
-        
-        if provider in ["openai", "local", "deepseek", "azure"]:
-            messages = [{"role": "user", "content": []}]
-            
-            # Add text content
-            messages[0]["content"].append({
-                "type": "text",
-                "text": prompt
-            })
-            
-            # Add image content if provided
-            if image_path:
-                if provider == "openai":
-                    encoded_image, mime_type = encode_image_file(image_path)
-                    messages[0]["content"] = [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{encoded_image}"}}
-                    ]
-            
-            kwargs = {
-                "model": model,
-                "messages": messages,
-                "temperature": 0.7,
-            }
-            
-            # Add o1-specific parameters
-            if model == "o1":
-                kwargs["response_format"] = {"type": "text"}
-                kwargs["reasoning_effort"] = "low"
-                del kwargs["temperature"]
-            
-            response = client.chat.completions.create(**kwargs)
-            return response.choices[0].message.content
-            
-        elif provider == "anthropic":
-            messages = [{"role": "user", "content": []}]
-            
-            # Add text content
-            messages[0]["content"].append({
-                "type": "text",
-                "text": prompt
-            })
-            
-            # Add image content if provided
-            if image_path:
-                encoded_image, mime_type = encode_image_file(image_path)
-                messages[0]["content"].append({
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": mime_type,
-                        "data": encoded_image
-                    }
-                })
-            
-            response = client.messages.create(
-                model=model,
-                max_tokens=1000,
-                messages=messages
-            )
-            return response.content[0].text
-            
-        elif provider == "gemini":
-            model = client.GenerativeModel(model)
-            response = model.generate_content(prompt)
-            return response.text
-            
+        return _query(_content(prompt, image_path, system), client, model, provider, cache, bypass_cache,
+                      cancel)
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error querying LLM: {e}", file=sys.stderr)
         return None
 
+async def query_llm_async(prompt: str, client=None, model=None, provider="openai", image_path: ImagePaths = None,
+                          cache: Optional[ResponseCache] = None, bypass_cache: bool = False,
+                          raise_errors: bool = False, system: Optional[str] = None) -> Optional[str]:
+    """
+    Asynchronous variant of query_llm using the providers' async clients.
+
+    Takes the same arguments as query_llm; a given client must come from
+    get_llm_client(provider, asynchronous=True).
+
+    Returns:
+        Optional[str]: The LLM's response or None if there was an error
+    """
+    if client is None:
+        client = get_llm_client(provider, asynchronous=True)
+    if model is None:
+        model = default_model(provider)
+
+    try:
+        return await _query_async(_content(prompt, image_path, system), client, model, provider, cache,
+                                  bypass_cache)
+    except Exception as e:
+        if raise_errors:
+            raise
+        print(f"Error querying LLM: {e}", file=sys.stderr)
+        return None
+
+async def query_llm_batch_async(prompts: Iterable[str], concurrency: int = 8, client=None, model=None,
+                                provider="openai", image_path: ImagePaths = None,
+                                cache: Optional[ResponseCache] = None, bypass_cache: bool = False,
+                                system: Optional[str] = None) -> List[BatchResult]:
+    """
+    Query an LLM with many prompts, at most ``concurrency`` at a time.
+
+    Args:
+        prompts (Iterable[str]): The text prompts to send
+        concurrency (int): Maximum number of requests in flight
+        client: An async LLM client instance, the shared one when omitted
+        model, provider, image_path, cache, bypass_cache, system: As for query_llm
+
+    Returns:
+        List[BatchResult]: One result per prompt, in input order
+    """
+    if client is None:
+        client = get_llm_client(provider, asynchronous=True)
+    if model is None:
+        model = default_model(provider)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(prompt: str) -> BatchResult:
+        async with semaphore:
+            try:
+                return BatchResult(await _query_async(_content(prompt, image_path, system), client, model,
+                                                      provider, cache, bypass_cache))
+            except Exception as e:
+                return BatchResult(None, e)
+
+    return list(await asyncio.gather(*(run(prompt) for prompt in prompts)))
+
+def query_llm_batch(prompts: Iterable[str], concurrency: int = 8, **kwargs) -> List[BatchResult]:
+    """
+    Synchronous wrapper around query_llm_batch_async.
+
+    Returns:
+        List[BatchResult]: One result per prompt, in input order
+    """
+    async def run():
+        try:
+            return await query_llm_batch_async(prompts, concurrency, **kwargs)
+        finally:
+            # The event loop ends here, taking its async clients with it
+            await aclose_llm_clients()
+
+    return asyncio.run(run())
+
+def query_llm_packed(questions: List[Tuple[str, ImagePaths]], client=None, model=None, provider="openai",
+                     max_per_request: int = 10, cache: Optional[ResponseCache] = None,
+                     bypass_cache: bool = False, system: Optional[str] = None) -> List[Optional[str]]:
+    """
+    Ask several questions, each with its own images, in as few requests as possible.
+
+    Up to ``max_per_request`` questions share one request, and the model
+    is asked to answer them as a JSON array. When a reply cannot be split
+    into one answer per question, that request's questions are asked one
+    by one instead.
+
+    Args:
+        questions (List[Tuple[str, ImagePaths]]): (question, image_path) pairs, image_path as for query_llm
+        client: The LLM client instance
+        model (str, optional): The model to use
+        provider (str): The API provider to use
+        max_per_request (int): Maximum number of questions packed into one request
+        cache (ResponseCache, optional): Cache to serve and store responses
+        bypass_cache (bool): Always query the provider, but still store the response
+        system (str, optional): System prompt sent ahead of every request
+
+    Returns:
+        List[Optional[str]]: One answer per question, in input order, None where the query failed
+    """
+    if client is None:
+        client = get_llm_client(provider)
+    if model is None:
+        model = default_model(provider)
+
+    answers = []
+    for start in range(0, len(questions), max_per_request):
+        group = questions[start:start + max_per_request]
+        answers.extend(_ask_packed(group, client, model, provider, cache, bypass_cache, system))
+    return answers
+
+def stream_llm(prompt: str, client=None, model=None, provider="openai", image_path: ImagePaths = None,
+               cache: Optional[ResponseCache] = None, bypass_cache: bool = False,
+               system: Optional[str] = None) -> Iterator[str]:
+    """
+    Query an LLM and yield the response text as it is generated.
+
+    Takes the same arguments as query_llm. A cached response is yielded
+    as a single piece; a streamed one is stored once it is complete. On
+    error the message is printed and the stream ends early.
+
+    Yields:
+        str: Consecutive pieces of the response
+    """
+    if client is None:
+        client = get_llm_client(provider)
+    if model is None:
+        model = default_model(provider)
+
+    call = CallTracker(provider, model, streamed=True)
+    try:
+        content = _content(prompt, image_path, system)
+        key = _cache_key(content, model, provider) if cache is not None else None
+        if key is not None:
+            call.cache = "bypass" if bypass_cache else "miss"
+        cached = cache.get(key) if key is not None and not bypass_cache else None
+        if cached is not None:
+            call.cache = "hit"
+            call.first_byte()
+            yield cached
+            return
+        pieces = []
+        for delta in _stream(content, client, model, provider):
+            call.first_byte()
+            pieces.append(delta)
+            yield delta
+        if key is not None:
+            cache.set(key, "".join(pieces))
+    except Exception as e:
+        call.fail(e)
+        print(f"Error querying LLM: {e}", file=sys.stderr)
+    finally:
+        call.finish()
+
+async def stream_llm_async(prompt: str, client=None, model=None, provider="openai",
+                           image_path: ImagePaths = None, cache: Optional[ResponseCache] = None,
+                           bypass_cache: bool = False, system: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Asynchronous variant of stream_llm using the providers' async clients.
+
+    Yields:
+        str: Consecutive pieces of the response
+    """
+    if client is None:
+        client = get_llm_client(provider, asynchronous=True)
+    if model is None:
+        model = default_model(provider)
+
+    call = CallTracker(provider, model, streamed=True)
+    try:
+        content = _content(prompt, image_path, system)
+        key = _cache_key(content, model, provider) if cache is not None else None
+        if key is not None:
+            call.cache = "bypass" if bypass_cache else "miss"
+        cached = cache.get(key) if key is not None and not bypass_cache else None
+        if cached is not None:
+            call.cache = "hit"
+            call.first_byte()
+            yield cached
+            return
+        pieces = []
+        async for delta in _stream_async(content, client, model, provider):
+            call.first_byte()
+            pieces.append(delta)
+            yield delta
+        if key is not None:
+            cache.set(key, "".join(pieces))
+    except Exception as e:
+        call.fail(e)
+        print(f"Error querying LLM: {e}", file=sys.stderr)
+    finally:
+        call.finish()
+
+def request_body(prompt: str, model=None, provider="openai", image_path: ImagePaths = None,
+                 system: Optional[str] = None) -> dict:
+    """
+    Return the JSON body query_llm would send, for submitting requests through a provider's batch API.
+
+    Args:
+        prompt, model, provider, image_path, system: As for query_llm
+
+    Returns:
+        dict: A chat completions body for OpenAI-compatible providers, a messages body for Anthropic
+    """
+    if model is None:
+        model = default_model(provider)
+    content = _content(prompt, image_path, system)
+    if provider in OPENAI_COMPATIBLE:
+        return {"model": model, "messages": _openai_messages(content, provider), **sampling_params(provider, model)}
+    elif provider == "anthropic":
+        return {"model": model, **_anthropic_payload(content), **sampling_params(provider, model)}
+    raise ValueError(f"Provider {provider} has no batch API")
+
+def _image_parts(image_path: ImagePaths) -> list:
+    paths = [image_path] if isinstance(image_path, str) else list(image_path or [])
+    return [ImagePart(path) for path in paths]
+
+def _content(prompt: str, image_path: ImagePaths, system: Optional[str] = None) -> list:
+    return _system_parts(system) + [prompt] + _image_parts(image_path)
+
+def _system_parts(system: Optional[str]) -> list:
+    return [SystemPart(system)] if system else []
+
+def _split_system(content: list) -> Tuple[Optional[str], list]:
+    if content and isinstance(content[0], SystemPart):
+        return content[0].text, content[1:]
+    return None, content
+
+def _packed_content(questions: List[Tuple[str, ImagePaths]], system: Optional[str] = None) -> list:
+    content = _system_parts(system) + [PACKED_INSTRUCTIONS.format(count=len(questions))]
+    for number, (question, image_path) in enumerate(questions, 1):
+        content.append(f"Question {number}: {question}")
+        content.extend(_image_parts(image_path))
+    return content
+
+def _split_packed_reply(reply: Optional[str], count: int) -> Optional[List[str]]:
+    match = re.search(r"\[.*\]", reply or "", re.DOTALL)
+    if not match:
+        return None
+    try:
+        answers = json.loads(match.group(0))
+    except ValueError:
+        return None
+    if not isinstance(answers, list) or len(answers) != count:
+        return None
+    return [answer if isinstance(answer, str) else json.dumps(answer) for answer in answers]
+
+def _ask_packed(questions: List[Tuple[str, ImagePaths]], client, model: str, provider: str,
+                cache: Optional[ResponseCache], bypass_cache: bool,
+                system: Optional[str] = None) -> List[Optional[str]]:
+    if len(questions) > 1:
+        try:
+            reply = _query(_packed_content(questions, system), client, model, provider, cache, bypass_cache)
+        except Exception as e:
+            print(f"Error querying LLM: {e}", file=sys.stderr)
+            return [None] * len(questions)
+        answers = _split_packed_reply(reply, len(questions))
+        if answers is not None:
+            return answers
+        print("Could not split the packed reply, asking the questions separately", file=sys.stderr)
+    return [query_llm(question, client, model, provider, image_path, cache, bypass_cache, system=system)
+            for question, image_path in questions]
+
+def _cache_key(content: list, model: str, provider: str) -> str:
+    if len(content) == 1:
+        return make_cache_key(provider, model, content[0], None, sampling_params(provider, model))
+    # Images are identified by content, and their position among the texts matters
+    parts = [item if isinstance(item, str) else
+             {"system": item.text} if isinstance(item, SystemPart) else
+             {"image": image_digest(item.path)} for item in content]
+    return make_cache_key(provider, model, json.dumps(parts, ensure_ascii=False), None,
+                          sampling_params(provider, model))
+
+def _query(content: list, client, model: str, provider: str,
+           cache: Optional[ResponseCache], bypass_cache: bool,
+           cancel: Optional[threading.Event] = None) -> Optional[str]:
+    call = CallTracker(provider, model)
+    try:
+        if cache is None:
+            return _request(content, client, model, provider, call, cancel)
+        key = _cache_key(content, model, provider)
+        if not bypass_cache:
+            cached = cache.get(key)
+            if cached is not None:
+                call.cache = "hit"
+                return cached
+
+        def fetch():
+            call.cache = "bypass" if bypass_cache else "miss"
+            response = _request(content, client, model, provider, call, cancel)
+            if response is not None:
+                cache.set(key, response)
+            return response
+
+        if bypass_cache:
+            return fetch()
+        # Stays "coalesced" when an identical request in flight answers for this one
+        call.cache = "coalesced"
+        return _coalescer.run(key, fetch)
+    except Exception as e:
+        call.fail(e)
+        raise
+    finally:
+        call.finish()
+
+async def _query_async(content: list, client, model: str, provider: str,
+                       cache: Optional[ResponseCache], bypass_cache: bool) -> Optional[str]:
+    call = CallTracker(provider, model)
+    try:
+        if cache is None:
+            return await _request_async(content, client, model, provider, call)
+        key = _cache_key(content, model, provider)
+        if not bypass_cache:
+            cached = cache.get(key)
+            if cached is not None:
+                call.cache = "hit"
+                return cached
+
+        async def fetch():
+            call.cache = "bypass" if bypass_cache else "miss"
+            response = await _request_async(content, client, model, provider, call)
+            if response is not None:
+                cache.set(key, response)
+            return response
+
+        if bypass_cache:
+            return await fetch()
+        call.cache = "coalesced"
+        return await _coalescer.run_async(key, fetch)
+    except Exception as e:
+        call.fail(e)
+        raise
+    finally:
+        call.finish()
+
+def _openai_messages(content: list, provider: str) -> list:
+    system, content = _split_system(content)
+    if provider not in VISION_PROVIDERS and any(isinstance(item, ImagePart) for item in content):
+        # Text-only models still get the prompt, just without its images
+        print(f"Provider {provider} does not accept images, sending the text only", file=sys.stderr)
+        content = [item for item in content if not isinstance(item, ImagePart)]
+    parts = []
+    for item in content:
+        if isinstance(item, ImagePart):
+            encoded_image, mime_type = prepare_image(item.path, provider)
+            parts.append({"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{encoded_image}"}})
+        else:
+            parts.append({"type": "text", "text": item})
+    messages = [{"role": "user", "content": parts}]
+    # The system message leads, so calls sharing it share a cacheable prefix
+    return ([{"role": "system", "content": system}] + messages) if system else messages
+
+def _anthropic_payload(content: list) -> dict:
+    """Return the messages, and the system prompt marked for prompt caching, of an Anthropic request."""
+    system, content = _split_system(content)
+    payload = {"messages": _anthropic_messages(content)}
+    if system:
+        payload["system"] = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+    return payload
+
+def _anthropic_messages(content: list) -> list:
+    parts = []
+    for item in content:
+        if isinstance(item, ImagePart):
+            encoded_image, mime_type = prepare_image(item.path, "anthropic")
+            parts.append({
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": mime_type,
+                    "data": encoded_image
+                }
+            })
+        else:
+            parts.append({"type": "text", "text": item})
+    return [{"role": "user", "content": parts}]
+
+def _gemini_model(client, model: str, content: list):
+    system, _ = _split_system(content)
+    if system:
+        return client.GenerativeModel(model, system_instruction=system)
+    return client.GenerativeModel(model)
+
+def _gemini_content(content: list):
+    _, content = _split_system(content)
+    if len(content) == 1:
+        return content[0]
+    parts = []
+    for item in content:
+        if isinstance(item, ImagePart):
+            encoded_image, mime_type = prepare_image(item.path, "gemini")
+            parts.append({"mime_type": mime_type, "data": base64.b64decode(encoded_image)})
+        else:
+            parts.append(item)
+    return parts
+
+def _request(content: list, client, model: str, provider: str, call: CallTracker,
+             cancel: Optional[threading.Event] = None) -> Optional[str]:
+    estimate = estimate_tokens(content, provider, model)
+    for attempt in itertools.count():
+        call.retries = attempt
+        _rate_limiter.acquire(provider, model, estimate)
+        if cancel is not None and cancel.is_set():
+            # Give the reserved budget back unused
+            _rate_limiter.record(provider, model, estimate, 0)
+            raise CancelledError("LLM request cancelled before it was sent")
+        try:
+            text, usage = _send(content, client, model, provider)
+        except Exception as e:
+            if not _requeue_after(e, provider, model, estimate, attempt):
+                raise
+            continue
+        _rate_limiter.record(provider, model, estimate, usage.total_tokens if usage else None)
+        call.record_usage(usage)
+        return text
+
+async def _request_async(content: list, client, model: str, provider: str, call: CallTracker) -> Optional[str]:
+    estimate = estimate_tokens(content, provider, model)
+    for attempt in itertools.count():
+        call.retries = attempt
+        await _rate_limiter.acquire_async(provider, model, estimate)
+        try:
+            text, usage = await _send_async(content, client, model, provider)
+        except Exception as e:
+            if not _requeue_after(e, provider, model, estimate, attempt):
+                raise
+            continue
+        _rate_limiter.record(provider, model, estimate, usage.total_tokens if usage else None)
+        call.record_usage(usage)
+        return text
+
+def _requeue_after(error: Exception, provider: str, model: str, estimate: int, attempt: int) -> bool:
+    """Give back a failed call's tokens; on a rate limit under a configured budget, queue it again."""
+    _rate_limiter.record(provider, model, estimate, 0)
+    if not (is_rate_limit(error) and _rate_limiter.limited(provider, model) and attempt < RATE_LIMIT_RETRIES):
+        return False
+    _rate_limiter.penalize(provider, model, retry_after(error) or 1.0)
+    return True
+
+def _send(content: list, client, model: str, provider: str) -> Tuple[Optional[str], Optional[Usage]]:
+    if provider in OPENAI_COMPATIBLE:
+        response = client.chat.completions.create(
+            model=model,
+            messages=_openai_messages(content, provider),
+            **sampling_params(provider, model)
+        )
+        return response.choices[0].message.content, _usage(response, provider)
+    elif provider == "anthropic":
+        response = client.messages.create(
+            model=model,
+            **_anthropic_payload(content),
+            **sampling_params(provider, model)
+        )
+        return response.content[0].text, _usage(response, provider)
+    elif provider == "gemini":
+        response = _gemini_model(client, model, content).generate_content(_gemini_content(content))
+        return response.text, _usage(response, provider)
+    raise ValueError(f"Unsupported provider: {provider}")
+
+async def _send_async(content: list, client, model: str, provider: str) -> Tuple[Optional[str], Optional[Usage]]:
+    if provider in OPENAI_COMPATIBLE:
+        response = await client.chat.completions.create(
+            model=model,
+            messages=_openai_messages(content, provider),
+            **sampling_params(provider, model)
+        )
+        return response.choices[0].message.content, _usage(response, provider)
+    elif provider == "anthropic":
+        response = await client.messages.create(
+            model=model,
+            **_anthropic_payload(content),
+            **sampling_params(provider, model)
+        )
+        return response.content[0].text, _usage(response, provider)
+    elif provider == "gemini":
+        response = await _gemini_model(client, model, content).generate_content_async(_gemini_content(content))
+        return response.text, _usage(response, provider)
+    raise ValueError(f"Unsupported provider: {provider}")
+
+def _usage(response, provider: str) -> Optional[Usage]:
+    """Read the token counts a provider reports with its response."""
+    if provider in OPENAI_COMPATIBLE:
+        usage = getattr(response, "usage", None)
+        counts = (getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None))
+        details = getattr(usage, "prompt_tokens_details", None)
+        cache_read = getattr(details, "cached_tokens", None)
+    elif provider == "anthropic":
+        usage = getattr(response, "usage", None)
+        counts = (getattr(usage, "input_tokens", None), getattr(usage, "output_tokens", None))
+        cache_read = getattr(usage, "cache_read_input_tokens", None)
+        cache_write = getattr(usage, "cache_creation_input_tokens", None)
+        if isinstance(counts[0], int):
+            # Anthropic counts cached input apart from input_tokens
+            cached = sum(count for count in (cache_read, cache_write) if isinstance(count, int))
+            counts = (counts[0] + cached, counts[1])
+    else:
+        usage = getattr(response, "usage_metadata", None)
+        counts = (getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None))
+        cache_read = getattr(usage, "cached_content_token_count", None)
+    if not all(isinstance(count, int) for count in counts):
+        return None
+    return Usage(*counts, cache_read if isinstance(cache_read, int) else 0)
+
+def _stream(content: list, client, model: str, provider: str) -> Iterator[str]:
+    # Streams are charged their estimate, their usage is not reported
+    _rate_limiter.acquire(provider, model, estimate_tokens(content, provider, model))
+    if provider in OPENAI_COMPATIBLE:
+        stream = client.chat.completions.create(
+            model=model,
+            messages=_openai_messages(content, provider),
+            stream=True,
+            **sampling_params(provider, model)
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    elif provider == "anthropic":
+        with client.messages.stream(
+            model=model,
+            **_anthropic_payload(content),
+            **sampling_params(provider, model)
+        ) as stream:
+            yield from stream.text_stream
+    elif provider == "gemini":
+        for chunk in _gemini_model(client, model, content).generate_content(_gemini_content(content), stream=True):
+            if chunk.text:
+                yield chunk.text
+    else:
+        raise ValueError(f"Unsupported provider: {provider}")
+
+async def _stream_async(content: list, client, model: str, provider: str) -> AsyncIterator[str]:
+    await _rate_limiter.acquire_async(provider, model, estimate_tokens(content, provider, model))
+    if provider in OPENAI_COMPATIBLE:
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=_openai_messages(content, provider),
+            stream=True,
+            **sampling_params(provider, model)
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    elif provider == "anthropic":
+        async with client.messages.stream(
+            model=model,
+            **_anthropic_payload(content),
+            **sampling_params(provider, model)
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+    elif provider == "gemini":
+        response = await _gemini_model(client, model, content).generate_content_async(_gemini_content(content), stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+    else:
+        raise ValueError(f"Unsupported provider: {provider}")
+
+PROVIDERS = ['openai', 'anthropic', 'gemini', 'local', 'deepseek', 'azure']
+
+def parse_targets(value: str) -> List[Tuple[str, Optional[str]]]:
+    """Parse comma-separated provider[:model] entries, as given to --provider."""
+    targets = []
+    for entry in value.split(','):
+        provider, _, model = entry.strip().partition(':')
+        if provider not in PROVIDERS:
+            raise argparse.ArgumentTypeError(f"invalid provider: {provider!r} (choose from {', '.join(PROVIDERS)})")
+        targets.append((provider, model or None))
+    return targets
+
 def main():
     parser = argparse.ArgumentParser(description='Query an LLM with a prompt')
-    parser.add_argument('--prompt', type=str, help='The prompt to send to the LLM', required=True)
-    parser.add_argument('--provider', choices=['openai','anthropic','gemini','local','deepseek','azure'], default='openai', help='The API provider to use')
+    parser.add_argument('--prompt', type=str, help='The prompt to send to the LLM')
+    parser.add_argument('--provider', type=parse_targets, default='openai', metavar='PROVIDER[:MODEL][,...]',
+                        help=f"The API provider to use, one of {', '.join(PROVIDERS)}. Several comma-separated "
+                             "providers, each optionally with a model, fail over to each other in order")
+    parser.add_argument('--hedge-after', type=float, metavar='SECONDS',
+                        help='With several providers, also ask the next one when an answer takes this long')
     parser.add_argument('--model', type=str, help='The model to use (default depends on provider)')
-    parser.add_argument('--image', type=str, help='Path to an image file to attach to the prompt')
+    parser.add_argument('--image', type=str, nargs='+', help='Path of one or more image files to attach to the prompt')
+    parser.add_argument('--system', type=str, help='System prompt sent ahead of the prompt')
+    parser.add_argument('--system-file', type=str, metavar='PATH',
+                        help='Read the system prompt from a file, e.g. a preamble shared by many calls')
+    parser.add_argument('--cache', type=str, metavar='PATH',
+                        help='SQLite file caching responses to identical requests')
+    parser.add_argument('--cache-ttl', type=float, help='Seconds a cached response stays valid (default: forever)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Query the provider even when a cached response exists')
+    parser.add_argument('--stream', action='store_true',
+                        help='Print the response as it is generated')
+    parser.add_argument('--metrics-log', type=str, metavar='PATH',
+                        help='Append the metrics of each call to this JSONL file')
+    parser.add_argument('--stats', type=str, metavar='PATH',
+                        help='Print latency percentiles, token and cache totals of a metrics log and exit')
+    parser.add_argument('--batch', type=str, metavar='INPUT',
+                        help='Run a JSONL file of prompts as a resumable batch job instead of a single prompt')
+    parser.add_argument('--output', type=str, metavar='PATH', help='JSONL file receiving the batch responses')
+    parser.add_argument('--batch-mode', choices=['auto', 'api', 'local'], default='auto',
+                        help="Use the provider's batch API, or send the prompts concurrently from here")
+    parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight in local batch mode')
+    parser.add_argument('--poll-interval', type=float, default=60.0,
+                        help='Seconds between checks on submitted batches')
     args = parser.parse_args()
+    if args.stats:
+        print(format_summary(summarize(load_metrics(args.stats))))
+        return
+    if args.batch and not args.output:
+        parser.error('--batch requires --output')
+    if not args.prompt and not args.batch:
+        parser.error('--prompt is required')
+    targets = args.provider
+    if len(targets) > 1:
+        if args.model:
+            parser.error('--model needs a single provider; give several as provider:model instead')
+        if args.stream or args.batch:
+            parser.error('--stream and --batch need a single provider')
+    elif args.hedge_after is not None:
+        parser.error('--hedge-after needs several providers')
+    args.provider, model = targets[0]
+    args.model = args.model or model
+    ensure_environment()
+    if args.metrics_log:
+        add_metrics_hook(JSONLSink(args.metrics_log))
+    if args.system_file:
+        args.system = Path(args.system_file).read_text(encoding='utf-8')
+
+    if args.batch:
+        try:
+            from tools.llm_batch import BatchJob
+        except ImportError:
+            from llm_batch import BatchJob
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        job = BatchJob(args.batch, args.output, provider=args.provider, model=args.model, mode=args.batch_mode,
+                       concurrency=args.concurrency, poll_interval=args.poll_interval, system=args.system)
+        counts = job.run()
+        print(f"{counts['done']} done, {counts['failed']} failed, results in {args.output}")
+        return
+
+    cache = SQLiteCache(args.cache, ttl=args.cache_ttl) if args.cache else None
+    if len(targets) > 1:
+        try:
+            from tools.llm_router import LLMRouter
+        except ImportError:
+            from llm_router import LLMRouter
+        router = LLMRouter(targets, hedge_after=args.hedge_after)
+        try:
+            response = router.query(args.prompt, image_path=args.image, cache=cache, bypass_cache=args.no_cache,
+                                    system=args.system)
+        finally:
+            router.close()
+        print(response if response else "Failed to get response from LLM")
+        return
 
     if not args.model:
-        if args.provider == 'openai':
-            args.model = "gpt-4o" 
-        elif args.provider == "deepseek":
-            args.model = "deepseek-chat"
-        elif args.provider == 'anthropic':
-            args.model = "claude-3-5-sonnet-20241022"
-        elif args.provider == 'gemini':
-            args.model = "gemini-2.0-flash-exp"
-        elif args.provider == 'azure':
-            args.model = os.getenv('AZURE_OPENAI_MODEL_DEPLOYMENT', 'gpt-4o-ms')  # Get from env with fallback
-
-    client = create_llm_client(args.provider)
-    response = query_llm(args.prompt, client, model=args.model, provider=args.provider, image_path=args.image)
+        args.model = default_model(args.provider)
+    client = get_llm_client(args.provider)
+    if args.stream:
+        received = False
+        for delta in stream_llm(args.prompt, client, model=args.model, provider=args.provider,
+                                image_path=args.image, cache=cache, bypass_cache=args.no_cache,
+                                system=args.system):
+            received = True
+            print(delta, end='', flush=True)
+        if received:
+            print()
+        else:
+            print("Failed to get response from LLM")
+        return
+
+    response = query_llm(args.prompt, client, model=args.model, provider=args.provider, image_path=args.image,
+                         cache=cache, bypass_cache=args.no_cache, system=args.system)
     if response:
         print(response)
     else:
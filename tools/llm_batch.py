@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    from tools.llm_api import aclose_llm_clients, default_model, get_llm_client, query_llm_async, request_body
+    from tools.llm_cache import hash_file
+except ImportError:
+    from llm_api import aclose_llm_clients, default_model, get_llm_client, query_llm_async, request_body
+    from llm_cache import hash_file
+
+logger = logging.getLogger(__name__)
+
+# Results written to the job state at once; a crash loses at most this many
+COMMIT_EVERY = 100
+
+# Rows read from the job state at a time while running locally
+PAGE_SIZE = 1000
+
+class BatchItem(NamedTuple):
+    """One prompt of a batch job."""
+    index: int
+    id: str
+    prompt: str
+    image_path: Optional[object] = None
+    system: Optional[str] = None
+
+def read_prompts(path: str) -> Iterator[BatchItem]:
+    """
+    Read prompts from a JSONL file.
+
+    Each line is either a JSON string, the prompt, or an object with a
+    "prompt" and optionally "id", "image_path" and "system". Items
+    without an id are numbered by position. Blank lines are skipped.
+    """
+    with open(path, encoding="utf-8") as f:
+        index = 0
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, str):
+                entry = {"prompt": entry}
+            if not isinstance(entry, dict) or not isinstance(entry.get("prompt"), str):
+                raise ValueError(f"{path}:{line_number}: expected a prompt string or an object with a prompt")
+            yield BatchItem(index, str(entry.get("id", index)), entry["prompt"], entry.get("image_path"),
+                            entry.get("system"))
+            index += 1
+
+class JobState:
+    """
+    Progress of a batch job, kept in SQLite so that an interrupted job resumes where it stopped.
+
+    Items go from "pending" to "submitted" (inside a provider batch) to
+    "done" or "failed". Failed items are tried again by the next run.
+    """
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS items (
+                idx INTEGER PRIMARY KEY, id TEXT NOT NULL, request TEXT NOT NULL,
+                status TEXT NOT NULL, batch_id TEXT, response TEXT, error TEXT);
+            CREATE INDEX IF NOT EXISTS items_status ON items (status);
+            CREATE TABLE IF NOT EXISTS batches (batch_id TEXT PRIMARY KEY, status TEXT NOT NULL);
+        """)
+        self._db.commit()
+
+    def load(self, input_path: str):
+        """Copy the input's prompts into the state, once; refuse a state made from another input."""
+        digest = hash_file(input_path)
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'input'").fetchone()
+        if row is not None:
+            if row[0] != digest:
+                raise ValueError(f"Job state belongs to a different input than {input_path}")
+            return
+        self._db.executemany(
+            "INSERT INTO items (idx, id, request, status) VALUES (?, ?, ?, 'pending')",
+            ((item.index, item.id, json.dumps([item.prompt, item.image_path, item.system]))
+             for item in read_prompts(input_path)),
+        )
+        self._db.execute("INSERT INTO meta VALUES ('input', ?)", (digest,))
+        self._db.commit()
+
+    def unfinished(self, after: int = -1, limit: int = PAGE_SIZE) -> List[BatchItem]:
+        """Return pending and failed items with an index above ``after``, in order."""
+        rows = self._db.execute(
+            "SELECT idx, id, request FROM items WHERE status IN ('pending', 'failed') AND idx > ? "
+            "ORDER BY idx LIMIT ?", (after, limit)).fetchall()
+        return [BatchItem(idx, item_id, *json.loads(request)) for idx, item_id, request in rows]
+
+    def complete(self, results: List[Tuple[int, Optional[str], Optional[str]]]):
+        """Record (index, response, error) results; an error marks the item failed."""
+        self._db.executemany(
+            "UPDATE items SET status = ?, response = ?, error = ? WHERE idx = ?",
+            (("failed" if error is not None else "done", response, error, index)
+             for index, response, error in results),
+        )
+        self._db.commit()
+
+    def submitted(self, batch_id: str, indices: List[int]):
+        self._db.execute("INSERT INTO batches VALUES (?, 'open')", (batch_id,))
+        self._db.executemany("UPDATE items SET status = 'submitted', batch_id = ? WHERE idx = ?",
+                             ((batch_id, index) for index in indices))
+        self._db.commit()
+
+    def open_batches(self) -> List[str]:
+        return [row[0] for row in self._db.execute("SELECT batch_id FROM batches WHERE status = 'open'")]
+
+    def close_batch(self, batch_id: str, status: str):
+        """Mark a provider batch ended; its items without a result fail."""
+        self._db.execute(
+            "UPDATE items SET status = 'failed', error = ? WHERE batch_id = ? AND status = 'submitted'",
+            (f"Batch {batch_id} ended ({status}) without a result", batch_id))
+        self._db.execute("UPDATE batches SET status = ? WHERE batch_id = ?", (status, batch_id))
+        self._db.commit()
+
+    def counts(self) -> dict:
+        counts = {"pending": 0, "submitted": 0, "done": 0, "failed": 0}
+        counts.update(self._db.execute("SELECT status, COUNT(*) FROM items GROUP BY status"))
+        return counts
+
+    def results(self) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+        """Yield (id, response, error) of every item, in input order."""
+        yield from self._db.execute("SELECT id, response, error FROM items ORDER BY idx")
+
+    def close(self):
+        self._db.close()
+
+class _OpenAIBatches:
+    """OpenAI Batch API: requests uploaded as a JSONL file, results downloaded as one."""
+    max_requests = 50000
+    max_bytes = 190 * 1024 * 1024
+
+    @staticmethod
+    def line(index: int, body: dict) -> dict:
+        return {"custom_id": str(index), "method": "POST", "url": "/v1/chat/completions", "body": body}
+
+    @staticmethod
+    def submit(client, lines: List[str]) -> str:
+        upload = client.files.create(file=("batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+        batch = client.batches.create(input_file_id=upload.id, endpoint="/v1/chat/completions",
+                                      completion_window="24h")
+        return batch.id
+
+    @staticmethod
+    def poll(client, batch_id: str) -> Optional[str]:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            return batch.status
+        return None
+
+    @staticmethod
+    def results(client, batch_id: str) -> Iterator[Tuple[int, Optional[str], Optional[str]]]:
+        batch = client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                response = entry.get("response") or {}
+                body = response.get("body") or {}
+                if response.get("status_code") == 200:
+                    yield int(entry["custom_id"]), body["choices"][0]["message"]["content"], None
+                else:
+                    yield int(entry["custom_id"]), None, json.dumps(entry.get("error") or body.get("error"))
+
+class _AnthropicBatches:
+    """Anthropic Message Batches API: requests sent inline, results streamed as JSONL."""
+    max_requests = 100000
+    max_bytes = 250 * 1024 * 1024
+
+    @staticmethod
+    def line(index: int, body: dict) -> dict:
+        return {"custom_id": str(index), "params": body}
+
+    @staticmethod
+    def submit(client, lines: List[str]) -> str:
+        return client.messages.batches.create(requests=[json.loads(line) for line in lines]).id
+
+    @staticmethod
+    def poll(client, batch_id: str) -> Optional[str]:
+        batch = client.messages.batches.retrieve(batch_id)
+        return "ended" if batch.processing_status == "ended" else None
+
+    @staticmethod
+    def results(client, batch_id: str) -> Iterator[Tuple[int, Optional[str], Optional[str]]]:
+        for entry in client.messages.batches.results(batch_id):
+            result = entry.result
+            if result.type == "succeeded":
+                yield int(entry.custom_id), result.message.content[0].text, None
+            else:
+                yield int(entry.custom_id), None, str(getattr(result, "error", None) or result.type)
+
+# Providers with a batch API: half the price, results within 24 hours
+BATCH_APIS = {"openai": _OpenAIBatches, "anthropic": _AnthropicBatches}
+
+class BatchJob:
+    """
+    Run a JSONL file of prompts and write the responses to a JSONL file, in input order.
+
+    With ``mode="api"`` (the default for providers in BATCH_APIS under
+    ``mode="auto"``) prompts are submitted through the provider's batch
+    API and the job polls until every batch has ended. With
+    ``mode="local"`` they are sent through query_llm_async, at most
+    ``concurrency`` at a time, within the configured rate limits.
+
+    Progress is kept in a SQLite state file, by default next to the
+    output. Running the same job again resumes it: finished items are
+    kept, batches already submitted are polled instead of resubmitted and
+    failed items are tried again.
+
+    Usage:
+        job = BatchJob("prompts.jsonl", "responses.jsonl", provider="anthropic")
+        counts = job.run()
+    """
+
+    def __init__(self, input_path: str, output_path: str, state_path: Optional[str] = None, provider="openai",
+                 model=None, mode: str = "auto", concurrency: int = 32, poll_interval: float = 60.0,
+                 system: Optional[str] = None, client=None):
+        """
+        Args:
+            input_path (str): JSONL file of prompts, see read_prompts
+            output_path (str): JSONL file receiving {"id", "response", "error"} per prompt
+            state_path (str, optional): SQLite job state, ``<output_path>.state.sqlite`` by default
+            provider (str): The API provider to use
+            model (str, optional): The model to use
+            mode (str): "auto", "api" or "local"
+            concurrency (int): Requests in flight when running locally
+            poll_interval (float): Seconds between checks on submitted batches
+            system (str, optional): System prompt for items that do not set their own
+            client (optional): The client to use; a synchronous one for the batch API, an async one locally
+        """
+        if mode == "auto":
+            mode = "api" if provider in BATCH_APIS else "local"
+        if mode not in ("api", "local"):
+            raise ValueError(f"Unsupported batch mode: {mode}")
+        if mode == "api" and provider not in BATCH_APIS:
+            raise ValueError(f"Provider {provider} has no batch API")
+        self.input_path = input_path
+        self.output_path = output_path
+        self.state_path = state_path or f"{output_path}.state.sqlite"
+        self.provider = provider
+        self.model = model or default_model(provider)
+        self.mode = mode
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.system = system
+        self.client = client
+
+    def run(self, wait: bool = True) -> dict:
+        """
+        Run the job until every item has finished, then write the output.
+
+        Args:
+            wait (bool): In API mode, poll until the batches end; False returns right after submitting
+
+        Returns:
+            dict: Number of items per state: pending, submitted, done and failed
+        """
+        state = JobState(self.state_path)
+        try:
+            state.load(self.input_path)
+            if self.mode == "api":
+                self._run_api(state, wait)
+            else:
+                asyncio.run(self._run_local(state))
+            counts = state.counts()
+            logger.info(f"Batch job {self.output_path}: {counts}")
+            if not counts["pending"] and not counts["submitted"]:
+                self._write_output(state)
+            return counts
+        finally:
+            state.close()
+
+    def _run_api(self, state: JobState, wait: bool):
+        api = BATCH_APIS[self.provider]
+        client = self.client or get_llm_client(self.provider)
+        self._submit(state, api, client)
+        while True:
+            for batch_id in state.open_batches():
+                status = api.poll(client, batch_id)
+                if status is None:
+                    continue
+                state.complete(list(api.results(client, batch_id)))
+                state.close_batch(batch_id, status)
+                logger.info(f"Batch {batch_id} {status}: {state.counts()}")
+            if not wait or not state.open_batches():
+                return
+            time.sleep(self.poll_interval)
+
+    def _submit(self, state: JobState, api, client):
+        lines, indices, size, failures = [], [], 0, []
+
+        def flush():
+            nonlocal lines, indices, size
+            if lines:
+                batch_id = api.submit(client, lines)
+                state.submitted(batch_id, indices)
+                logger.info(f"Submitted batch {batch_id} with {len(indices)} requests")
+            lines, indices, size = [], [], 0
+
+        after = -1
+        while True:
+            page = state.unfinished(after)
+            if not page:
+                break
+            for item in page:
+                try:
+                    body = request_body(item.prompt, self.model, self.provider, item.image_path,
+                                        item.system or self.system)
+                except Exception as e:
+                    failures.append((item.index, None, str(e)))
+                    continue
+                line = json.dumps(api.line(item.index, body), ensure_ascii=False)
+                if len(lines) >= api.max_requests or size + len(line) > api.max_bytes:
+                    flush()
+                lines.append(line)
+                indices.append(item.index)
+                size += len(line) + 1
+            after = page[-1].index
+        flush()
+        if failures:
+            state.complete(failures)
+
+    async def _run_local(self, state: JobState):
+        client = self.client or get_llm_client(self.provider, asynchronous=True)
+        results = []
+
+        def items():
+            after = -1
+            while True:
+                page = state.unfinished(after)
+                if not page:
+                    return
+                yield from page
+                after = page[-1].index
+
+        pending = items()
+
+        async def worker():
+            for item in pending:
+                try:
+                    response = await query_llm_async(item.prompt, client, self.model, self.provider, item.image_path,
+                                                     raise_errors=True, system=item.system or self.system)
+                    results.append((item.index, response, None))
+                except Exception as e:
+                    results.append((item.index, None, str(e)))
+                if len(results) >= COMMIT_EVERY:
+                    state.complete(results)
+                    results.clear()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        finally:
+            state.complete(results)
+            if self.client is None:
+                # The event loop ends here, taking its async clients with it
+                await aclose_llm_clients()
+
+    def _write_output(self, state: JobState):
+        temporary = f"{self.output_path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            for item_id, response, error in state.results():
+                f.write(json.dumps({"id": item_id, "response": response, "error": error}, ensure_ascii=False) + "\n")
+        os.replace(temporary, self.output_path)
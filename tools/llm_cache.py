@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_cache_key(provider: str, model: str, prompt: str, image_hash: Optional[str] = None,
+                   params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build the cache key of a request.
+
+    Args:
+        provider (str): The API provider
+        model (str): The model name
+        prompt (str): The text prompt
+        image_hash (str, optional): Content hash of the attached image
+        params (dict, optional): Sampling parameters sent with the request
+
+    Returns:
+        str: A hex digest identifying the request
+    """
+    payload = json.dumps([provider, model, prompt, image_hash, params or {}],
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    Base class of the response caches used by query_llm.
+
+    Subclasses implement ``get`` and ``set``. Entries older than ``ttl``
+    seconds are treated as missing; ``ttl=None`` keeps them forever.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl is not None and time.time() - stored_at >= self.ttl
+
+class MemoryCache(ResponseCache):
+    """In-process LRU cache holding at most ``max_entries`` responses."""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if self._expired(stored_at):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SQLiteCache(ResponseCache):
+    """Response cache persisted in a SQLite database, shared across processes."""
+
+    def __init__(self, path: str, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT value, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self._expired(row[1]):
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            return row[0]
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, value, time.time()))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class RequestCoalescer:
+    """
+    Share one call between concurrent callers asking for the same key.
+
+    The first caller runs the function; callers arriving while it is in
+    flight wait for and receive the same result (or exception). Threads
+    share calls through ``run``, coroutines on one event loop through
+    ``run_async``.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, Future] = {}
+        self._in_flight_async: Dict[Tuple[int, str], asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    async def run_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        loop_key = (id(asyncio.get_running_loop()), key)
+        task = self._in_flight_async.get(loop_key)
+        if task is None:
+            task = self._in_flight_async[loop_key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._in_flight_async.pop(loop_key, None))
+        # A cancelled caller must not cancel the call the others are waiting for
+        return await asyncio.shield(task)
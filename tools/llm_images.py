@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+import base64
+import io
+import logging
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Tuple
+
+try:
+    from tools.llm_cache import hash_file
+except ImportError:
+    from llm_cache import hash_file
+
+logger = logging.getLogger(__name__)
+
+class ImageLimits(NamedTuple):
+    """
+    Largest image a provider makes use of; bigger ones are downscaled by the provider anyway.
+
+    ``max_bytes`` is the largest image the provider accepts, counted as base64.
+    """
+    max_long_side: int
+    max_short_side: int
+    max_bytes: int
+
+# OpenAI fits images into 2048x2048 and then scales the short side to 768,
+# Anthropic downscales anything with a side over 1568 and rejects images
+# over 5 MB, Gemini tiles images up to 3072 pixels.
+PROVIDER_IMAGE_LIMITS: Dict[str, ImageLimits] = {
+    "openai": ImageLimits(2048, 768, 20 * 1024 * 1024),
+    "azure": ImageLimits(2048, 768, 20 * 1024 * 1024),
+    "deepseek": ImageLimits(2048, 768, 20 * 1024 * 1024),
+    "local": ImageLimits(2048, 768, 20 * 1024 * 1024),
+    "anthropic": ImageLimits(1568, 1568, 5 * 1024 * 1024),
+    "gemini": ImageLimits(3072, 3072, 20 * 1024 * 1024),
+}
+
+# Images smaller than this are sent as they are when they fit the limits
+RECOMPRESS_THRESHOLD = 1024 * 1024
+
+# Each step down in size once even the lowest JPEG quality is too large
+SHRINK_FACTOR = 0.75
+
+def encode_file_base64(path: str) -> str:
+    """Base64-encode a file."""
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("ascii")
+
+def _fits(size: int, max_bytes: int) -> bool:
+    """Whether ``size`` bytes stay within ``max_bytes`` once base64-encoded."""
+    return 4 * ((size + 2) // 3) <= max_bytes
+
+def guess_mime_type(path: str) -> str:
+    mime_type, _ = mimetypes.guess_type(path)
+    return mime_type or 'image/png'  # Default to PNG if type cannot be determined
+
+class _EncodedImageCache:
+    """LRU cache of encoded images holding at most ``max_bytes`` of base64 data."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, str]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key)[0])
+            self._entries[key] = entry
+            self._size += len(entry[0])
+            while self._size > self.max_bytes and self._entries:
+                self._size -= len(self._entries.popitem(last=False)[1][0])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+_encoded_images = _EncodedImageCache()
+
+# Content hashes by (path, mtime, size), so unchanged files are not hashed again
+_digests: Dict[str, Tuple[int, int, str]] = {}
+_digests_lock = threading.Lock()
+
+def image_digest(path: str) -> str:
+    """Return the SHA-256 of a file, reusing the last result while the file is unchanged."""
+    stat = os.stat(path)
+    with _digests_lock:
+        cached = _digests.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    digest = hash_file(path)
+    with _digests_lock:
+        _digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+def prepare_image(image_path: str, provider: str) -> Tuple[str, str]:
+    """
+    Encode an image for a provider, downscaling and recompressing it when useful.
+
+    Images larger than the provider's limits are scaled down, and large
+    files are recompressed (JPEG for opaque images, optimized PNG
+    otherwise) when that makes them smaller. Images still over the
+    provider's byte limit are flattened to JPEG and shrunk until they fit.
+    Results are cached by file content and provider. Without Pillow, and
+    for animated images, files are sent unchanged.
+
+    Args:
+        image_path (str): Path to the image file
+        provider (str): The API provider the image is sent to
+
+    Returns:
+        tuple: (base64_encoded_string, mime_type)
+    """
+    limits = PROVIDER_IMAGE_LIMITS.get(provider, PROVIDER_IMAGE_LIMITS["openai"])
+    key = (image_digest(image_path), provider)
+    entry = _encoded_images.get(key)
+    if entry is None:
+        entry = _encode(image_path, limits)
+        _encoded_images.set(key, entry)
+    return entry
+
+def _encode(image_path: str, limits: ImageLimits) -> Tuple[str, str]:
+    mime_type = guess_mime_type(image_path)
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.debug("Pillow is not installed, sending images unchanged")
+        return encode_file_base64(image_path), mime_type
+
+    file_size = os.path.getsize(image_path)
+    fits = _fits(file_size, limits.max_bytes)
+    try:
+        with Image.open(image_path) as image:
+            scale = _scale(image.size, limits)
+            if scale >= 1 and fits and file_size <= RECOMPRESS_THRESHOLD:
+                return encode_file_base64(image_path), mime_type
+            if getattr(image, "is_animated", False):
+                # Resampling would drop every frame but the first
+                return encode_file_base64(image_path), mime_type
+            if scale < 1:
+                size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+                image = image.resize(size, Image.LANCZOS)
+            data, mime_type_out = _compress(image, limits.max_bytes)
+    except (OSError, Image.DecompressionBombError) as e:
+        logger.debug(f"Could not preprocess {image_path}: {e}")
+        return encode_file_base64(image_path), mime_type
+
+    if scale >= 1 and fits and len(data) >= file_size:
+        return encode_file_base64(image_path), mime_type
+    logger.debug(f"Preprocessed {image_path}: {file_size} -> {len(data)} bytes")
+    return base64.b64encode(data).decode("ascii"), mime_type_out
+
+def _scale(size: Tuple[int, int], limits: ImageLimits) -> float:
+    long_side, short_side = max(size), min(size)
+    return min(1.0, limits.max_long_side / long_side, limits.max_short_side / short_side)
+
+def _compress(image, max_bytes: int) -> Tuple[bytes, str]:
+    from PIL import Image
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    if has_alpha:
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", optimize=True)
+        if _fits(buffer.tell(), max_bytes):
+            return buffer.getvalue(), "image/png"
+        # Too large as PNG: put it on white and fall back to JPEG
+        rgba = image.convert("RGBA")
+        image = Image.new("RGB", rgba.size, "white")
+        image.paste(rgba, mask=rgba.getchannel("A"))
+    image = image.convert("RGB")
+    while True:
+        for quality in (85, 70, 50):
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=quality, optimize=True)
+            if _fits(buffer.tell(), max_bytes):
+                return buffer.getvalue(), "image/jpeg"
+        if min(image.size) == 1:
+            return buffer.getvalue(), "image/jpeg"
+        size = (max(1, int(image.width * SHRINK_FACTOR)), max(1, int(image.height * SHRINK_FACTOR)))
+        image = image.resize(size, Image.LANCZOS)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+class CallMetrics(NamedTuple):
+    """Measurements of one LLM call."""
+    timestamp: float
+    provider: str
+    model: Optional[str]
+    latency: float
+    ttfb: Optional[float]
+    input_tokens: Optional[int]
+    output_tokens: Optional[int]
+    cache: Optional[str]
+    retries: int
+    streamed: bool
+    error: Optional[str]
+    # Input tokens served from the provider's prompt cache
+    cache_read_tokens: Optional[int] = None
+
+MetricsHook = Callable[[CallMetrics], None]
+
+_hooks: List[MetricsHook] = []
+_hooks_lock = threading.Lock()
+
+def add_metrics_hook(hook: MetricsHook):
+    """Call ``hook`` with the CallMetrics of every LLM call that completes."""
+    with _hooks_lock:
+        _hooks.append(hook)
+
+def remove_metrics_hook(hook: MetricsHook):
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+def emit(metrics: CallMetrics):
+    """Pass metrics to every hook; a failing hook is logged and skipped."""
+    for hook in list(_hooks):
+        try:
+            hook(metrics)
+        except Exception as e:
+            logger.warning(f"Metrics hook {hook!r} failed: {e}")
+
+class CallTracker:
+    """
+    Collects the measurements of one call while it runs.
+
+    ``cache`` is None without a cache, or one of "hit", "miss", "bypass"
+    and "coalesced" (answered by an identical request already in flight).
+    """
+
+    def __init__(self, provider: str, model: Optional[str], streamed: bool = False):
+        self.provider = provider
+        self.model = model
+        self.streamed = streamed
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.ttfb = None
+        self.input_tokens = None
+        self.output_tokens = None
+        self.cache_read_tokens = None
+        self.cache = None
+        self.retries = 0
+        self.error = None
+
+    def first_byte(self):
+        if self.ttfb is None:
+            self.ttfb = time.perf_counter() - self.start
+
+    def record_usage(self, usage):
+        if usage is not None:
+            self.input_tokens = usage.input_tokens
+            self.output_tokens = usage.output_tokens
+            self.cache_read_tokens = usage.cache_read_tokens
+
+    def fail(self, error: Exception):
+        self.error = f"{type(error).__name__}: {error}"
+
+    def finish(self):
+        if not _hooks:
+            return
+        latency = time.perf_counter() - self.start
+        emit(CallMetrics(
+            timestamp=self.timestamp,
+            provider=self.provider,
+            model=self.model,
+            latency=latency,
+            # Without streaming the first byte of the answer arrives with the rest of it
+            ttfb=self.ttfb if self.streamed else (None if self.cache == "hit" else latency),
+            input_tokens=self.input_tokens,
+            output_tokens=self.output_tokens,
+            cache=self.cache,
+            retries=self.retries,
+            streamed=self.streamed,
+            error=self.error,
+            cache_read_tokens=self.cache_read_tokens,
+        ))
+
+class JSONLSink:
+    """Metrics hook appending each call as one JSON line to a file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, metrics: CallMetrics):
+        line = json.dumps(metrics._asdict())
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+def load_metrics(path: str) -> List[CallMetrics]:
+    """Read the calls recorded by a JSONLSink, skipping lines that do not parse."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(CallMetrics(**json.loads(line)))
+            except (ValueError, TypeError):
+                continue
+    return records
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of ``values``."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def summarize(records: Iterable[CallMetrics]) -> Dict[str, dict]:
+    """
+    Aggregate calls per "provider/model".
+
+    Returns:
+        dict: Per provider/model the call and error counts, latency and
+        TTFB percentiles (p50/p95/p99), token totals (including input
+        tokens read from the provider's prompt cache), response cache hit
+        rate and retries
+    """
+    groups: Dict[str, List[CallMetrics]] = {}
+    for record in records:
+        groups.setdefault(f"{record.provider}/{record.model}", []).append(record)
+    summary = {}
+    for name, calls in sorted(groups.items()):
+        latencies = [call.latency for call in calls if call.error is None]
+        ttfbs = [call.ttfb for call in calls if call.error is None and call.ttfb is not None]
+        cached = [call for call in calls if call.cache is not None]
+        summary[name] = {
+            "calls": len(calls),
+            "errors": sum(1 for call in calls if call.error is not None),
+            "latency": {f"p{int(q * 100)}": percentile(latencies, q) for q in (0.5, 0.95, 0.99)},
+            "ttfb": {f"p{int(q * 100)}": percentile(ttfbs, q) for q in (0.5, 0.95, 0.99)},
+            "input_tokens": sum(call.input_tokens or 0 for call in calls),
+            "output_tokens": sum(call.output_tokens or 0 for call in calls),
+            "cache_read_tokens": sum(call.cache_read_tokens or 0 for call in calls),
+            "cache_hit_rate": (sum(1 for call in cached if call.cache == "hit") / len(cached)) if cached else None,
+            "retries": sum(call.retries for call in calls),
+        }
+    return summary
+
+def format_summary(summary: Dict[str, dict]) -> str:
+    """Render a summarize() result as a text table."""
+    def seconds(value):
+        return "-" if value is None else f"{value:.2f}s"
+
+    lines = [f"{'provider/model':<40} {'calls':>6} {'errors':>6} {'p50':>8} {'p95':>8} {'p99':>8} "
+             f"{'ttfb p50':>9} {'in tok':>9} {'cached':>9} {'out tok':>9} {'cache':>6} {'retries':>7}"]
+    for name, stats in summary.items():
+        latency = stats["latency"]
+        hit_rate = stats["cache_hit_rate"]
+        lines.append(
+            f"{name:<40} {stats['calls']:>6} {stats['errors']:>6} {seconds(latency['p50']):>8} "
+            f"{seconds(latency['p95']):>8} {seconds(latency['p99']):>8} {seconds(stats['ttfb']['p50']):>9} "
+            f"{stats['input_tokens']:>9} {stats['cache_read_tokens']:>9} {stats['output_tokens']:>9} "
+            f"{'-' if hit_rate is None else f'{hit_rate:.0%}':>6} {stats['retries']:>7}"
+        )
+    return "\n".join(lines)
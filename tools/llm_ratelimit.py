@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+def status_code(error: Exception) -> Optional[int]:
+    """Return the HTTP status of an SDK error, if it carries one."""
+    for attribute in ("status_code", "code", "status"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+def is_rate_limit(error: Exception) -> bool:
+    return status_code(error) == 429
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are worth retrying."""
+    status = status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    name = type(error).__name__
+    return isinstance(error, (TimeoutError, ConnectionError)) or "Timeout" in name or "Connection" in name
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Return the Retry-After delay of a rate-limit error, if the provider sent one."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """
+    Bucket refilled at ``per_minute / 60`` units per second, holding at most a minute's budget.
+
+    Reservations are taken immediately and may drive the level below zero;
+    the caller then waits until the refill has covered its share. Since
+    reservations are made in arrival order, waits are first come, first
+    served.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take ``amount`` units and return the seconds to wait before using them."""
+        self._refill(now)
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, amount: float, now: float):
+        """Take (or, when negative, give back) units after the fact."""
+        self._refill(now)
+        self.level = min(self.capacity, self.level - amount)
+
+    def block(self, seconds: float, now: float):
+        """Make new reservations wait at least ``seconds``."""
+        self._refill(now)
+        self.level = min(self.level, -seconds * self.rate)
+
+class RateLimiter:
+    """
+    Per provider/model request (RPM) and token (TPM) budgets.
+
+    Limits are set per provider, or per (provider, model) to override the
+    provider's. Calls without a configured limit pass straight through.
+    Token reservations start from an estimate and are corrected with the
+    usage the provider reports.
+    """
+
+    def __init__(self):
+        self._limits: Dict[Tuple[str, Optional[str]], Tuple[Optional[float], Optional[float]]] = {}
+        self._buckets: Dict[Tuple[str, Optional[str]], Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._lock = threading.Lock()
+
+    def set_limit(self, provider: str, model: Optional[str] = None, rpm: Optional[float] = None,
+                  tpm: Optional[float] = None):
+        """
+        Set the budgets of a provider, or of one of its models.
+
+        Args:
+            provider (str): The API provider
+            model (str, optional): The model; None applies to the provider's other models
+            rpm (float, optional): Requests per minute, unlimited when None
+            tpm (float, optional): Tokens (input plus output) per minute, unlimited when None
+        """
+        with self._lock:
+            key = (provider, model)
+            if rpm is None and tpm is None:
+                self._limits.pop(key, None)
+            else:
+                self._limits[key] = (rpm, tpm)
+            self._buckets = {k: v for k, v in self._buckets.items() if k[0] != provider}
+
+    def limited(self, provider: str, model: Optional[str]) -> bool:
+        return self._buckets_for(provider, model) is not None
+
+    def reserve(self, provider: str, model: Optional[str], tokens: float) -> float:
+        """Reserve one request and ``tokens`` tokens; return the seconds to wait before sending."""
+        buckets = self._buckets_for(provider, model)
+        if buckets is None:
+            return 0.0
+        requests, token_bucket = buckets
+        with self._lock:
+            now = time.monotonic()
+            delay = requests.reserve(1, now) if requests else 0.0
+            if token_bucket:
+                delay = max(delay, token_bucket.reserve(tokens, now))
+            return delay
+
+    def acquire(self, provider: str, model: Optional[str], tokens: float):
+        """Block until the request fits the budgets."""
+        delay = self.reserve(provider, model, tokens)
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self, provider: str, model: Optional[str], tokens: float):
+        """Wait, without blocking the event loop, until the request fits the budgets."""
+        delay = self.reserve(provider, model, tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def record(self, provider: str, model: Optional[str], reserved: float, used: Optional[float]):
+        """Correct a reservation with the tokens actually used; None keeps the estimate."""
+        buckets = self._buckets_for(provider, model)
+        if buckets is None or used is None or buckets[1] is None:
+            return
+        with self._lock:
+            buckets[1].adjust(used - reserved, time.monotonic())
+
+    def penalize(self, provider: str, model: Optional[str], seconds: float):
+        """Hold back every request to a provider/model after it answered with a rate limit."""
+        buckets = self._buckets_for(provider, model)
+        if buckets is None:
+            return
+        with self._lock:
+            for bucket in buckets:
+                if bucket is not None:
+                    bucket.block(seconds, time.monotonic())
+
+    def _buckets_for(self, provider: str, model: Optional[str]):
+        key = (provider, model) if (provider, model) in self._limits else (provider, None)
+        limits = self._limits.get(key)
+        if limits is None:
+            return None
+        with self._lock:
+            buckets = self._buckets.get(key)
+            if buckets is None:
+                rpm, tpm = limits
+                buckets = self._buckets[key] = (
+                    TokenBucket(rpm) if rpm else None,
+                    TokenBucket(tpm) if tpm else None,
+                )
+            return buckets
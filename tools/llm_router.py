@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+import asyncio
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, NamedTuple, Optional, Sequence, Union
+
+try:
+    from tools.llm_api import query_llm, query_llm_async
+    from tools.llm_ratelimit import is_retryable, retry_after
+except ImportError:
+    from llm_api import query_llm, query_llm_async
+    from llm_ratelimit import is_retryable, retry_after
+
+class Target(NamedTuple):
+    """A (provider, model) pair the router can send a request to."""
+    provider: str
+    model: Optional[str] = None
+    weight: float = 1.0
+
+class TargetStats:
+    """Rolling latency and error statistics of one target."""
+
+    def __init__(self, window: int = 100):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        return (self.outcomes.count(False) / len(self.outcomes)) if self.outcomes else 0.0
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        return {
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "error_rate": self.error_rate,
+            "requests": len(self.outcomes),
+            "cooling_down": max(0.0, self.cooldown_until - time.monotonic()),
+        }
+
+class LLMRouter:
+    """
+    Send each request to one of several (provider, model) targets.
+
+    Targets are tried in the order given by ``strategy``: ``"ordered"``
+    keeps the given priority, ``"weighted"`` shuffles by target weight and
+    ``"fastest"`` prefers the lowest rolling p95 latency. A request that
+    has not finished after ``hedge_after`` seconds is also sent to the next
+    target, and the first answer wins. A failed request fails over to the
+    next target; rate limits (429) and server errors (5xx) additionally
+    put the target on an exponential backoff, honouring Retry-After. When
+    every target failed and at least one failure was retryable, the round
+    is repeated, up to ``max_rounds`` rounds, once the earliest backoff
+    has passed.
+
+    Synchronous queries run in threads, which cannot be interrupted: a
+    losing hedged request keeps running until its provider answers, and so
+    still uses rate limit and token budget. It is not sent again after a
+    rate limit, and its outcome does not count towards the statistics.
+    Asynchronous queries cancel their losing requests.
+
+    Usage:
+        router = LLMRouter([Target("anthropic"), Target("openai", "gpt-4o")], hedge_after=5)
+        response = router.query("Summarize this page: ...")
+    """
+
+    def __init__(self, targets: Sequence[Union[Target, tuple]], strategy: str = "ordered",
+                 hedge_after: Optional[float] = None, max_rounds: int = 2, backoff_base: float = 1.0,
+                 backoff_max: float = 60.0, window: int = 100, max_workers: int = 32):
+        """
+        Args:
+            targets (Sequence[Target]): The targets, as Target or (provider, model[, weight]) tuples
+            strategy (str): "ordered", "weighted" or "fastest"
+            hedge_after (float, optional): Seconds before a slow request is duplicated to the next target
+            max_rounds (int): Times the whole target list is tried before giving up
+            backoff_base (float): Backoff after a target's first rate limit or server error, in seconds
+            backoff_max (float): Upper bound of a target's backoff, in seconds
+            window (int): Number of recent requests the statistics cover
+            max_workers (int): Threads available to synchronous queries and their hedges
+        """
+        if not targets:
+            raise ValueError("LLMRouter needs at least one target")
+        if strategy not in ("ordered", "weighted", "fastest"):
+            raise ValueError(f"Unsupported routing strategy: {strategy}")
+        self.targets = [target if isinstance(target, Target) else Target(*target) for target in targets]
+        self.strategy = strategy
+        self.hedge_after = hedge_after
+        self.max_rounds = max_rounds
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._stats = {target: TargetStats(window) for target in self.targets}
+        self._lock = threading.Lock()
+        self._max_workers = max_workers
+        self._executor = None
+
+    def stats(self) -> Dict[Target, Dict[str, Optional[float]]]:
+        """Return p50/p95 latency, error rate and backoff state per target."""
+        with self._lock:
+            return {target: stats.summary() for target, stats in self._stats.items()}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def query(self, prompt: str, **kwargs) -> Optional[str]:
+        """
+        Query the targets with a prompt, failing over and hedging as configured.
+
+        Args:
+            prompt (str): The text prompt to send
+            **kwargs: Further query_llm arguments, such as image_path or cache
+
+        Returns:
+            Optional[str]: The first successful response, or None if every target failed
+        """
+        executor = self._get_executor()
+        errors = []
+        # Set once this query has its answer, so losing requests still running are ignored
+        settled = threading.Event()
+        try:
+            for round_number in range(self.max_rounds):
+                if round_number:
+                    if not any(is_retryable(error) for error in errors):
+                        break
+                    time.sleep(self._backoff_delay())
+                order = self._order()
+                pending = {}
+
+                def launch():
+                    if order:
+                        target = order.pop(0)
+                        pending[executor.submit(self._attempt, target, prompt, kwargs, settled)] = target
+
+                launch()
+                while pending:
+                    can_hedge = self.hedge_after is not None and len(pending) == 1 and order
+                    done, _ = wait(pending, timeout=self.hedge_after if can_hedge else None,
+                                   return_when=FIRST_COMPLETED)
+                    if not done:
+                        launch()
+                        continue
+                    for future in done:
+                        pending.pop(future)
+                        try:
+                            return future.result()
+                        except Exception as e:
+                            errors.append(e)
+                            if not pending:
+                                launch()
+        finally:
+            settled.set()
+        self._report(errors)
+        return None
+
+    async def query_async(self, prompt: str, **kwargs) -> Optional[str]:
+        """
+        Asynchronous variant of query; losing hedged requests are cancelled.
+
+        Returns:
+            Optional[str]: The first successful response, or None if every target failed
+        """
+        errors = []
+        for round_number in range(self.max_rounds):
+            if round_number:
+                if not any(is_retryable(error) for error in errors):
+                    break
+                await asyncio.sleep(self._backoff_delay())
+            order = self._order()
+            pending = {}
+
+            def launch():
+                if order:
+                    target = order.pop(0)
+                    pending[asyncio.ensure_future(self._attempt_async(target, prompt, kwargs))] = target
+
+            launch()
+            try:
+                while pending:
+                    can_hedge = self.hedge_after is not None and len(pending) == 1 and order
+                    done, _ = await asyncio.wait(pending, timeout=self.hedge_after if can_hedge else None,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        launch()
+                        continue
+                    for task in done:
+                        pending.pop(task)
+                        try:
+                            return task.result()
+                        except Exception as e:
+                            errors.append(e)
+                            if not pending:
+                                launch()
+            finally:
+                for task in pending:
+                    task.cancel()
+        self._report(errors)
+        return None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="llm-router")
+            return self._executor
+
+    def _order(self) -> List[Target]:
+        with self._lock:
+            now = time.monotonic()
+            if self.strategy == "weighted":
+                # Weighted shuffle: sort by a random key biased by weight
+                order = sorted(self.targets, key=lambda t: random.random() ** (1.0 / max(t.weight, 1e-9)),
+                               reverse=True)
+            elif self.strategy == "fastest":
+                # Targets without measurements go first so they get measured
+                order = sorted(self.targets, key=lambda t: self._stats[t].percentile(0.95) or 0.0)
+            else:
+                order = list(self.targets)
+            # Targets in backoff are only tried after the healthy ones
+            return sorted(order, key=lambda t: self._stats[t].cooldown_until > now)
+
+    def _attempt(self, target: Target, prompt: str, kwargs: dict, settled: threading.Event) -> Optional[str]:
+        start = time.monotonic()
+        try:
+            response = query_llm(prompt, model=target.model, provider=target.provider, raise_errors=True,
+                                 cancel=settled, **kwargs)
+        except Exception as e:
+            # A request that lost the race says nothing about its target
+            if not settled.is_set():
+                self._record_failure(target, e)
+            raise
+        if not settled.is_set():
+            self._record_success(target, time.monotonic() - start)
+        return response
+
+    async def _attempt_async(self, target: Target, prompt: str, kwargs: dict) -> Optional[str]:
+        start = time.monotonic()
+        try:
+            response = await query_llm_async(prompt, model=target.model, provider=target.provider,
+                                             raise_errors=True, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._record_failure(target, e)
+            raise
+        self._record_success(target, time.monotonic() - start)
+        return response
+
+    def _record_success(self, target: Target, latency: float):
+        with self._lock:
+            stats = self._stats[target]
+            stats.latencies.append(latency)
+            stats.outcomes.append(True)
+            stats.consecutive_failures = 0
+            stats.cooldown_until = 0.0
+
+    def _record_failure(self, target: Target, error: Exception):
+        with self._lock:
+            stats = self._stats[target]
+            stats.outcomes.append(False)
+            if not is_retryable(error):
+                return
+            delay = min(self.backoff_max, self.backoff_base * 2 ** stats.consecutive_failures)
+            # Full jitter keeps callers that failed together from retrying together
+            delay = retry_after(error) or random.uniform(delay / 2, delay)
+            stats.consecutive_failures += 1
+            stats.cooldown_until = time.monotonic() + delay
+
+    def _backoff_delay(self) -> float:
+        with self._lock:
+            earliest = min(stats.cooldown_until for stats in self._stats.values())
+        return max(0.0, min(earliest - time.monotonic(), self.backoff_max))
+
+    def _report(self, errors: List[Exception]):
+        for error in errors:
+            print(f"Error querying LLM: {error}", file=sys.stderr)
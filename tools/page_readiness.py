@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import asyncio
+import fnmatch
+import inspect
+import json
+import logging
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple, Union
+from urllib.parse import urlsplit
+from playwright.async_api import Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Load states page.goto can wait for, from earliest to latest
+WAIT_UNTIL = ('commit', 'domcontentloaded', 'load', 'networkidle')
+# Attempts, and the pause between them, at reading a page that is still navigating
+CONTENT_ATTEMPTS = 5
+CONTENT_RETRY_DELAY = 0.1
+
+class PageNotReady(TimeoutError):
+    """Raised when a page is not ready by its deadline and partial content was not asked for."""
+
+class ReadinessPolicy(NamedTuple):
+    """
+    When a loaded page counts as ready, shared by the scraper and the screenshot tool.
+
+    Navigation waits for the ``wait_until`` load state, then for
+    ``selector`` to be attached and for ``predicate`` to hold. The
+    predicate is either a JavaScript expression or a callable taking the
+    page and returning (or awaiting to) a truthy value once ready.
+    ``timeout`` is a hard deadline in seconds for the whole load; past it
+    PageNotReady is raised, or with ``partial`` the page is used as it is.
+    ``overrides`` holds (pattern, policy) pairs, see for_url().
+    """
+    wait_until: str = 'networkidle'
+    selector: Optional[str] = None
+    predicate: Optional[Union[str, Callable[[Any], Any]]] = None
+    timeout: float = 30.0
+    partial: bool = False
+    overrides: Tuple[Tuple[str, 'ReadinessPolicy'], ...] = ()
+
+    def for_url(self, url: str) -> 'ReadinessPolicy':
+        """
+        Return the policy for ``url``: the first override whose glob pattern
+        matches the URL or its host name, else this policy.
+        """
+        host = urlsplit(url).hostname or ''
+        for pattern, policy in self.overrides:
+            if fnmatch.fnmatch(url, pattern) or fnmatch.fnmatch(host, pattern):
+                return policy
+        return self
+
+DEFAULT_POLICY = ReadinessPolicy()
+
+async def load_page(page, url: str, policy: Optional[ReadinessPolicy] = None) -> bool:
+    """
+    Navigate ``page`` to ``url`` and wait until it is ready.
+
+    Args:
+        page: The Playwright page
+        url (str): The URL to load
+        policy (ReadinessPolicy, optional): Readiness policy, its per-URL
+            overrides applied. Defaults to waiting for networkidle.
+
+    Returns:
+        bool: True when the page became ready, False when the deadline
+        passed and the policy accepts partial content
+
+    Raises:
+        PageNotReady: The deadline passed and the policy does not accept partial content
+    """
+    policy = (policy or DEFAULT_POLICY).for_url(url)
+    if policy.wait_until not in WAIT_UNTIL:
+        raise ValueError(f"Unknown load state: {policy.wait_until}")
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + policy.timeout
+
+    def remaining_ms() -> float:
+        return max(1.0, (deadline - loop.time()) * 1000)
+
+    async def wait():
+        await page.goto(url, wait_until=policy.wait_until, timeout=remaining_ms())
+        if policy.selector is not None:
+            await page.wait_for_selector(policy.selector, state='attached', timeout=remaining_ms())
+        if isinstance(policy.predicate, str):
+            await page.wait_for_function(policy.predicate, timeout=remaining_ms())
+        elif policy.predicate is not None:
+            while not await _check(policy.predicate, page):
+                await asyncio.sleep(0.1)
+
+    try:
+        # Playwright enforces the deadline on its own waits; wait_for also bounds Python predicates
+        await asyncio.wait_for(wait(), policy.timeout)
+        return True
+    except (asyncio.TimeoutError, PlaywrightTimeoutError) as e:
+        if not policy.partial:
+            raise PageNotReady(f"{url} not ready after {policy.timeout:g}s") from e
+        logger.warning(f"{url} not ready after {policy.timeout:g}s, using partial content")
+        return False
+
+async def page_content(page) -> str:
+    """
+    Return the HTML of ``page``, also while it is still navigating.
+
+    When load_page() gave up at the deadline, the navigation may still be
+    running and page.content() fails with "Unable to retrieve content
+    because the page is navigating". The document is then serialized in
+    the page instead, retrying briefly while the navigation replaces it.
+    """
+    for _ in range(CONTENT_ATTEMPTS - 1):
+        try:
+            return await page.content()
+        except PlaywrightError as e:
+            if 'navigating' not in str(e):
+                raise
+        try:
+            return await page.evaluate("document.documentElement.outerHTML")
+        except PlaywrightError:
+            # The old document was torn down before it could be read
+            await asyncio.sleep(CONTENT_RETRY_DELAY)
+    return await page.content()
+
+async def _check(predicate: Callable[[Any], Any], page) -> bool:
+    result = predicate(page)
+    if inspect.isawaitable(result):
+        result = await result
+    return bool(result)
+
+def load_overrides(path: str, base: ReadinessPolicy = DEFAULT_POLICY) -> Tuple[Tuple[str, ReadinessPolicy], ...]:
+    """
+    Read per-URL overrides from a JSON file mapping glob patterns to policy
+    fields; fields left out are taken from ``base``.
+
+    Example:
+        {"*.example.com": {"wait_until": "domcontentloaded", "selector": "#content"},
+         "https://news.site/*": {"timeout": 5, "partial": true}}
+    """
+    with open(path, encoding='utf-8') as f:
+        rules: Dict[str, Dict[str, Any]] = json.load(f)
+    return tuple((pattern, base._replace(overrides=(), **fields)) for pattern, fields in rules.items())
+
+def add_readiness_arguments(parser):
+    """Add the command line options that build a ReadinessPolicy, see policy_from_args()."""
+    parser.add_argument('--wait-until', choices=WAIT_UNTIL, default=DEFAULT_POLICY.wait_until,
+                        help=f'Load state a page must reach (default: {DEFAULT_POLICY.wait_until})')
+    parser.add_argument('--wait-for-selector', metavar='SELECTOR',
+                        help='Also wait for an element matching this CSS selector')
+    parser.add_argument('--wait-for-function', metavar='JS',
+                        help='Also wait for this JavaScript expression to be truthy')
+    parser.add_argument('--page-timeout', type=float, default=DEFAULT_POLICY.timeout,
+                        help=f'Hard deadline in seconds for loading a page (default: {DEFAULT_POLICY.timeout:g})')
+    parser.add_argument('--partial', action='store_true',
+                        help='Use whatever the page has at the deadline instead of failing')
+    parser.add_argument('--readiness-rules', metavar='FILE',
+                        help='JSON file of per-URL readiness overrides, keyed by URL or host glob')
+
+def policy_from_args(args) -> ReadinessPolicy:
+    """Build the ReadinessPolicy given by the options of add_readiness_arguments()."""
+    policy = ReadinessPolicy(
+        wait_until=args.wait_until,
+        selector=args.wait_for_selector,
+        predicate=args.wait_for_function,
+        timeout=args.page_timeout,
+        partial=args.partial,
+    )
+    if args.readiness_rules:
+        policy = policy._replace(overrides=load_overrides(args.readiness_rules, policy))
+    return policy
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import logging
+from typing import FrozenSet, NamedTuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Request resource types Playwright reports
+RESOURCE_TYPES = ('document', 'stylesheet', 'image', 'media', 'font', 'script', 'texttrack', 'xhr',
+                  'fetch', 'eventsource', 'websocket', 'manifest', 'other')
+
+# Ad, analytics and tracking hosts; subdomains are blocked too
+AD_AND_TRACKER_DOMAINS = frozenset({
+    'doubleclick.net', 'googlesyndication.com', 'googleadservices.com', 'adservice.google.com',
+    'google-analytics.com', 'googletagmanager.com', 'googletagservices.com', 'amazon-adsystem.com',
+    'adnxs.com', 'criteo.com', 'criteo.net', 'pubmatic.com', 'rubiconproject.com', 'openx.net',
+    'taboola.com', 'outbrain.com', 'scorecardresearch.com', 'quantserve.com', 'moatads.com',
+    'connect.facebook.net', 'analytics.twitter.com', 'ads.linkedin.com', 'bat.bing.com', 'clarity.ms',
+    'hotjar.com', 'segment.io', 'cdn.segment.com', 'mixpanel.com', 'amplitude.com', 'fullstory.com',
+    'newrelic.com', 'nr-data.net', 'optimizely.com',
+})
+
+class BlockingProfile(NamedTuple):
+    """Requests to abort while a page loads: by resource type, and by host with its subdomains."""
+    resource_types: FrozenSet[str] = frozenset()
+    domains: FrozenSet[str] = frozenset()
+
+    def blocks(self, resource_type: str, url: str) -> bool:
+        if resource_type in self.resource_types:
+            return True
+        host = (urlsplit(url).hostname or '').lower()
+        while host:
+            if host in self.domains:
+                return True
+            host = host.partition('.')[2]
+        return False
+
+# Text extraction only needs the DOM: skip rendering assets and trackers, keep scripts and XHR
+TEXT_PROFILE = BlockingProfile(
+    resource_types=frozenset({'image', 'media', 'font', 'stylesheet', 'texttrack', 'manifest'}),
+    domains=AD_AND_TRACKER_DOMAINS,
+)
+# Screenshots need images, fonts and styles to look right; trackers and streams add nothing
+SCREENSHOT_PROFILE = BlockingProfile(
+    resource_types=frozenset({'media', 'eventsource', 'websocket'}),
+    domains=AD_AND_TRACKER_DOMAINS,
+)
+NO_BLOCKING = BlockingProfile()
+
+async def block_resources(page, profile: BlockingProfile):
+    """
+    Abort the requests of ``page`` that ``profile`` blocks, for every later navigation.
+
+    Routing a page turns off the browser's HTTP cache for it, so nothing is
+    routed when the profile blocks nothing.
+
+    Args:
+        page: The Playwright page
+        profile (BlockingProfile): What to block
+    """
+    if not profile.resource_types and not profile.domains:
+        return
+
+    async def handle(route):
+        request = route.request
+        # The page being loaded is never blocked, whatever its host
+        main_document = request.is_navigation_request() and request.frame.parent_frame is None
+        if not main_document and profile.blocks(request.resource_type, request.url):
+            logger.debug(f"Blocked {request.resource_type} {request.url}")
+            await route.abort('blockedbyclient')
+        else:
+            await route.continue_()
+
+    await page.route('**/*', handle)
+
+def read_domains(path: str) -> FrozenSet[str]:
+    """Read a domain list, one host per line; blank lines and # comments are skipped."""
+    with open(path, encoding='utf-8') as f:
+        lines = (line.split('#', 1)[0].strip().lower() for line in f)
+        return frozenset(line for line in lines if line)
+
+def parse_resource_types(value: str) -> FrozenSet[str]:
+    """Parse a comma-separated list of resource types."""
+    types = frozenset(t.strip() for t in value.split(',') if t.strip())
+    unknown = types - set(RESOURCE_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown resource types: {', '.join(sorted(unknown))}")
+    return types
+
+def add_blocking_arguments(parser, default: BlockingProfile):
+    """Add the command line options that adjust ``default``, see profile_from_args()."""
+    parser.add_argument('--block', metavar='TYPES', type=parse_resource_types,
+                        help='Comma-separated resource types to block, replacing the defaults '
+                             f'({",".join(sorted(default.resource_types)) or "none"}); '
+                             f'one of {", ".join(RESOURCE_TYPES[1:])}')
+    parser.add_argument('--block-domains', metavar='FILE', action='append',
+                        help='File of extra hosts to block, one per line; repeatable')
+    parser.add_argument('--no-blocking', action='store_true',
+                        help='Load every resource, including ads and trackers')
+
+def profile_from_args(args, default: BlockingProfile) -> BlockingProfile:
+    """Build the BlockingProfile given by the options of add_blocking_arguments()."""
+    if args.no_blocking:
+        return NO_BLOCKING
+    profile = default
+    if args.block is not None:
+        profile = profile._replace(resource_types=args.block)
+    for path in args.block_domains or ():
+        profile = profile._replace(domains=profile.domains | read_domains(path))
+    return profile
@@ -1,12 +1,121 @@
 #!/usr/bin/env python3
 
 import asyncio
-from playwright.async_api import async_playwright
+import hashlib
+import io
 import os
+import re
+import sys
 import tempfile
 from pathlib import Path
+from typing import AsyncIterator, Iterable, Iterator, NamedTuple, Optional, Tuple
 
-async def take_screenshot(url: str, output_path: str = None, width: int = 1280, height: int = 720) -> str:
+try:
+    from tools.browser_pool import get_browser_pool, iter_sync, run_sync
+    from tools.page_readiness import ReadinessPolicy, add_readiness_arguments, load_page, policy_from_args
+    from tools.resource_blocking import (BlockingProfile, SCREENSHOT_PROFILE, add_blocking_arguments,
+                                         block_resources, profile_from_args)
+except ImportError:
+    from browser_pool import get_browser_pool, iter_sync, run_sync
+    from page_readiness import ReadinessPolicy, add_readiness_arguments, load_page, policy_from_args
+    from resource_blocking import (BlockingProfile, SCREENSHOT_PROFILE, add_blocking_arguments, block_resources,
+                                   profile_from_args)
+
+# File extensions of the supported image formats
+FORMAT_EXTENSIONS = {'png': '.png', 'jpeg': '.jpg', 'webp': '.webp'}
+
+class ScreenshotOptions(NamedTuple):
+    """
+    What to capture and how to encode it.
+
+    JPEG encodes far faster than PNG. WebP makes the smallest files but
+    is the slowest format: Chromium only encodes PNG and JPEG, so a WebP
+    capture is a full PNG capture that Pillow decodes and re-encodes,
+    about three times the cost of the PNG alone. ``quality`` (0-100)
+    applies to JPEG and WebP; PNG is lossless and rejects it. ``clip`` is
+    an (x, y, width, height) region, ``selector`` captures the first
+    matching element only (the two exclude each other), and
+    ``full_page=False`` captures the viewport.
+    """
+    format: Optional[str] = None
+    quality: Optional[int] = None
+    full_page: bool = True
+    clip: Optional[Tuple[float, float, float, float]] = None
+    selector: Optional[str] = None
+
+def screenshot_format(options: ScreenshotOptions, output_path: Optional[str] = None) -> str:
+    """Return the image format to write: the one asked for, else the output path's extension, else PNG."""
+    if options.format is not None:
+        image_format = 'jpeg' if options.format.lower() == 'jpg' else options.format.lower()
+        if image_format not in FORMAT_EXTENSIONS:
+            raise ValueError(f"Unsupported screenshot format: {options.format}")
+    else:
+        extension = os.path.splitext(output_path or '')[1].lower()
+        image_format = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.webp': 'webp'}.get(extension, 'png')
+    if image_format == 'png' and options.quality is not None:
+        raise ValueError("Quality applies to JPEG and WebP only, PNG is lossless")
+    if options.clip is not None and options.selector is not None:
+        raise ValueError("Give either a clip region or a selector, not both")
+    return image_format
+
+async def capture(page, options: ScreenshotOptions = None, path: Optional[str] = None) -> bytes:
+    """
+    Screenshot a loaded page as described by ``options``.
+
+    Args:
+        page: The Playwright page
+        options (ScreenshotOptions, optional): Format and region, a full-page PNG by default
+        path (str, optional): File to write the image to as well
+
+    Returns:
+        bytes: The encoded image
+    """
+    options = options or ScreenshotOptions()
+    image_format = screenshot_format(options, path)
+    kwargs = {}
+    if path is not None and image_format != 'webp':
+        kwargs['path'] = path
+    if image_format == 'jpeg':
+        kwargs['type'] = 'jpeg'
+        if options.quality is not None:
+            kwargs['quality'] = options.quality
+    if options.selector is not None:
+        data = await page.locator(options.selector).first.screenshot(**kwargs)
+    else:
+        if options.clip is not None:
+            x, y, width, height = options.clip
+            kwargs['clip'] = {'x': x, 'y': y, 'width': width, 'height': height}
+        data = await page.screenshot(full_page=options.full_page, **kwargs)
+    if image_format == 'webp':
+        data = _to_webp(data, options.quality)
+        if path is not None:
+            with open(path, 'wb') as f:
+                f.write(data)
+    return data
+
+def _to_webp(png: bytes, quality: Optional[int]) -> bytes:
+    from PIL import Image
+    with Image.open(io.BytesIO(png)) as image:
+        buffer = io.BytesIO()
+        image.save(buffer, format='WEBP', quality=quality if quality is not None else 80)
+        return buffer.getvalue()
+
+class ScreenshotJob(NamedTuple):
+    """One capture of a batch: a URL at a viewport size."""
+    url: str
+    width: int = 1280
+    height: int = 720
+    output_path: Optional[str] = None
+
+class ScreenshotResult(NamedTuple):
+    """Outcome of a ScreenshotJob: the saved path, or the error that prevented it."""
+    job: ScreenshotJob
+    path: Optional[str]
+    error: Optional[Exception] = None
+
+async def take_screenshot(url: str, output_path: str = None, width: int = 1280, height: int = 720,
+                          browser_pool=None, options: ScreenshotOptions = None,
+                          readiness: ReadinessPolicy = None, blocking: BlockingProfile = None) -> str:
     """
     Take a screenshot of a webpage using Playwright.
     
@@ -15,42 +124,219 @@ async def take_screenshot(url: str, output_path: str = None, width: int = 1280,
         output_path (str, optional): Path to save the screenshot. If None, saves to a temporary file.
         width (int, optional): Viewport width. Defaults to 1280.
         height (int, optional): Viewport height. Defaults to 720.
+        browser_pool (BrowserPool, optional): Pool to take the page from. Defaults to the shared pool.
+        options (ScreenshotOptions, optional): Format and region. Defaults to a full-page PNG.
+        readiness (ReadinessPolicy, optional): When the page is ready to capture. Defaults to networkidle.
+        blocking (BlockingProfile, optional): Requests to abort while the page loads. Defaults to
+            SCREENSHOT_PROFILE, which keeps images, fonts and styles but skips media and ad and analytics hosts.
     
     Returns:
         str: Path to the saved screenshot
     """
+    options = options or ScreenshotOptions()
     if output_path is None:
-        # Create a temporary file with .png extension
-        temp_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
+        # Create a temporary file with the format's extension
+        suffix = FORMAT_EXTENSIONS[screenshot_format(options)]
+        temp_file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
         output_path = temp_file.name
         temp_file.close()
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        page = await browser.new_page(viewport={'width': width, 'height': height})
-        
-        try:
-            await page.goto(url, wait_until='networkidle')
-            await page.screenshot(path=output_path, full_page=True)
-        finally:
-            await browser.close()
-    
+    await _screenshot(url, width, height, browser_pool, options, readiness, blocking, output_path)
     return output_path
 
-def take_screenshot_sync(url: str, output_path: str = None, width: int = 1280, height: int = 720) -> str:
+async def take_screenshot_bytes(url: str, width: int = 1280, height: int = 720, browser_pool=None,
+                                options: ScreenshotOptions = None, readiness: ReadinessPolicy = None,
+                                blocking: BlockingProfile = None) -> bytes:
+    """
+    Take a screenshot of a webpage and return the encoded image, without writing a file.
+
+    Takes the same arguments as take_screenshot, except output_path.
+
+    Returns:
+        bytes: The encoded image
+    """
+    return await _screenshot(url, width, height, browser_pool, options or ScreenshotOptions(), readiness, blocking)
+
+async def _screenshot(url: str, width: int, height: int, browser_pool, options: ScreenshotOptions,
+                      readiness: Optional[ReadinessPolicy], blocking: Optional[BlockingProfile],
+                      output_path: Optional[str] = None) -> bytes:
+    # Invalid options fail before a page is loaded
+    screenshot_format(options, output_path)
+    if browser_pool is None:
+        browser_pool = await get_browser_pool()
+
+    async with browser_pool.page() as page:
+        await page.set_viewport_size({'width': width, 'height': height})
+        await block_resources(page, SCREENSHOT_PROFILE if blocking is None else blocking)
+        await load_page(page, url, readiness)
+        return await capture(page, options, output_path)
+
+def take_screenshot_sync(url: str, output_path: str = None, width: int = 1280, height: int = 720,
+                         options: ScreenshotOptions = None, readiness: ReadinessPolicy = None,
+                         blocking: BlockingProfile = None) -> str:
     """
     Synchronous wrapper for take_screenshot.
+
+    Runs on a shared background event loop so the browser stays warm between calls.
     """
-    return asyncio.run(take_screenshot(url, output_path, width, height))
+    return run_sync(take_screenshot(url, output_path, width, height, options=options, readiness=readiness,
+                                    blocking=blocking))
 
-if __name__ == "__main__":
+def take_screenshot_bytes_sync(url: str, width: int = 1280, height: int = 720,
+                               options: ScreenshotOptions = None, readiness: ReadinessPolicy = None,
+                               blocking: BlockingProfile = None) -> bytes:
+    """Synchronous wrapper for take_screenshot_bytes."""
+    return run_sync(take_screenshot_bytes(url, width, height, options=options, readiness=readiness,
+                                          blocking=blocking))
+
+def screenshot_filename(job: ScreenshotJob, image_format: str = 'png') -> str:
+    """Return a file name for a job that is readable and unique per URL and viewport."""
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', re.sub(r'^https?://', '', job.url)).strip('_')[:60]
+    digest = hashlib.sha1(job.url.encode('utf-8')).hexdigest()[:8]
+    return f"{slug}_{digest}_{job.width}x{job.height}{FORMAT_EXTENSIONS[image_format]}"
+
+async def iter_screenshots(jobs: Iterable[ScreenshotJob], output_dir: str = None, concurrency: int = 8,
+                           browser_pool=None, options: ScreenshotOptions = None,
+                           readiness: ReadinessPolicy = None,
+                           blocking: BlockingProfile = None) -> AsyncIterator[ScreenshotResult]:
+    """
+    Capture many (url, viewport) jobs concurrently on the pool's shared contexts.
+
+    Jobs run at most ``concurrency`` at a time, each in its own page, and
+    results are yielded as captures finish, so not in job order. A failed
+    capture yields its error instead of stopping the batch.
+
+    Args:
+        jobs (Iterable[ScreenshotJob]): The captures, as ScreenshotJob or (url, width, height) tuples
+        output_dir (str, optional): Directory for jobs without an output_path; temporary files otherwise
+        concurrency (int): Maximum number of pages capturing at the same time
+        browser_pool (BrowserPool, optional): Pool to take the pages from. Defaults to the shared pool.
+        options (ScreenshotOptions, optional): Format and region of every capture
+        readiness (ReadinessPolicy, optional): When a page is ready to capture, with per-URL overrides
+        blocking (BlockingProfile, optional): Requests to abort while pages load. Defaults to SCREENSHOT_PROFILE.
+
+    Yields:
+        ScreenshotResult: One result per job
+    """
+    options = options or ScreenshotOptions()
+    if browser_pool is None:
+        browser_pool = await get_browser_pool()
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    pending = iter(jobs)
+    results = asyncio.Queue()
+
+    async def worker():
+        for job in pending:
+            job = job if isinstance(job, ScreenshotJob) else ScreenshotJob(*job)
+            output_path = job.output_path
+            if output_path is None and output_dir is not None:
+                output_path = os.path.join(output_dir, screenshot_filename(job, screenshot_format(options)))
+            try:
+                path = await take_screenshot(job.url, output_path, job.width, job.height, browser_pool, options,
+                                             readiness, blocking)
+                await results.put(ScreenshotResult(job, path))
+            except Exception as e:
+                await results.put(ScreenshotResult(job, None, e))
+
+    async def run_all():
+        try:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        finally:
+            results.put_nowait(None)
+
+    runner = asyncio.ensure_future(run_all())
+    try:
+        while (result := await results.get()) is not None:
+            yield result
+        await runner
+    finally:
+        runner.cancel()
+
+def take_screenshots_sync(jobs: Iterable[ScreenshotJob], output_dir: str = None, concurrency: int = 8,
+                          options: ScreenshotOptions = None,
+                          readiness: ReadinessPolicy = None,
+                          blocking: BlockingProfile = None) -> Iterator[ScreenshotResult]:
+    """
+    Synchronous wrapper for iter_screenshots, yielding results as captures finish.
+
+    Runs on the shared background event loop, like take_screenshot_sync.
+    """
+    return iter_sync(iter_screenshots(jobs, output_dir, concurrency, options=options, readiness=readiness,
+                                      blocking=blocking))
+
+def parse_viewport(value: str):
+    """Parse a WIDTHxHEIGHT viewport argument."""
+    match = re.fullmatch(r'(\d+)x(\d+)', value)
+    if not match:
+        raise ValueError(f"Viewport must look like 1280x720, got {value}")
+    return int(match.group(1)), int(match.group(2))
+
+def parse_clip(value: str):
+    """Parse an X,Y,WIDTH,HEIGHT clip argument."""
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ValueError(f"Clip must look like 0,0,800,600, got {value}")
+    return tuple(float(part) for part in parts)
+
+def main():
     import argparse
     parser = argparse.ArgumentParser(description='Take a screenshot of a webpage')
-    parser.add_argument('url', help='URL to take screenshot of')
-    parser.add_argument('--output', '-o', help='Output path for screenshot')
+    parser.add_argument('url', nargs='*', help='URL to take screenshot of; several are captured concurrently')
+    parser.add_argument('--urls-file', help='File with one URL per line')
+    parser.add_argument('--output', '-o', help='Output path for the screenshot of a single URL and viewport')
+    parser.add_argument('--output-dir', help='Directory for the screenshots of a batch')
     parser.add_argument('--width', '-w', type=int, default=1280, help='Viewport width')
     parser.add_argument('--height', '-H', type=int, default=720, help='Viewport height')
+    parser.add_argument('--viewport', action='append', type=parse_viewport, metavar='WIDTHxHEIGHT',
+                        help='Viewport to capture every URL at; repeat for several')
+    parser.add_argument('--concurrency', type=int, default=8, help='Maximum number of pages capturing at once')
+    parser.add_argument('--format', choices=['png', 'jpeg', 'webp'],
+                        help='Image format (default: from the output extension, else png); jpeg is the fastest, '
+                             'webp the smallest but slower than png')
+    parser.add_argument('--quality', type=int, help='JPEG/WebP quality, 0-100; not allowed for png')
+    parser.add_argument('--clip', type=parse_clip, metavar='X,Y,WIDTH,HEIGHT', help='Capture this region only')
+    parser.add_argument('--selector', help='Capture the first element matching this CSS selector')
+    parser.add_argument('--viewport-only', action='store_true', help='Capture the viewport instead of the full page')
+    add_readiness_arguments(parser)
+    add_blocking_arguments(parser, SCREENSHOT_PROFILE)
     
     args = parser.parse_args()
-    output_path = take_screenshot_sync(args.url, args.output, args.width, args.height)
-    print(f"Screenshot saved to: {output_path}") 
\ No newline at end of file
+    urls = list(args.url)
+    if args.urls_file:
+        with open(args.urls_file, encoding='utf-8') as f:
+            urls.extend(line.strip() for line in f if line.strip())
+    if not urls:
+        parser.error('give a URL or --urls-file')
+    viewports = args.viewport or [(args.width, args.height)]
+    if args.output and (len(urls) > 1 or len(viewports) > 1 or args.output_dir):
+        parser.error('--output takes a single URL and viewport; use --output-dir for a batch')
+    options = ScreenshotOptions(format=args.format, quality=args.quality, full_page=not args.viewport_only,
+                                clip=args.clip, selector=args.selector)
+    try:
+        screenshot_format(options, args.output)
+    except ValueError as e:
+        parser.error(str(e))
+    readiness = policy_from_args(args)
+    blocking = profile_from_args(args, SCREENSHOT_PROFILE)
+
+    if len(urls) == 1 and len(viewports) == 1 and not args.output_dir:
+        output_path = take_screenshot_sync(urls[0], args.output, *viewports[0], options=options,
+                                           readiness=readiness, blocking=blocking)
+        print(f"Screenshot saved to: {output_path}")
+        return
+
+    jobs = [ScreenshotJob(url, width, height) for url in urls for width, height in viewports]
+    failed = 0
+    for result in take_screenshots_sync(jobs, args.output_dir, args.concurrency, options, readiness, blocking):
+        viewport = f"{result.job.width}x{result.job.height}"
+        if result.error is None:
+            print(f"{result.job.url} {viewport}: {result.path}", flush=True)
+        else:
+            failed += 1
+            print(f"ERROR: {result.job.url} {viewport}: {result.error}", file=sys.stderr, flush=True)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
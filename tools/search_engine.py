@@ -1,27 +1,151 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
+import os
+import random
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import NamedTuple
 from duckduckgo_search import DDGS
+from duckduckgo_search.exceptions import DuckDuckGoSearchException, RatelimitException, TimeoutException
 
-def search_with_retry(query, max_results=10, max_retries=3):
+try:
+    from tools.llm_cache import SQLiteCache
+except ImportError:
+    from llm_cache import SQLiteCache
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "cursor-playground", "search_engine", "results.sqlite",
+)
+DEFAULT_CACHE_TTL = 24 * 3600
+
+class RetryPolicy(NamedTuple):
+    """Exponential backoff with jitter; rate limits back off from a longer first delay."""
+    base_delay: float = 1.0
+    rate_limit_delay: float = 5.0
+    max_delay: float = 30.0
+
+    def delay(self, attempt, error_kind):
+        """Seconds to wait before retry number ``attempt + 1`` after an error of ``error_kind``."""
+        base = self.rate_limit_delay if error_kind == "rate_limit" else self.base_delay
+        delay = min(self.max_delay, base * 2 ** attempt)
+        # Jitter keeps concurrent searches that failed together from retrying together
+        return random.uniform(delay / 2, delay)
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+def classify_error(error):
+    """
+    Sort a search error into "rate_limit", "transient" or "permanent".
+
+    Rate limits and transient errors (timeouts, connection and HTTP
+    failures) are worth retrying; anything else will fail again.
+    """
+    message = str(error).lower()
+    if isinstance(error, RatelimitException) or "ratelimit" in message or "429" in message:
+        return "rate_limit"
+    if isinstance(error, (TimeoutException, TimeoutError, ConnectionError, DuckDuckGoSearchException)):
+        return "transient"
+    return "permanent"
+
+class CircuitOpenError(Exception):
+    """Raised instead of searching while the circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    Stop searching for a while after repeated failures, across every caller in the process.
+
+    After ``failure_threshold`` rate limits or transient errors in a row
+    the circuit opens and searches fail fast for ``reset_timeout``
+    seconds. Then a single search is let through: success closes the
+    circuit, failure opens it again. Permanent errors do not count, they
+    say nothing about the search service.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self._trial:
+                raise CircuitOpenError(
+                    f"Search circuit open after {self.failures} consecutive failures, "
+                    f"retry in {max(remaining, 0):.0f}s")
+            self._trial = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_neutral(self):
+        """End a trial search whose outcome says nothing about the service."""
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._trial = False
+
+# Shared by every search in the process
+_breaker = CircuitBreaker()
+
+def normalize_query(query):
+    """Collapse whitespace and case, so repeated queries are recognized."""
+    return " ".join(query.split()).lower()
+
+def search_with_retry(query, max_results=10, max_retries=3, ddgs=None, policy=DEFAULT_RETRY_POLICY,
+                      breaker=None):
     """
     Search using DuckDuckGo and return results with URLs and text snippets.
+
+    Rate limits and transient errors are retried with exponential backoff
+    and jitter; permanent errors are raised at once. While the circuit
+    breaker is open, CircuitOpenError is raised without searching.
     
     Args:
         query (str): Search query
         max_results (int): Maximum number of results to return
         max_retries (int): Maximum number of retry attempts
+        ddgs (DDGS, optional): Session to search with instead of opening a new one
+        policy (RetryPolicy): Delays between attempts
+        breaker (CircuitBreaker, optional): Circuit breaker, the process-wide one by default
     """
+    breaker = breaker or _breaker
     for attempt in range(max_retries):
+        breaker.before_call()
         try:
             print(f"DEBUG: Searching for query: {query} (attempt {attempt + 1}/{max_retries})", 
                   file=sys.stderr)
             
-            with DDGS() as ddgs:
+            if ddgs is None:
+                with DDGS() as session:
+                    results = list(session.text(query, max_results=max_results))
+            else:
                 results = list(ddgs.text(query, max_results=max_results))
                 
+            breaker.record_success()
             if not results:
                 print("DEBUG: No results found", file=sys.stderr)
                 return []
@@ -31,13 +155,97 @@ def search_with_retry(query, max_results=10, max_retries=3):
                 
         except Exception as e:
             print(f"ERROR: Attempt {attempt + 1}/{max_retries} failed: {str(e)}", file=sys.stderr)
+            kind = classify_error(e)
+            if kind == "permanent":
+                print("ERROR: Permanent error, not retrying", file=sys.stderr)
+                breaker.record_neutral()
+                raise
+            breaker.record_failure()
             if attempt < max_retries - 1:  # If not the last attempt
-                print(f"DEBUG: Waiting 1 second before retry...", file=sys.stderr)
-                time.sleep(1)  # Wait 1 second before retry
+                delay = policy.delay(attempt, kind)
+                print(f"DEBUG: Waiting {delay:.1f} seconds before retry ({kind.replace('_', ' ')})...",
+                      file=sys.stderr)
+                time.sleep(delay)
             else:
                 print(f"ERROR: All {max_retries} attempts failed", file=sys.stderr)
                 raise
 
+def cached_search(query, max_results=10, max_retries=3, cache=None, ddgs=None):
+    """search_with_retry, served from and stored in ``cache`` when one is given."""
+    if cache is None:
+        return search_with_retry(query, max_results, max_retries, ddgs)
+    key = json.dumps([normalize_query(query), max_results])
+    cached = cache.get(key)
+    if cached is not None:
+        print(f"DEBUG: Using cached results for query: {query}", file=sys.stderr)
+        return json.loads(cached)
+    results = search_with_retry(query, max_results, max_retries, ddgs)
+    # An empty answer may be a transient block; caching it would hide real results for the whole TTL
+    if results:
+        cache.set(key, json.dumps(results))
+    return results
+
+def _url_key(url):
+    return url.split("#", 1)[0].rstrip("/")
+
+def search_many(queries, max_results=10, max_retries=3, concurrency=4, cache=None, dedupe=True):
+    """
+    Run many queries concurrently, searching repeated queries only once.
+
+    Each worker thread reuses one DDGS session for all its queries; the
+    sessions are closed once every query is done. A query that fails
+    after its retries is reported and gets no results.
+
+    Args:
+        queries (Iterable[str]): Search queries
+        max_results (int): Maximum number of results per query
+        max_retries (int): Maximum number of retry attempts per query
+        concurrency (int): Maximum number of queries searched at the same time
+        cache (ResponseCache, optional): Cache of results by query, e.g. a SQLiteCache with a TTL
+        dedupe (bool): List each URL only under the first query that found it
+
+    Returns:
+        dict: Results per distinct query, in the order the queries were given
+    """
+    unique = {}
+    for query in queries:
+        if query.strip():
+            unique.setdefault(normalize_query(query), query.strip())
+    sessions = threading.local()
+    opened = ExitStack()
+    opened_lock = threading.Lock()
+
+    def run(query):
+        if not hasattr(sessions, "ddgs"):
+            sessions.ddgs = DDGS()
+            with opened_lock:
+                opened.push(sessions.ddgs)
+        return cached_search(query, max_results, max_retries, cache, sessions.ddgs)
+
+    results = {}
+    # The executor waits for its workers before the sessions they use are closed
+    with opened, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [(query, executor.submit(run, query)) for query in unique.values()]
+        for query, future in futures:
+            try:
+                results[query] = future.result()
+            except Exception as e:
+                print(f"ERROR: Search failed for query: {query}: {str(e)}", file=sys.stderr)
+                results[query] = []
+
+    if dedupe:
+        seen = set()
+        for query, query_results in results.items():
+            kept = []
+            for r in query_results:
+                key = _url_key(r.get('href', ''))
+                if key and key in seen:
+                    continue
+                seen.add(key)
+                kept.append(r)
+            results[query] = kept
+    return results
+
 def format_results(results):
     """Format and print search results."""
     for i, r in enumerate(results, 1):
@@ -46,7 +254,7 @@ def format_results(results):
         print(f"Title: {r.get('title', 'N/A')}")
         print(f"Snippet: {r.get('body', 'N/A')}")
 
-def search(query, max_results=10, max_retries=3):
+def search(query, max_results=10, max_retries=3, cache=None):
     """
     Main search function that handles search with retry mechanism.
     
@@ -54,9 +262,10 @@ def search(query, max_results=10, max_retries=3):
         query (str): Search query
         max_results (int): Maximum number of results to return
         max_retries (int): Maximum number of retry attempts
+        cache (ResponseCache, optional): Cache of results by query
     """
     try:
-        results = search_with_retry(query, max_results, max_retries)
+        results = cached_search(query, max_results, max_retries, cache)
         if results:
             format_results(results)
             
@@ -64,16 +273,45 @@ def search(query, max_results=10, max_retries=3):
         print(f"ERROR: Search failed: {str(e)}", file=sys.stderr)
         sys.exit(1)
 
+def search_all(queries, max_results=10, max_retries=3, concurrency=4, cache=None):
+    """Search many queries and print the results of each, URLs deduplicated across queries."""
+    for query, results in search_many(queries, max_results, max_retries, concurrency, cache).items():
+        print(f"\n##### Query: {query} ({len(results)} results) #####")
+        format_results(results)
+
 def main():
     parser = argparse.ArgumentParser(description="Search using DuckDuckGo API")
-    parser.add_argument("query", help="Search query")
+    parser.add_argument("query", nargs="*", help="Search query; several queries are searched concurrently")
+    parser.add_argument("--queries-file", help="File with one search query per line")
     parser.add_argument("--max-results", type=int, default=10,
                       help="Maximum number of results (default: 10)")
     parser.add_argument("--max-retries", type=int, default=3,
                       help="Maximum number of retry attempts (default: 3)")
+    parser.add_argument("--concurrency", type=int, default=4,
+                      help="Maximum number of queries searched at the same time (default: 4)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH,
+                      help=f"SQLite file caching results (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_CACHE_TTL,
+                      help=f"Seconds cached results stay valid (default: {DEFAULT_CACHE_TTL})")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the result cache")
     
     args = parser.parse_args()
-    search(args.query, args.max_results, args.max_retries)
+    queries = list(args.query)
+    if args.queries_file:
+        with open(args.queries_file, encoding="utf-8") as f:
+            queries.extend(line.strip() for line in f if line.strip())
+    if not queries:
+        parser.error("give a query or --queries-file")
+
+    cache = None if args.no_cache else SQLiteCache(args.cache, ttl=args.cache_ttl)
+    try:
+        if len(queries) == 1:
+            search(queries[0], args.max_results, args.max_retries, cache)
+        else:
+            search_all(queries, args.max_results, args.max_retries, args.concurrency, cache)
+    finally:
+        if cache is not None:
+            cache.close()
 
 if __name__ == "__main__":
     main()
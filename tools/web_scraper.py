@@ -4,14 +4,35 @@ import asyncio
 import argparse
 import sys
 import os
-from typing import List, Optional
-from playwright.async_api import async_playwright
+import re
+import hashlib
+import sqlite3
+import threading
+import aiohttp
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 import html5lib
-from multiprocessing import Pool
+import multiprocessing
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
 import time
-from urllib.parse import urlparse
+from pathlib import Path
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode
 import logging
 
+try:
+    from tools.browser_pool import BrowserPool, get_browser_pool, close_browser_pool, iter_sync, run_sync
+    from tools.page_readiness import (ReadinessPolicy, add_readiness_arguments, load_page, page_content,
+                                       policy_from_args)
+    from tools.resource_blocking import (BlockingProfile, TEXT_PROFILE, add_blocking_arguments, block_resources,
+                                         profile_from_args)
+except ImportError:
+    from browser_pool import BrowserPool, get_browser_pool, close_browser_pool, iter_sync, run_sync
+    from page_readiness import (ReadinessPolicy, add_readiness_arguments, load_page, page_content,
+                                policy_from_args)
+    from resource_blocking import (BlockingProfile, TEXT_PROFILE, add_blocking_arguments, block_resources,
+                                   profile_from_args)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -20,24 +41,269 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-async def fetch_page(url: str, context) -> Optional[str]:
-    """Asynchronously fetch a webpage's content."""
+# Lines containing any of these patterns are likely to be noise
+NOISE_PATTERNS = [
+    'var ',
+    'function()',
+    '.js',
+    '.css',
+    'google-analytics',
+    'disqus',
+    '{',
+    '}'
+]
+
+# Default location of the page cache used by the CLI
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+    'cursor-playground', 'web_scraper'
+)
+
+# Headers for the plain HTTP fetch, close to what the browser would send
+HTTP_HEADERS = {
+    'User-Agent': ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+                   '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'),
+    'Accept': 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.8',
+}
+
+# Larger responses are left to the browser
+MAX_HTTP_BODY = 20 * 1024 * 1024
+HTTP_READ_CHUNK = 64 * 1024
+
+# Pages with less visible text than this are assumed to be rendered by JavaScript
+MIN_STATIC_TEXT = 200
+
+_INVISIBLE_RE = re.compile(r'<(script|style|noscript|template)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r'<[^>]*>')
+_WHITESPACE_RE = re.compile(r'\s+')
+# Empty mount points of single-page app frameworks
+_SPA_ROOT_RE = re.compile(
+    r'<(div|main|body)\b[^>]*\bid=["\']?(root|app|__next|__nuxt|svelte|react-root)["\'\s>][^>]*>\s*</\1>'
+    r'|<app-root\b[^>]*>\s*</app-root>'
+    r'|<div\b[^>]*\bng-app\b[^>]*>\s*</div>',
+    re.IGNORECASE
+)
+
+_http_session: Optional[aiohttp.ClientSession] = None
+_http_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+async def _close_stale_session(session: aiohttp.ClientSession, loop: asyncio.AbstractEventLoop):
+    """Close a session that belongs to another event loop than the running one."""
+    if session.closed:
+        return
+    try:
+        if loop.is_running():
+            # The loop lives on in another thread, so the session is closed there
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+        elif loop.is_closed():
+            # Its transports can no longer be closed; this only releases the connector
+            await session.close()
+        else:
+            await asyncio.to_thread(loop.run_until_complete, session.close())
+    except Exception as e:
+        logger.debug(f"Error closing stale HTTP session: {str(e)}")
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Return the shared HTTP session for the running event loop, creating it on first use."""
+    global _http_session, _http_session_loop
+    loop = asyncio.get_running_loop()
+    if _http_session is None or _http_session.closed or _http_session_loop is not loop:
+        stale, stale_loop = _http_session, _http_session_loop
+        _http_session = None
+        if stale is not None and stale_loop is not loop:
+            await _close_stale_session(stale, stale_loop)
+        connector = aiohttp.TCPConnector(limit=100, limit_per_host=8, ttl_dns_cache=300)
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            headers=HTTP_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=30)
+        )
+        _http_session_loop = loop
+    return _http_session
+
+async def close_http_session():
+    """Close the shared HTTP session, on the event loop it belongs to."""
+    global _http_session, _http_session_loop
+    session, loop = _http_session, _http_session_loop
+    _http_session = None
+    _http_session_loop = None
+    if session is None:
+        return
+    if loop is asyncio.get_running_loop():
+        await session.close()
+    else:
+        await _close_stale_session(session, loop)
+
+def needs_browser(html_content: str, min_text_length: int = MIN_STATIC_TEXT) -> bool:
+    """
+    Guess whether a page fetched over plain HTTP only renders in a browser.
+
+    Args:
+        html_content (str): The raw HTML
+        min_text_length (int): Minimum visible characters of a server-rendered page
+
+    Returns:
+        bool: True for empty bodies, <noscript> shells and empty SPA mount points
+    """
+    if _SPA_ROOT_RE.search(html_content):
+        return True
+    body_start = html_content.find('<body')
+    if body_start < 0:
+        body_start = html_content.find('<BODY')
+    body = html_content[body_start:] if body_start >= 0 else html_content
+    # Text inside <noscript> is not visible once scripts run, so a shell has none
+    text = _TAG_RE.sub(' ', _INVISIBLE_RE.sub(' ', body))
+    return len(_WHITESPACE_RE.sub('', text)) < min_text_length
+
+class FetchResult(NamedTuple):
+    """Outcome of a fetch, with the validators needed to revalidate it later."""
+    html: Optional[str]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    not_modified: bool = False
+    partial: bool = False
+
+async def _read_body(response: aiohttp.ClientResponse) -> Optional[str]:
+    """Read and decode a response body, giving up once it grows past MAX_HTTP_BODY."""
+    # Chunked responses have no Content-Length, so the size is checked as it arrives
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(HTTP_READ_CHUNK):
+        body += chunk
+        if len(body) > MAX_HTTP_BODY:
+            return None
+    try:
+        return body.decode(response.charset or 'utf-8', errors='replace')
+    except LookupError:
+        return body.decode('utf-8', errors='replace')
+
+async def _fetch_http(url: str, session: Optional[aiohttp.ClientSession] = None,
+                      headers: Optional[Dict[str, str]] = None) -> FetchResult:
+    if session is None:
+        session = await get_http_session()
+    try:
+        logger.info(f"Fetching {url} over HTTP")
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304:
+                return FetchResult(None, not_modified=True)
+            if response.status != 200:
+                logger.debug(f"HTTP {response.status} for {url}")
+                return FetchResult(None)
+            content_type = response.headers.get('Content-Type', '')
+            if content_type and 'html' not in content_type.lower():
+                logger.debug(f"Unexpected content type {content_type} for {url}")
+                return FetchResult(None)
+            if response.content_length and response.content_length > MAX_HTTP_BODY:
+                return FetchResult(None)
+            html_content = await _read_body(response)
+            if html_content is None:
+                logger.debug(f"Response from {url} exceeds {MAX_HTTP_BODY} bytes")
+                return FetchResult(None)
+            return FetchResult(
+                html_content,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified')
+            )
+    except Exception as e:
+        logger.debug(f"HTTP fetch of {url} failed: {str(e)}")
+        return FetchResult(None)
+
+async def fetch_page_http(url: str, session: Optional[aiohttp.ClientSession] = None) -> Optional[str]:
+    """
+    Fetch a webpage with a plain HTTP GET.
+
+    Args:
+        url (str): The URL to fetch
+        session (aiohttp.ClientSession, optional): Session to use. Defaults to the shared session.
+
+    Returns:
+        Optional[str]: The HTML, or None for errors, non-HTML and oversized responses
+    """
+    return (await _fetch_http(url, session)).html
+
+async def _fetch_tiered(url: str, browser_pool: Optional[BrowserPool], http_first: bool,
+                        validators: Optional[Dict[str, str]] = None,
+                        readiness: Optional[ReadinessPolicy] = None,
+                        blocking: Optional[BlockingProfile] = None) -> FetchResult:
+    if http_first:
+        result = await _fetch_http(url, headers=validators)
+        if result.not_modified:
+            logger.info(f"{url} not modified")
+            return result
+        if result.html is not None and not needs_browser(result.html):
+            logger.info(f"Successfully fetched {url}")
+            return result
+        logger.info(f"Rendering {url} in the browser")
+    if browser_pool is None:
+        browser_pool = await get_browser_pool()
+    async with browser_pool.page() as page:
+        return await _load_page(url, page, readiness, blocking)
+
+async def fetch_page_tiered(url: str, browser_pool: Optional[BrowserPool] = None,
+                            http_first: bool = True, readiness: Optional[ReadinessPolicy] = None,
+                            blocking: Optional[BlockingProfile] = None) -> Optional[str]:
+    """
+    Fetch a webpage over plain HTTP, falling back to the browser when needed.
+
+    The browser is only used when the HTTP fetch fails or needs_browser()
+    considers the response a JavaScript-rendered page.
+
+    Args:
+        url (str): The URL to fetch
+        browser_pool (BrowserPool, optional): Pool for the browser fallback. Defaults to the shared pool.
+        http_first (bool): Try the plain HTTP fetch before the browser
+        readiness (ReadinessPolicy, optional): When a rendered page is ready. Defaults to networkidle.
+        blocking (BlockingProfile, optional): Requests the browser skips. Defaults to TEXT_PROFILE.
+    """
+    return (await _fetch_tiered(url, browser_pool, http_first, readiness=readiness, blocking=blocking)).html
+
+async def fetch_page(url: str, context=None, readiness: Optional[ReadinessPolicy] = None,
+                     blocking: Optional[BlockingProfile] = None) -> Optional[str]:
+    """
+    Asynchronously fetch a webpage's content.
+
+    Args:
+        url (str): The URL to fetch
+        context: Browser context to open the page in. If None, a page is taken
+            from the shared browser pool.
+        readiness (ReadinessPolicy, optional): When the page counts as loaded,
+            with per-URL overrides and a deadline. Defaults to networkidle.
+        blocking (BlockingProfile, optional): Requests to abort while the page
+            loads. Defaults to TEXT_PROFILE, which skips images, media, fonts,
+            stylesheets and ad and analytics hosts.
+    """
+    if context is None:
+        pool = await get_browser_pool()
+        async with pool.page() as page:
+            return (await _load_page(url, page, readiness, blocking)).html
     page = await context.new_page()
+    try:
+        return (await _load_page(url, page, readiness, blocking)).html
+    finally:
+        await page.close()
+
+async def _load_page(url: str, page, readiness: Optional[ReadinessPolicy] = None,
+                     blocking: Optional[BlockingProfile] = None) -> FetchResult:
     try:
         logger.info(f"Fetching {url}")
-        await page.goto(url)
-        await page.wait_for_load_state('networkidle')
-        content = await page.content()
-        logger.info(f"Successfully fetched {url}")
-        return content
+        await block_resources(page, TEXT_PROFILE if blocking is None else blocking)
+        ready = await load_page(page, url, readiness)
+        content = await page_content(page)
+        if ready:
+            logger.info(f"Successfully fetched {url}")
+        else:
+            logger.info(f"Fetched partial content of {url}")
+        return FetchResult(content, partial=not ready)
     except Exception as e:
         logger.error(f"Error fetching {url}: {str(e)}")
-        return None
-    finally:
-        await page.close()
+        return FetchResult(None)
 
-def parse_html(html_content: Optional[str]) -> str:
-    """Parse HTML content and extract text with hyperlinks in markdown format."""
+def parse_html_tree(html_content: Optional[str]) -> str:
+    """Parse HTML content and extract text with hyperlinks in markdown format.
+
+    Reference implementation that asks every element for its full text while
+    walking the tree recursively, which is quadratic in nesting depth. Kept
+    for parity testing of parse_html.
+    """
     if not html_content:
         return ""
     
@@ -105,16 +371,7 @@ def parse_html(html_content: Optional[str]) -> str:
         filtered_result = []
         for line in result:
             # Skip lines that are likely to be noise
-            if any(pattern in line.lower() for pattern in [
-                'var ', 
-                'function()', 
-                '.js',
-                '.css',
-                'google-analytics',
-                'disqus',
-                '{',
-                '}'
-            ]):
+            if any(pattern in line.lower() for pattern in NOISE_PATTERNS):
                 continue
             filtered_result.append(line)
         
@@ -123,36 +380,508 @@ def parse_html(html_content: Optional[str]) -> str:
         logger.error(f"Error parsing HTML: {str(e)}")
         return ""
 
-async def process_urls(urls: List[str], max_concurrent: int = 5) -> List[str]:
-    """Process multiple URLs concurrently."""
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
+def _elements_with_text(root) -> set:
+    """
+    Return the ids of the elements whose text, or any descendant's text, is not blank.
+
+    Matches ``any(text.strip() for text in elem.itertext())`` for every element
+    at once, bottom-up, instead of walking each subtree again per element.
+    """
+    order = []
+    stack = [root]
+    while stack:
+        elem = stack.pop()
+        order.append(elem)
+        stack.extend(elem)
+    with_text = set()
+    # Preorder reversed visits every child before its parent
+    for elem in reversed(order):
+        if (elem.text and elem.text.strip()) or any(
+                id(child) in with_text or (child.tail and child.tail.strip()) for child in elem):
+            with_text.add(id(elem))
+    return with_text
+
+def parse_html(html_content: Optional[str]) -> str:
+    """
+    Parse HTML content and extract text with hyperlinks in markdown format.
+
+    Produces the same output as parse_html_tree in time linear in the size of
+    the tree: which elements hold any text is worked out in one bottom-up
+    pass, and the walk itself uses an explicit stack, so deeply nested pages
+    neither repeat work per level nor hit the recursion limit.
+    """
+    if not html_content:
+        return ""
+
+    try:
+        document = html5lib.parse(html_content)
+        body = document.find('.//{http://www.w3.org/1999/xhtml}body')
+        root = body if body is not None else document
+        with_text = _elements_with_text(root)
+        result = []
+        seen_texts = set()  # To avoid duplicates
+
+        # Entries are (element, depth, tail): the element itself, or only its tail
+        stack = [(root, 0, False)]
+        while stack:
+            elem, depth, tail = stack.pop()
+            if tail:
+                text = elem.tail.strip() if elem.tail else ''
+                if text and text not in seen_texts:
+                    result.append("  " * depth + text)
+                    seen_texts.add(text)
+                continue
+            # Skipped elements drop their tail too
+            if elem.tag in ('{http://www.w3.org/1999/xhtml}script',
+                            '{http://www.w3.org/1999/xhtml}style') or id(elem) not in with_text:
+                continue
+
+            text = elem.text.strip() if elem.text else ''
+            if text and text not in seen_texts:
+                if elem.tag == '{http://www.w3.org/1999/xhtml}a':
+                    href = None
+                    for attr, value in elem.items():
+                        if attr.endswith('href'):
+                            href = value
+                            break
+                    if href and not href.startswith(('#', 'javascript:')):
+                        result.append("  " * depth + f"[{text}]({href})")
+                        seen_texts.add(text)
+                else:
+                    result.append("  " * depth + text)
+                    seen_texts.add(text)
+
+            stack.append((elem, depth, True))
+            stack.extend((child, depth + 1, False) for child in reversed(elem))
+
+        return '\n'.join(line for line in result
+                         if not any(pattern in line.lower() for pattern in NOISE_PATTERNS))
+    except Exception as e:
+        logger.error(f"Error parsing HTML: {str(e)}")
+        return ""
+
+def _parse_shared_html(name: str, size: int) -> str:
+    """Parse HTML handed over through a shared memory block (runs in a worker)."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        html_content = bytes(shm.buf[:size]).decode('utf-8')
+    finally:
+        shm.close()
+    return parse_html(html_content)
+
+class ParseExecutor:
+    """
+    Long-lived process pool that parses pages as the fetch stage delivers them.
+
+    Pages below ``inline_limit`` characters are parsed directly, as handing
+    them to another process costs more than parsing them. Larger pages go to
+    the pool, and pages of ``shared_memory_limit`` characters or more are
+    passed through a shared memory block instead of being pickled. Worker
+    processes are started on first use and kept for the life of the executor.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, inline_limit: int = 64 * 1024,
+                 shared_memory_limit: int = 1024 * 1024):
+        """
+        Args:
+            max_workers (int, optional): Number of worker processes. Defaults to the CPU count.
+            inline_limit (int): Pages shorter than this are parsed in the calling process
+            shared_memory_limit (int): Pages at least this long are passed through shared memory
+        """
+        self.max_workers = max_workers
+        self.inline_limit = inline_limit
+        self.shared_memory_limit = shared_memory_limit
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned workers do not inherit the browser pool's threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    async def parse(self, html_content: Optional[str]) -> str:
+        """Parse a page, choosing inline, pickled or shared memory handoff by size."""
+        if not html_content or len(html_content) < self.inline_limit:
+            return parse_html(html_content)
+        loop = asyncio.get_running_loop()
         try:
-            # Create browser contexts
-            n_contexts = min(len(urls), max_concurrent)
-            contexts = [await browser.new_context() for _ in range(n_contexts)]
-            
-            # Create tasks for each URL
-            tasks = []
-            for i, url in enumerate(urls):
-                context = contexts[i % len(contexts)]
-                task = fetch_page(url, context)
-                tasks.append(task)
-            
-            # Gather results
-            html_contents = await asyncio.gather(*tasks)
-            
-            # Parse HTML contents in parallel
-            with Pool() as pool:
-                results = pool.map(parse_html, html_contents)
-                
-            return results
-            
-        finally:
-            # Cleanup
-            for context in contexts:
-                await context.close()
-            await browser.close()
+            if len(html_content) < self.shared_memory_limit:
+                return await loop.run_in_executor(self._get_executor(), parse_html, html_content)
+            data = html_content.encode('utf-8')
+            shm = shared_memory.SharedMemory(create=True, size=len(data))
+            try:
+                shm.buf[:len(data)] = data
+                return await loop.run_in_executor(
+                    self._get_executor(), _parse_shared_html, shm.name, len(data))
+            finally:
+                shm.close()
+                shm.unlink()
+        except BrokenProcessPool:
+            logger.warning("Parse worker died, restarting the pool")
+            self.shutdown()
+            return parse_html(html_content)
+
+    def shutdown(self):
+        """Stop the worker processes; they are started again on the next parse."""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+_parse_executor: Optional[ParseExecutor] = None
+
+def get_parse_executor() -> ParseExecutor:
+    """Return the parse executor shared by all fetches in this process."""
+    global _parse_executor
+    if _parse_executor is None:
+        _parse_executor = ParseExecutor()
+    return _parse_executor
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL for use as a cache key.
+
+    Lowercases the scheme and host, drops default ports and the fragment,
+    and sorts the query parameters.
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{parts.port}"
+    if parts.username or parts.password:
+        host = f"{parts.username or ''}:{parts.password or ''}@{host}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+class CachedPage(NamedTuple):
+    """Index entry of a cached page."""
+    url: str
+    html_hash: str
+    text_hash: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+class PageCache:
+    """
+    On-disk cache of fetched pages and their extracted text.
+
+    HTML and text are stored as content-addressed blobs, so identical pages
+    share storage, and a SQLite index maps each normalized URL to its blobs
+    and HTTP validators. Entries younger than ``ttl`` seconds are served
+    without a request; older ones are revalidated with If-None-Match /
+    If-Modified-Since when the server sent validators. Once the blobs
+    referenced by the index exceed ``max_bytes``, the least recently used
+    entries are evicted. The methods block on disk I/O and may be called
+    from several threads at once.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, ttl: float = 3600,
+                 max_bytes: int = 512 * 1024 * 1024):
+        """
+        Args:
+            cache_dir (str): Directory holding the index and the blobs
+            ttl (float): Seconds an entry is served without revalidation
+            max_bytes (int): Size limit of the cached HTML and text
+        """
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        (self.cache_dir / 'blobs').mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.cache_dir / 'index.sqlite'), timeout=30,
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                html_hash TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        return time.time() - page.fetched_at < self.ttl
+
+    def validators(self, page: CachedPage) -> Dict[str, str]:
+        """Conditional request headers for revalidating a cached page."""
+        headers = {}
+        if page.etag:
+            headers['If-None-Match'] = page.etag
+        if page.last_modified:
+            headers['If-Modified-Since'] = page.last_modified
+        return headers
+
+    def lookup(self, url: str) -> Optional[CachedPage]:
+        """Return the entry for ``url`` and mark it as recently used."""
+        key = normalize_url(url)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, html_hash, text_hash, etag, last_modified, fetched_at FROM pages WHERE url = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            page = CachedPage(*row)
+            if not (self._blob_path(page.html_hash).exists() and self._blob_path(page.text_hash).exists()):
+                self._db.execute("DELETE FROM pages WHERE url = ?", (key,))
+                return None
+            self._db.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), key))
+        return page
+
+    def read_html(self, page: CachedPage) -> str:
+        return self._blob_path(page.html_hash).read_bytes().decode('utf-8')
+
+    def read_text(self, page: CachedPage) -> str:
+        return self._blob_path(page.text_hash).read_bytes().decode('utf-8')
+
+    def refresh(self, url: str):
+        """Restart the TTL of an entry the server confirmed as not modified."""
+        with self._lock:
+            self._db.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), normalize_url(url)))
+
+    def store(self, url: str, html_content: str, text: str,
+              etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """Cache a page and its extracted text, evicting old entries when over budget."""
+        html_data = html_content.encode('utf-8')
+        text_data = text.encode('utf-8')
+        html_hash = self._write_blob(html_data)
+        text_hash = self._write_blob(text_data)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (normalize_url(url), html_hash, text_hash, etag, last_modified,
+                 len(html_data) + len(text_data), now, now)
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT url, html_hash, text_hash, size FROM pages ORDER BY accessed_at").fetchall()
+        for url, html_hash, text_hash, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM pages WHERE url = ?", (url,))
+            total -= size
+            for blob_hash in (html_hash, text_hash):
+                referenced = self._db.execute(
+                    "SELECT 1 FROM pages WHERE html_hash = ? OR text_hash = ? LIMIT 1", (blob_hash, blob_hash)
+                ).fetchone()
+                if not referenced:
+                    self._blob_path(blob_hash).unlink(missing_ok=True)
+
+    def _blob_path(self, blob_hash: str) -> Path:
+        return self.cache_dir / 'blobs' / blob_hash[:2] / blob_hash
+
+    def _write_blob(self, data: bytes) -> str:
+        blob_hash = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(blob_hash)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            # Threads of one process may write the same blob at once
+            tmp_path = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        return blob_hash
+
+async def _fetch_and_parse(url: str, browser_pool: Optional[BrowserPool], http_first: bool,
+                           parse_executor: ParseExecutor, cache: Optional[PageCache],
+                           readiness: Optional[ReadinessPolicy] = None,
+                           blocking: Optional[BlockingProfile] = None) -> str:
+    """
+    Fetch and parse one page, going through the cache when one is given.
+
+    A stale entry whose page cannot be fetched again is served as it is.
+    The cache's SQLite and blob I/O runs in a thread, off the event loop.
+    """
+    cached = await asyncio.to_thread(cache.lookup, url) if cache is not None else None
+    if cached is not None and cache.is_fresh(cached):
+        logger.info(f"Cache hit for {url}")
+        return await asyncio.to_thread(cache.read_text, cached)
+    validators = cache.validators(cached) if cached is not None else None
+    try:
+        result = await _fetch_tiered(url, browser_pool, http_first, validators or None, readiness, blocking)
+    except Exception as e:
+        if cached is None:
+            raise
+        logger.warning(f"Error fetching {url}, serving the stale cached copy: {str(e)}")
+        return await asyncio.to_thread(cache.read_text, cached)
+    if cached is not None:
+        if result.not_modified:
+            await asyncio.to_thread(cache.refresh, url)
+            return await asyncio.to_thread(cache.read_text, cached)
+        if not result.html:
+            logger.warning(f"Could not fetch {url}, serving the stale cached copy")
+            return await asyncio.to_thread(cache.read_text, cached)
+    text = await parse_executor.parse(result.html)
+    # Partial pages are not cached, the next fetch may get the whole page
+    if cache is not None and result.html and not result.partial:
+        await asyncio.to_thread(cache.store, url, result.html, text, result.etag, result.last_modified)
+    return text
+
+async def iter_urls(urls: Iterable[str], max_concurrent: int = 5, browser_pool: Optional[BrowserPool] = None,
+                    http_first: bool = True, cache: Optional[PageCache] = None,
+                    readiness: Optional[ReadinessPolicy] = None,
+                    blocking: Optional[BlockingProfile] = None) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Fetch and parse URLs, yielding each result as soon as its page is done.
+
+    A fixed set of ``max_concurrent`` workers pulls URLs from ``urls`` one at a
+    time, so at most that many pages are open and the input may be a lazy
+    iterable of any length; it is read in a separate thread, so a slow source
+    such as stdin does not hold up pages already being fetched. Results come
+    out in completion order; a page that fails to load or parse yields an
+    empty string.
+
+    Args:
+        urls (Iterable[str]): URLs to fetch
+        max_concurrent (int): Maximum number of pages open at once
+        browser_pool (BrowserPool, optional): Pool to take pages from. Defaults
+            to the shared pool, which stays open for later calls.
+        http_first (bool): Try a plain HTTP GET before rendering in the browser
+        cache (PageCache, optional): Cache to serve and store pages
+        readiness (ReadinessPolicy, optional): When a rendered page is ready. Defaults to networkidle.
+        blocking (BlockingProfile, optional): Requests the browser skips. Defaults to TEXT_PROFILE.
+
+    Yields:
+        Tuple[str, str]: (url, extracted text)
+    """
+    results = _iter_indexed(urls, max_concurrent, browser_pool, http_first, cache, readiness, blocking)
+    try:
+        async for _, url, text in results:
+            yield url, text
+    finally:
+        # Stop the workers right away when the caller leaves early
+        await results.aclose()
+
+def _read_urls(urls: Iterable[str], size: int) -> Tuple[asyncio.Queue, threading.Event]:
+    """
+    Iterate ``urls`` in a daemon thread, so a slow source such as stdin does not block the event loop.
+
+    The queue receives ``(index, url)`` pairs, then None once ``urls`` is
+    exhausted, or the exception it raised. Setting the returned event makes
+    the thread stop after its current URL.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        try:
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+            return True
+        except (RuntimeError, CancelledError):
+            # The event loop is closed or shutting down
+            return False
+
+    def read():
+        try:
+            for item in enumerate(urls):
+                if stop.is_set() or not put(item):
+                    return
+            end = None
+        except Exception as e:
+            end = e
+        if not stop.is_set():
+            put(end)
+
+    threading.Thread(target=read, name='url-reader', daemon=True).start()
+    return queue, stop
+
+async def _iter_indexed(urls: Iterable[str], max_concurrent: int, browser_pool: Optional[BrowserPool],
+                        http_first: bool, cache: Optional[PageCache],
+                        readiness: Optional[ReadinessPolicy] = None,
+                        blocking: Optional[BlockingProfile] = None) -> AsyncIterator[Tuple[int, str, str]]:
+    """Scheduler behind iter_urls, also reporting each URL's input position."""
+    parse_executor = get_parse_executor()
+    max_concurrent = max(1, max_concurrent)
+    pending, stop = _read_urls(urls, max_concurrent)
+    # Bounded so finished pages wait for a slow consumer instead of piling up
+    results: asyncio.Queue = asyncio.Queue(maxsize=max_concurrent)
+    done = object()
+
+    async def worker():
+        while True:
+            item = await pending.get()
+            if not isinstance(item, tuple):
+                # Leave the end of the input for the other workers
+                pending.put_nowait(item)
+                await results.put(done if item is None else item)
+                return
+            index, url = item
+            try:
+                text = await _fetch_and_parse(url, browser_pool, http_first, parse_executor, cache, readiness,
+                                              blocking)
+            except Exception as e:
+                logger.error(f"Error processing {url}: {str(e)}")
+                text = ""
+            await results.put((index, url, text))
+
+    workers = [asyncio.create_task(worker()) for _ in range(max_concurrent)]
+    try:
+        remaining = len(workers)
+        while remaining:
+            item = await results.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # Unblock the reader if it is waiting for room in the queue
+        while not pending.empty():
+            pending.get_nowait()
+
+async def process_urls(urls: List[str], max_concurrent: int = 5, browser_pool: Optional[BrowserPool] = None,
+                       http_first: bool = True, cache: Optional[PageCache] = None,
+                       readiness: Optional[ReadinessPolicy] = None,
+                       blocking: Optional[BlockingProfile] = None) -> List[str]:
+    """
+    Process multiple URLs concurrently.
+
+    Args:
+        urls (List[str]): URLs to fetch
+        max_concurrent (int): Maximum number of pages open at once
+        browser_pool (BrowserPool, optional): Pool to take pages from. Defaults
+            to the shared pool, which stays open for later calls.
+        http_first (bool): Try a plain HTTP GET before rendering in the browser
+        cache (PageCache, optional): Cache to serve and store pages
+        readiness (ReadinessPolicy, optional): When a rendered page is ready. Defaults to networkidle.
+        blocking (BlockingProfile, optional): Requests the browser skips. Defaults to TEXT_PROFILE.
+
+    Returns:
+        List[str]: Extracted text for each URL, in input order
+    """
+    results = [""] * len(urls)
+    async for index, _, text in _iter_indexed(urls, max_concurrent, browser_pool, http_first, cache, readiness,
+                                              blocking):
+        results[index] = text
+    return results
+
+async def _close_shared_clients():
+    await close_http_session()
+    await close_browser_pool()
 
 def validate_url(url: str) -> bool:
     """Validate if the given string is a valid URL."""
@@ -162,11 +891,40 @@ def validate_url(url: str) -> bool:
     except:
         return False
 
+def iter_valid_urls(lines: Iterable[str]) -> Iterator[str]:
+    """Yield the valid URLs among ``lines``, logging the invalid ones."""
+    for line in lines:
+        url = line.strip()
+        if not url:
+            continue
+        if validate_url(url):
+            yield url
+        else:
+            logger.error(f"Invalid URL: {url}")
+
+def print_result(url: str, text: str):
+    """Print the extracted text of one page to stdout."""
+    print(f"\n=== Content from {url} ===")
+    print(text)
+    print("=" * 80, flush=True)
+
 def main():
     parser = argparse.ArgumentParser(description='Fetch and extract text content from webpages.')
-    parser.add_argument('urls', nargs='+', help='URLs to process')
+    parser.add_argument('urls', nargs='+', help='URLs to process, or - to read them from stdin')
     parser.add_argument('--max-concurrent', type=int, default=5,
-                       help='Maximum number of concurrent browser instances (default: 5)')
+                       help='Maximum number of pages open at once (default: 5)')
+    parser.add_argument('--stream', action='store_true',
+                       help='Print each page as soon as it is done instead of in input order')
+    parser.add_argument('--browser-only', action='store_true',
+                       help='Always render pages in the browser instead of trying a plain HTTP GET first')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                       help=f'Directory of the page cache (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--cache-ttl', type=float, default=3600,
+                       help='Seconds a cached page is used without revalidation (default: 3600)')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Neither read nor write the page cache')
+    add_readiness_arguments(parser)
+    add_blocking_arguments(parser, TEXT_PROFILE)
     parser.add_argument('--debug', action='store_true',
                        help='Enable debug logging')
     
@@ -175,33 +933,43 @@ def main():
     if args.debug:
         logger.setLevel(logging.DEBUG)
     
-    # Validate URLs
-    valid_urls = []
-    for url in args.urls:
-        if validate_url(url):
-            valid_urls.append(url)
-        else:
-            logger.error(f"Invalid URL: {url}")
-    
-    if not valid_urls:
-        logger.error("No valid URLs provided")
-        sys.exit(1)
+    # Validate URLs, lazily when streaming from stdin
+    url_lines = sys.stdin if args.urls == ['-'] else args.urls
+    if args.stream and url_lines is sys.stdin:
+        valid_urls = iter_valid_urls(url_lines)
+    else:
+        valid_urls = list(iter_valid_urls(url_lines))
+        if not valid_urls:
+            logger.error("No valid URLs provided")
+            sys.exit(1)
     
+    options = {
+        'max_concurrent': args.max_concurrent,
+        'http_first': not args.browser_only,
+        'cache': None if args.no_cache else PageCache(args.cache_dir, ttl=args.cache_ttl),
+        'readiness': policy_from_args(args),
+        'blocking': profile_from_args(args, TEXT_PROFILE),
+    }
     start_time = time.time()
     try:
-        results = asyncio.run(process_urls(valid_urls, args.max_concurrent))
-        
-        # Print results to stdout
-        for url, text in zip(valid_urls, results):
-            print(f"\n=== Content from {url} ===")
-            print(text)
-            print("=" * 80)
+        # Everything runs on the background loop the shared clients are bound to
+        if args.stream:
+            for url, text in iter_sync(iter_urls(valid_urls, **options)):
+                print_result(url, text)
+        else:
+            results = run_sync(process_urls(valid_urls, **options))
+            
+            # Print results to stdout
+            for url, text in zip(valid_urls, results):
+                print_result(url, text)
         
         logger.info(f"Total processing time: {time.time() - start_time:.2f}s")
         
     except Exception as e:
         logger.error(f"Error during execution: {str(e)}")
         sys.exit(1)
+    finally:
+        run_sync(_close_shared_clients())
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file